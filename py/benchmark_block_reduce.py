@@ -0,0 +1,70 @@
+"""This file benchmarks the vectorized block reduction against the original per-block loop."""
+import os
+import glob
+import time
+import rasterio
+import numpy as np
+from block_reduce import block_fraction
+
+
+def loop_shade_fraction(raster, block_size):
+    """The original nested-loop implementation of calculate_shade_fraction, kept as the baseline."""
+    rows, cols = raster.shape
+    blocks_y = rows // block_size
+    blocks_x = cols // block_size
+
+    fractions = np.zeros((blocks_y, blocks_x))
+
+    for i in range(blocks_y):
+        for j in range(blocks_x):
+            block = raster[i*block_size:(i+1)*block_size, j*block_size:(j+1)*block_size]
+            total_value = np.sum(block)
+            max_value = 255 * block_size * block_size
+            fractions[i, j] = total_value / max_value
+
+    return fractions
+
+
+def best_time(func, repeat):
+    """Return the fastest of `repeat` runs of func, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmark(input_directory, block_sizes, repeat=3):
+    tiff_files = sorted(glob.glob(os.path.join(input_directory, "*", "*.tiff")))
+    if not tiff_files:
+        print(f"No TIFF files found in {input_directory}")
+        return
+
+    rasters = []
+    for tiff_file in tiff_files:
+        with rasterio.open(tiff_file) as src:
+            rasters.append(src.read(1))
+    stack = np.stack(rasters)
+
+    print(f"Tiles: {len(rasters)} x {rasters[0].shape[0]}x{rasters[0].shape[1]} pixels")
+    print(f"{'block':>6} {'loop [s]':>10} {'vector [s]':>11} {'stack [s]':>10} {'speedup':>9}")
+
+    for block_size in block_sizes:
+        loop_time = best_time(lambda: [loop_shade_fraction(r, block_size) for r in rasters], repeat)
+        vector_time = best_time(lambda: [block_fraction(r, block_size) for r in rasters], repeat)
+        stack_time = best_time(lambda: block_fraction(stack, block_size), repeat)
+
+        # The vectorized kernel must reproduce the loop exactly
+        for raster in rasters:
+            assert np.array_equal(loop_shade_fraction(raster, block_size), block_fraction(raster, block_size))
+
+        print(f"{block_size:>6} {loop_time:>10.3f} {vector_time:>11.3f} {stack_time:>10.3f} "
+              f"{loop_time / vector_time:>8.1f}x")
+
+
+if __name__ == "__main__":
+    input_directory = "fusedata"  # Directory with one subdirectory of ShadeMap tiles per area
+    block_sizes = [2, 5, 10, 20, 50]
+    repeat = 1  # The loop baseline takes over a minute per run at block size 2
+    run_benchmark(input_directory, block_sizes, repeat)
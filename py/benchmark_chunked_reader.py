@@ -0,0 +1,76 @@
+"""This file measures peak memory of a full-band read versus the windowed reader on growing rasters."""
+import os
+import time
+import tempfile
+import multiprocessing
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from block_reduce import block_sums
+from chunked_reader import read_block_sums, peak_rss_mb
+
+
+def write_synthetic_tile(path, size, rows_per_chunk=1024):
+    """Write a size x size uint8 ShadeMap-like GeoTIFF without holding it in memory."""
+    profile = {
+        'driver': 'GTiff', 'dtype': 'uint8', 'count': 1, 'width': size, 'height': size,
+        'crs': 'EPSG:4326', 'transform': from_origin(77.0, 28.7, 8.585e-05, 7.538e-05),
+        'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+    }
+    rng = np.random.default_rng(0)
+    with rasterio.open(path, 'w', **profile) as dst:
+        for row_off in range(0, size, rows_per_chunk):
+            height = min(rows_per_chunk, size - row_off)
+            chunk = rng.choice(np.array([0, 255], dtype=np.uint8), size=(height, size))
+            dst.write(chunk, 1, window=rasterio.windows.Window(0, row_off, size, height))
+
+
+def _measure(path, block_size, chunked, queue):
+    # Runs in a fresh process so ru_maxrss only covers this one reduction.
+    # The GDAL block cache is capped so it does not hide the reader's own footprint.
+    with rasterio.Env(GDAL_CACHEMAX=64):
+        baseline = peak_rss_mb()
+        start = time.perf_counter()
+        with rasterio.open(path) as src:
+            if chunked:
+                sums, counts = read_block_sums(src, block_size)
+            else:
+                sums, counts = block_sums(src.read(1), block_size)
+        elapsed = time.perf_counter() - start
+    output_mb = (sums.nbytes + counts.nbytes) / (1024 * 1024)
+    queue.put((elapsed, peak_rss_mb() - baseline, output_mb))
+
+
+def measure(path, block_size, chunked):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(path, block_size, chunked, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def run_benchmark(sizes, block_size=5):
+    """Print time and peak RSS above the interpreter baseline for both readers.
+
+    The block grid itself (sums + counts) necessarily grows with the raster; the last column
+    is the chunked peak minus that grid, i.e. the reader's working memory, which stays flat.
+    """
+    print(f"{'pixels':>14} {'full [s]':>9} {'full peak MB':>13} {'chunked [s]':>12} {'chunked peak MB':>16} "
+          f"{'grid MB':>8} {'working MB':>11}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            path = os.path.join(tmp_dir, f"synthetic_{size}.tiff")
+            write_synthetic_tile(path, size)
+            full_time, full_peak, _ = measure(path, block_size, chunked=False)
+            chunked_time, chunked_peak, grid_mb = measure(path, block_size, chunked=True)
+            os.remove(path)
+            print(f"{size:>6}x{size:<7} {full_time:>9.2f} {full_peak:>13.1f} {chunked_time:>12.2f} {chunked_peak:>16.1f} "
+                  f"{grid_mb:>8.1f} {max(chunked_peak - grid_mb, 0):>11.1f}")
+
+
+if __name__ == "__main__":
+    sizes = [2048, 4096, 8192, 16384]  # Side length of the synthetic square rasters
+    block_size = 5
+    run_benchmark(sizes, block_size)
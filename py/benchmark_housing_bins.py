@@ -0,0 +1,78 @@
+"""This file benchmarks the row-by-row housing binning against the columnar H3 path on a synthetic CSV."""
+import os
+import time
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+from chunked_reader import peak_rss_mb
+import delhi_housing_prices
+
+
+def write_synthetic_listings(path, num_rows, chunk_rows=1000000):
+    """Write num_rows listings scattered over the Delhi metro area, in the columns of delhi.csv."""
+    rng = np.random.default_rng(0)
+    header = True
+    for start in range(0, num_rows, chunk_rows):
+        rows = min(chunk_rows, num_rows - start)
+        area = rng.uniform(400, 3000, rows).round()
+        price_sqft = rng.lognormal(np.log(5000), 0.4, rows)
+        chunk = pd.DataFrame({
+            'price': (area * price_sqft).round(),
+            'Address': 'Synthetic Listing, Delhi NCR',
+            'area': area,
+            'latitude': rng.normal(28.55, 0.1, rows).round(5),
+            'longitude': rng.normal(77.27, 0.17, rows).round(5),
+            'Bedrooms': rng.integers(1, 5, rows),
+            'type_of_building': 'Flat',
+            'Price_sqft': price_sqft,
+        })
+        chunk.to_csv(path, mode='w' if header else 'a', header=header, index_label='')
+        header = False
+
+
+def _run_rows(path):
+    data = delhi_housing_prices.parse_csv(path)
+    delhi_housing_prices.create_geojson(data)
+
+
+def _run_columnar(path):
+    listings = delhi_housing_prices.load_listings(path)
+    delhi_housing_prices.create_geojson_columnar(listings, [8])
+
+
+def _measure(target, path, queue):
+    # Runs in a fresh process so ru_maxrss only covers this one run
+    start = time.perf_counter()
+    target(path)
+    queue.put((time.perf_counter() - start, peak_rss_mb()))
+
+
+def measure(target, path):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(target, path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def run_benchmark(num_rows):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "synthetic_listings.csv")
+        write_synthetic_listings(path, num_rows)
+        print(f"Synthetic CSV: {num_rows} listings, {os.path.getsize(path) / 1e6:.0f} MB")
+
+        rows_time, rows_peak = measure(_run_rows, path)
+        columnar_time, columnar_peak = measure(_run_columnar, path)
+
+    print(f"\n{'path':<10} {'time [s]':>9} {'peak RSS MB':>12}")
+    print(f"{'rows':<10} {rows_time:>9.1f} {rows_peak:>12.0f}")
+    print(f"{'columnar':<10} {columnar_time:>9.1f} {columnar_peak:>12.0f}")
+    print(f"\nSpeedup: {rows_time / columnar_time:.1f}x, memory: {rows_peak / columnar_peak:.1f}x less")
+
+
+if __name__ == "__main__":
+    num_rows = 10000000  # The row-by-row path needs several GB of RAM at this size
+    run_benchmark(num_rows)
@@ -0,0 +1,34 @@
+"""This file compares feature count, output size and runtime of the raw LST polygonization with classified ones."""
+import time
+import json
+from convert_geotiff import geotiff_to_geojson
+
+
+def measure(filepath, pool_size, **options):
+    start = time.perf_counter()
+    geojson_output = geotiff_to_geojson(filepath, pool_size, **options)
+    elapsed = time.perf_counter() - start
+    num_features = len(json.loads(geojson_output)['features'])
+    return num_features, len(geojson_output.encode('utf-8')) / 1e6, elapsed
+
+
+def run_benchmark(filepath, pool_size, num_classes, simplify_tolerance):
+    variants = [('raw values', {})]
+    for method in ('equal_interval', 'quantile', 'jenks'):
+        variants.append((method, {'num_classes': num_classes, 'method': method}))
+        variants.append((f"{method} + simplify", {'num_classes': num_classes, 'method': method,
+                                                   'simplify_tolerance': simplify_tolerance}))
+
+    print(f"{filepath}, pool size {pool_size}, {num_classes} classes, simplify tolerance {simplify_tolerance}\n")
+    print(f"{'variant':<26} {'features':>9} {'size MB':>8} {'time [s]':>9}")
+    for name, options in variants:
+        num_features, size_mb, elapsed = measure(filepath, pool_size, **options)
+        print(f"{name:<26} {num_features:>9} {size_mb:>8.2f} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    filepath = "LST_Clipped.tif"
+    pool_size = 8  # temp_clustersize_8.json was made with 8x8 pooling
+    num_classes = 8
+    simplify_tolerance = 240  # metres, one pooled 240 m pixel
+    run_benchmark(filepath, pool_size, num_classes, simplify_tolerance)
@@ -0,0 +1,263 @@
+"""This file benchmarks every stage of the py/ pipeline on synthetic inputs and checks for regressions.
+
+Synthetic ShadeMap-like tiles (four overlapping quadrants x hours), an LST raster and a housing
+CSV are generated at a chosen scale. Each stage calls the production functions (process_geotiffs,
+mosaic_tiles, create_geojson, geotiff_to_geojson, the housing binning, the heatmap) and is timed on
+its own, keeping the best of a few runs, with the instrumentation stages inside them as substages.
+It is then run once more under tracemalloc for its peak allocation (NumPy buffers included; GDAL's
+own buffers are not).
+The results go into a JSON report that can be compared with the report of another commit.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from chunked_reader import peak_rss_mb
+from convert_geotiff import geotiff_to_geojson
+from benchmark_housing_bins import write_synthetic_listings
+import delhi_housing_prices
+import delhi_shade_fusedata_non_overlapping as shade_pipeline
+import visualize_geojson_html
+import instrumentation
+
+SCALES = {
+    'small': {'tile_size': 512, 'hours': 3, 'lst_size': 512, 'listings': 20000},
+    'medium': {'tile_size': 1024, 'hours': 9, 'lst_size': 1024, 'listings': 200000},
+    'large': {'tile_size': 2048, 'hours': 9, 'lst_size': 4096, 'listings': 2000000},
+}
+
+QUADRANTS = {'lower_left': (0, 1), 'lower_right': (1, 1), 'upper_left': (0, 0), 'upper_right': (1, 0)}
+SHADE_RESOLUTION = (8.585e-05, 7.538e-05)
+
+
+def smooth_noise(rng, size, feature_pixels):
+    """Blobby values in [0, 1): coarse noise upsampled with np.kron, like building and tree shadows."""
+    coarse = rng.random((-(-size // feature_pixels),) * 2)
+    return np.kron(coarse, np.ones((feature_pixels, feature_pixels)))[:size, :size]
+
+
+def write_shade_tiles(input_directory, tile_size, hours, seed=0):
+    """Write hourly uint8 shade tiles into four quadrant subdirectories that overlap by 10%."""
+    rng = np.random.default_rng(seed)
+    step = int(tile_size * 0.9)
+    for subdir, (col, row) in QUADRANTS.items():
+        os.makedirs(os.path.join(input_directory, subdir), exist_ok=True)
+        transform = from_origin(77.0 + col * step * SHADE_RESOLUTION[0], 28.7 - row * step * SHADE_RESOLUTION[1],
+                                *SHADE_RESOLUTION)
+        base = smooth_noise(rng, tile_size, 16)
+        for hour in range(hours):
+            # The shadows shift a little every hour
+            shade = np.roll(base, hour * 4, axis=1) > 0.6
+            path = os.path.join(input_directory, subdir, f"ShadeMap hour {hour:02d}.tiff")
+            with rasterio.open(path, 'w', driver='GTiff', dtype='uint8', count=1, width=tile_size, height=tile_size,
+                               crs='EPSG:4326', transform=transform) as dst:
+                dst.write(np.where(shade, 0, 255).astype(np.uint8), 1)
+
+
+def write_lst_raster(path, size, seed=0):
+    """Write a float32 UTM LST raster with a nodata border, like LST_Clipped.tif."""
+    rng = np.random.default_rng(seed)
+    lst = (24 + 8 * smooth_noise(rng, size, 32) + rng.normal(0, 0.3, (size, size))).astype(np.float32)
+    nodata = np.float32(-3.4028234663852886e+38)
+    border = max(size // 50, 1)
+    lst[:border] = nodata
+    lst[:, -border:] = nodata
+    with rasterio.open(path, 'w', driver='GTiff', dtype='float32', count=1, width=size, height=size,
+                       crs='EPSG:32643', transform=from_origin(689505.0, 3188145.0, 30.0, 30.0),
+                       nodata=float(nodata)) as dst:
+        dst.write(lst, 1)
+
+
+def generate_inputs(data_directory, scale):
+    write_shade_tiles(os.path.join(data_directory, 'fusedata'), scale['tile_size'], scale['hours'])
+    write_lst_raster(os.path.join(data_directory, 'lst.tif'), scale['lst_size'])
+    write_synthetic_listings(os.path.join(data_directory, 'listings.csv'), scale['listings'])
+
+
+# Every stage takes the shared context dict, reads what earlier stages left in it and adds its output
+
+def stage_shade_reduce(ctx):
+    # Reads, reduces and averages the hourly tiles exactly as the shade script does
+    fractions, counts, transforms, crss, _ = shade_pipeline.process_geotiffs(
+        os.path.join(ctx['data_directory'], 'fusedata'), ctx['block_size'],
+        output_directory=os.path.join(ctx['output_directory'], 'histograms'))
+    ctx['avg_fractions'], ctx['counts'], ctx['transforms'], ctx['crss'] = fractions, counts, transforms, crss
+
+
+def stage_shade_mosaic(ctx):
+    ctx['mosaic'] = shade_pipeline.mosaic_tiles(ctx['avg_fractions'], ctx['transforms'], ctx['crss'],
+                                                ctx['block_size'], ctx['counts'])
+
+
+def stage_shade_serialize(ctx):
+    fractions, transform, crs = ctx['mosaic']
+    ctx['shade_json'] = os.path.join(ctx['output_directory'], 'average_shade.json')
+    shade_pipeline.create_geojson(fractions, transform, crs, 1, ctx['shade_json'])
+
+
+def stage_lst(ctx):
+    # Pool, polygonize, reproject and serialize; the split comes from the lst.* instrumentation stages
+    ctx['lst_json'] = geotiff_to_geojson(os.path.join(ctx['data_directory'], 'lst.tif'), ctx['pool_size'])
+
+
+def stage_housing_bin(ctx):
+    listings = delhi_housing_prices.load_listings(os.path.join(ctx['data_directory'], 'listings.csv'))
+    ctx['housing'] = delhi_housing_prices.create_geojson_columnar(listings, [8])
+
+
+def stage_housing_serialize(ctx):
+    with open(os.path.join(ctx['output_directory'], 'housing.geojson'), 'w', encoding='utf-8') as f:
+        json.dump(ctx['housing'][8], f, ensure_ascii=False, indent=2)
+
+
+def stage_render(ctx):
+    visualize_geojson_html.plot_multi_sector_heatmap(ctx['output_directory'],
+                                                     os.path.join(ctx['output_directory'], 'heatmap.html'))
+
+
+STAGES = [
+    ('shade.reduce', stage_shade_reduce),
+    ('shade.mosaic', stage_shade_mosaic),
+    ('shade.serialize', stage_shade_serialize),
+    ('lst', stage_lst),
+    ('housing.bin', stage_housing_bin),
+    ('housing.serialize', stage_housing_serialize),
+    ('render', stage_render),
+]
+
+
+def _stage_seconds(events_file):
+    """Total seconds per instrumentation stage name in one events file."""
+    seconds = {}
+    for record in instrumentation.read_events(events_file):
+        if record['type'] == 'stage':
+            seconds[record['name']] = seconds.get(record['name'], 0.0) + record['seconds']
+    return seconds
+
+
+def run_stages(ctx, repeat):
+    """Best wall time of each stage over repeat runs, then one traced run for its peak allocation.
+
+    The instrumentation stages inside the pipeline functions (e.g. lst.pool, lst.polygonize) are
+    recorded during the timed runs and reported as substages, again the best of the runs.
+    """
+    events_file = os.path.join(ctx['output_directory'], 'benchmark_events.jsonl')
+    results = {}
+    for name, stage in STAGES:
+        times = []
+        substages = {}
+        for _ in range(repeat):
+            instrumentation.enable(events_file)
+            start = time.perf_counter()
+            stage(ctx)
+            times.append(time.perf_counter() - start)
+            instrumentation.disable()
+            for substage, seconds in _stage_seconds(events_file).items():
+                substages[substage] = min(seconds, substages.get(substage, seconds))
+
+        tracemalloc.start()
+        stage(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {'seconds': min(times), 'peak_mb': peak / (1024 * 1024), 'substages': substages}
+        print(f"{name:<18} {min(times):>9.3f} s {peak / (1024 * 1024):>9.1f} MB")
+        for substage, seconds in sorted(substages.items(), key=lambda item: -item[1]):
+            print(f"  {substage:<22} {seconds:>7.3f} s")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scale_name, report_file, repeat=3, block_size=10, pool_size=5):
+    scale = SCALES[scale_name]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_directory = os.path.join(tmp_dir, 'data')
+        output_directory = os.path.join(tmp_dir, 'output')
+        os.makedirs(output_directory)
+        print(f"Generating '{scale_name}' inputs: {scale}")
+        generate_inputs(data_directory, scale)
+
+        ctx = {'data_directory': data_directory, 'output_directory': output_directory,
+               'block_size': block_size, 'pool_size': pool_size}
+        print(f"\n{'stage':<18} {'best time':>11} {'peak alloc':>12}")
+        stages = run_stages(ctx, repeat)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scale': scale_name,
+        'scale_parameters': scale,
+        'block_size': block_size,
+        'pool_size': pool_size,
+        'repeat': repeat,
+        'total_seconds': sum(stage['seconds'] for stage in stages.values()),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stages,
+    }
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nTotal: {report['total_seconds']:.2f} s, peak RSS {report['peak_rss_mb']:.0f} MB. "
+          f"Report written to {report_file}")
+    return report
+
+
+def compare_reports(baseline, current, time_threshold=0.25, memory_threshold=0.25, min_seconds=0.02):
+    """Return the stages that got slower or hungrier than the thresholds allow (relative increase).
+
+    Stages faster than min_seconds in both reports are too noisy for the time check.
+    """
+    if baseline.get('scale') != current.get('scale'):
+        raise ValueError(f"Cannot compare a '{baseline.get('scale')}' report with a '{current.get('scale')}' report")
+
+    regressions = []
+    for name, stage in current['stages'].items():
+        before = baseline['stages'].get(name)
+        if before is None:
+            continue
+        if max(before['seconds'], stage['seconds']) >= min_seconds and \
+                stage['seconds'] > before['seconds'] * (1 + time_threshold):
+            regressions.append(f"{name}: {before['seconds']:.3f} s -> {stage['seconds']:.3f} s")
+        if stage['peak_mb'] > before['peak_mb'] * (1 + memory_threshold) and stage['peak_mb'] - before['peak_mb'] > 1:
+            regressions.append(f"{name}: {before['peak_mb']:.1f} MB -> {stage['peak_mb']:.1f} MB")
+        for substage, seconds in stage.get('substages', {}).items():
+            seconds_before = before.get('substages', {}).get(substage)
+            if seconds_before is not None and max(seconds_before, seconds) >= min_seconds and \
+                    seconds > seconds_before * (1 + time_threshold):
+                regressions.append(f"{name}/{substage}: {seconds_before:.3f} s -> {seconds:.3f} s")
+    return regressions
+
+
+if __name__ == "__main__":
+    scale = "small"  # One of SCALES: small, medium, large
+    report_file = "benchmark_report.json"
+    baseline_file = None  # Set to the report of an earlier commit to check for regressions
+    time_threshold = 0.25  # Fail if a stage is more than 25% slower than the baseline
+    memory_threshold = 0.25  # Fail if a stage allocates more than 25% more at its peak
+
+    report = run_benchmark(scale, report_file)
+
+    if baseline_file is not None:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, time_threshold, memory_threshold)
+        if regressions:
+            print(f"\nRegressions against {baseline_file} ({baseline.get('commit')}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {baseline_file} ({baseline.get('commit')})")
@@ -0,0 +1,69 @@
+"""This file measures how block-parallel pooling scales with the number of threads on a large synthetic raster.
+
+The synthetic raster is a tiled, deflate-compressed float32 GeoTIFF with a smooth temperature-like
+field, noise and nodata holes, written window by window so it never has to fit in memory.
+"""
+import os
+import time
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from chunked_reader import peak_rss_mb
+from raster_pooling import pool_raster, write_cog
+
+NODATA = -9999.0
+
+
+def make_synthetic_raster(output_file, size, tile_size=4096, seed=0):
+    """Write a size x size float32 GeoTIFF, one tile_size strip at a time."""
+    rng = np.random.default_rng(seed)
+    profile = {
+        'driver': 'GTiff', 'width': size, 'height': size, 'count': 1, 'dtype': 'float32',
+        'crs': 'EPSG:32643', 'transform': from_origin(689505, 3188145, 30, 30), 'nodata': NODATA,
+        'tiled': True, 'blockxsize': 512, 'blockysize': 512, 'compress': 'deflate', 'predictor': 3,
+        'BIGTIFF': 'YES',
+    }
+    cols = np.arange(size, dtype=np.float32)
+    with rasterio.open(output_file, 'w', **profile) as dst:
+        for row_off in range(0, size, tile_size):
+            rows = np.arange(row_off, min(row_off + tile_size, size), dtype=np.float32)[:, None]
+            strip = 28 + 4 * np.sin(rows / 1500) * np.cos(cols / 2100)
+            strip += rng.normal(0, 0.5, strip.shape).astype(np.float32)
+            # Nodata holes, like the clipped edges and clouds of the LST raster
+            strip[rng.random(strip.shape) < 0.02] = NODATA
+            strip[:, :size // 50] = NODATA
+            dst.write(strip.astype(np.float32), 1, window=Window(0, row_off, size, len(rows)))
+
+
+def run_benchmark(size, pool_size, method, thread_counts, raster_file):
+    if not os.path.exists(raster_file):
+        start = time.perf_counter()
+        make_synthetic_raster(raster_file, size)
+        print(f"Wrote {size}x{size} synthetic raster in {time.perf_counter() - start:.0f} s "
+              f"({os.path.getsize(raster_file) / 1e9:.1f} GB on disk, {size * size * 4 / 1e9:.1f} GB decoded)")
+
+    print(f"\n{method} pooling {pool_size}x{pool_size}, cpu_count {os.cpu_count()}")
+    print(f"{'threads':>7} {'seconds':>8} {'speedup':>8} {'peak RSS MB':>12}")
+    baseline = None
+    for workers in thread_counts:
+        start = time.perf_counter()
+        pooled, transform, crs, nodata = pool_raster(raster_file, pool_size, method, workers=workers)
+        seconds = time.perf_counter() - start
+        baseline = baseline or seconds
+        print(f"{workers:>7} {seconds:>8.1f} {baseline / seconds:>8.2f} {peak_rss_mb():>12.0f}")
+
+    start = time.perf_counter()
+    cog_file = os.path.splitext(raster_file)[0] + f"_{method}_{pool_size}.tif"
+    write_cog(pooled, transform, crs, cog_file, nodata)
+    print(f"\nPooled raster {pooled.shape[0]}x{pooled.shape[1]} written as a COG in "
+          f"{time.perf_counter() - start:.1f} s: {cog_file}")
+
+
+if __name__ == "__main__":
+    size = 40000  # 40k x 40k float32 is 6.4 GB decoded, more than fits in memory on most laptops
+    pool_size = 8
+    method = "mean"  # "mean", "median" or "max"
+    thread_counts = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    raster_file = f"synthetic_{size}.tif"
+    run_benchmark(size, pool_size, method, thread_counts, raster_file)
@@ -0,0 +1,118 @@
+"""This file load-tests the shade query service with concurrent keep-alive clients and reports p50/p99 latency."""
+import json
+import time
+import socket
+import asyncio
+import multiprocessing
+import numpy as np
+from urllib.parse import urlencode
+import shade_query_service
+
+
+def _serve(input_directory, block_size, host, port):
+    shade_query_service.main(input_directory, block_size, host, port)
+
+
+def wait_for_port(host, port, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"Query service did not come up on {host}:{port}")
+
+
+async def fetch(reader, writer, path, params=None):
+    """Send one GET on an open connection; returns (status, payload)."""
+    target = f"{path}?{urlencode(params)}" if params else path
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('latin-1'))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+def random_query(rng, bounds):
+    """A point, bbox or top-k query somewhere inside the grid bounds."""
+    west, south, east, north = bounds
+    lon = rng.uniform(west, east)
+    lat = rng.uniform(south, north)
+    kind = rng.choice(['point', 'bbox', 'topk'])
+    if kind == 'point':
+        return '/point', {'lon': lon, 'lat': lat}
+    if kind == 'bbox':
+        half = rng.uniform(0.001, 0.005)  # roughly 100-500 m boxes
+        return '/bbox', {'west': lon - half, 'south': lat - half, 'east': lon + half, 'north': lat + half}
+    return '/topk', {'lon': lon, 'lat': lat, 'radius': 500, 'k': 10}
+
+
+async def client(host, port, bounds, num_requests, seed, latencies):
+    rng = np.random.default_rng(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(num_requests):
+            path, params = random_query(rng, bounds)
+            start = time.perf_counter()
+            status, _ = await fetch(reader, writer, path, params)
+            latencies.setdefault(path, []).append(time.perf_counter() - start)
+            if status not in (200, 404):
+                raise RuntimeError(f"{path} returned {status}")
+    finally:
+        writer.close()
+
+
+async def load_test(host, port, concurrency, requests_per_client):
+    reader, writer = await asyncio.open_connection(host, port)
+    _, info = await fetch(reader, writer, '/info')
+    writer.close()
+
+    latencies = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, info['bounds'], requests_per_client, seed, latencies)
+                           for seed in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def print_latencies(latencies, elapsed):
+    print(f"\n{'endpoint':<8} {'requests':>9} {'p50 [ms]':>9} {'p99 [ms]':>9}")
+    all_latencies = []
+    for path in sorted(latencies):
+        values = np.array(latencies[path]) * 1000
+        all_latencies.append(values)
+        print(f"{path:<8} {len(values):>9} {np.percentile(values, 50):>9.2f} {np.percentile(values, 99):>9.2f}")
+    values = np.concatenate(all_latencies)
+    print(f"{'all':<8} {len(values):>9} {np.percentile(values, 50):>9.2f} {np.percentile(values, 99):>9.2f}")
+    print(f"\nThroughput: {len(values) / elapsed:.0f} requests/s")
+
+
+def run_benchmark(input_directory, block_size, concurrency_levels, requests_per_client, host='127.0.0.1', port=8765):
+    context = multiprocessing.get_context('spawn')
+    server = context.Process(target=_serve, args=(input_directory, block_size, host, port), daemon=True)
+    server.start()
+    try:
+        wait_for_port(host, port)
+        for concurrency in concurrency_levels:
+            print(f"\nConcurrency {concurrency}, {requests_per_client} requests per client:")
+            latencies, elapsed = asyncio.run(load_test(host, port, concurrency, requests_per_client))
+            print_latencies(latencies, elapsed)
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    input_directory = "fusedata"
+    block_size = 10
+    concurrency_levels = [1, 16, 64]  # Number of simultaneous keep-alive clients
+    requests_per_client = 200
+    run_benchmark(input_directory, block_size, concurrency_levels, requests_per_client)
@@ -0,0 +1,79 @@
+"""This file benchmarks building the shade routing graph and answering queries on a city-sized synthetic grid."""
+import time
+import numpy as np
+from affine import Affine
+from shade_query_service import ShadeGridIndex
+from shade_routing import ShadeRouter
+from chunked_reader import peak_rss_mb
+from benchmark_pipeline import smooth_noise
+
+
+def synthetic_city_grid(size, seed=0):
+    """size x size shade fractions: tree canopies and building shadows, with 5% of cells without data."""
+    rng = np.random.default_rng(seed)
+    shade = 0.6 * smooth_noise(rng, size, 40) + 0.4 * smooth_noise(rng, size, 4)
+    shade[smooth_noise(rng, size, 3) > 0.95] = np.nan
+    return shade
+
+
+def time_queries(query, points, repeat_label):
+    latencies = []
+    found = 0
+    for point in points:
+        start = time.perf_counter()
+        result = query(*point)
+        latencies.append(time.perf_counter() - start)
+        found += result is not None
+    latencies = np.array(latencies) * 1000
+    print(f"{repeat_label:<34} p50 {np.percentile(latencies, 50):>8.1f} ms  p99 {np.percentile(latencies, 99):>8.1f} ms"
+          f"  ({found}/{len(points)} found)")
+
+
+def run_benchmark(size, cell_size, num_queries, trip_length, min_shade, seed=0):
+    grid = synthetic_city_grid(size, seed)
+    # Delhi in UTM zone 43N, cell_size metres per cell
+    transform = Affine(cell_size, 0, 689505, 0, -cell_size, 3188145)
+
+    start = time.perf_counter()
+    index = ShadeGridIndex(grid, transform, 'EPSG:32643')
+    index_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    router = ShadeRouter(index)
+    build_seconds = time.perf_counter() - start
+    print(f"{size}x{size} grid of {cell_size} m cells ({size * cell_size / 1000:.0f} km across): "
+          f"{len(router.cells)} nodes, {len(router.indices)} edges")
+    print(f"Grid index {index_seconds:.1f} s, CSR graph {build_seconds:.1f} s, "
+          f"{router.nbytes / 1e6:.0f} MB, peak RSS {peak_rss_mb():.0f} MB\n")
+
+    rng = np.random.default_rng(seed + 1)
+    valid = np.argwhere(~np.isnan(grid))
+    starts = valid[rng.integers(len(valid), size=num_queries)]
+    angles = rng.uniform(0, 2 * np.pi, num_queries)
+    steps = trip_length / cell_size
+    ends = np.clip(starts + np.column_stack([np.sin(angles), np.cos(angles)]) * steps, 0, size - 1).astype(int)
+
+    def lonlat(row, col):
+        return float(index.lon[row, col]), float(index.lat[row, col])
+
+    pairs = [lonlat(*a) + lonlat(*b) for a, b in zip(starts, ends)]
+    time_queries(router.shadiest_path, pairs, f"shadiest path, {trip_length / 1000:.0f} km trips (A*)")
+
+    def dijkstra_path(start_lon, start_lat, end_lon, end_lat):
+        source, goal = router.node(start_lon, start_lat), router.node(end_lon, end_lat)
+        if source is None or goal is None:
+            return None
+        return router._search(source, lambda node: node == goal)
+    time_queries(dijkstra_path, pairs, "same trips, plain Dijkstra")
+
+    points = [lonlat(*start) for start in starts]
+    time_queries(lambda lon, lat: router.nearest_shade(lon, lat, min_shade), points,
+                 f"nearest cell with shade >= {min_shade}")
+
+
+if __name__ == "__main__":
+    size = 2000  # 4 million cells
+    cell_size = 10  # metres, a 20 km x 20 km city grid
+    num_queries = 50
+    trip_length = 2000  # metres between start and end of a shadiest path query
+    min_shade = 0.8
+    run_benchmark(size, cell_size, num_queries, trip_length, min_shade)
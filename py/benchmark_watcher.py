@@ -0,0 +1,68 @@
+"""This file measures the drop-to-output latency of the shade watcher against re-running the batch.
+
+A copy of the tile directories starts with only the first hours of every area; the remaining
+tiles are then dropped in one at a time while the watcher runs.
+"""
+import os
+import glob
+import time
+import shutil
+import tempfile
+import threading
+import numpy as np
+from shade_watcher import ShadeWatcher
+from reduction_cache import ReductionCache
+from delhi_shade_fusedata_non_overlapping import process_geotiffs, mosaic_tiles, create_geojson
+
+
+def time_batch(input_directory, block_size, output_file):
+    start = time.perf_counter()
+    avg_fractions, counts, transforms, crss, _ = process_geotiffs(input_directory, block_size,
+                                                                  output_directory=tempfile.mkdtemp())
+    fractions, transform, crs = mosaic_tiles(avg_fractions, transforms, crss, block_size, counts)
+    create_geojson(fractions, transform, crs, 1, output_file)
+    return time.perf_counter() - start
+
+
+def run_benchmark(input_directory, block_size, initial_hours, drop_interval, poll_interval):
+    work_directory = tempfile.mkdtemp(prefix='shade_watch_')
+    watch_directory = os.path.join(work_directory, 'input')
+    held_back = []
+    for area in sorted(os.listdir(input_directory)):
+        tiff_files = sorted(glob.glob(os.path.join(input_directory, area, "*.tiff")))
+        os.makedirs(os.path.join(watch_directory, area))
+        for tiff_file in tiff_files[:initial_hours]:
+            shutil.copy(tiff_file, os.path.join(watch_directory, area))
+        held_back += [(area, tiff_file) for tiff_file in tiff_files[initial_hours:]]
+
+    # A cache of its own, so the dropped tiles are really decoded
+    cache = ReductionCache(os.path.join(work_directory, 'cache'))
+    time.sleep(1)  # Let the copies settle, so the watcher treats them as existing tiles
+    watcher = ShadeWatcher(watch_directory, os.path.join(work_directory, 'output'), block_size, cache=cache)
+    watcher.poll()  # Catch up on the tiles that are already there
+
+    duration = len(held_back) * drop_interval + 3
+    thread = threading.Thread(target=watcher.run, args=(poll_interval, duration))
+    thread.start()
+    for area, tiff_file in held_back:
+        shutil.copy(tiff_file, os.path.join(watch_directory, area))
+        time.sleep(drop_interval)
+    thread.join()
+
+    batch_seconds = time_batch(input_directory, block_size, os.path.join(work_directory, 'batch.json'))
+    latencies = np.array(watcher.latencies)
+    print(f"\nBlock size {block_size}, {len(held_back)} tiles dropped every {drop_interval} s, "
+          f"polling every {poll_interval} s")
+    print(f"Watcher latency: p50 {np.percentile(latencies, 50):.2f} s, "
+          f"p90 {np.percentile(latencies, 90):.2f} s, max {latencies.max():.2f} s")
+    print(f"Full batch re-run (process_geotiffs + mosaic + GeoJSON): {batch_seconds:.2f} s")
+    shutil.rmtree(work_directory)
+
+
+if __name__ == "__main__":
+    input_directory = "fusedata"
+    block_size = 10
+    initial_hours = 6  # Hours per area that are there when the watcher starts
+    drop_interval = 2.0  # seconds between dropped tiles
+    poll_interval = 0.5
+    run_benchmark(input_directory, block_size, initial_hours, drop_interval, poll_interval)
@@ -0,0 +1,59 @@
+"""This file offers a multi-resolution block pyramid built by successively summing 2x2 children.
+
+Every level stores per-block sums and valid-pixel counts rather than means, so a parent block is
+exactly the sum of its children and the mean at any level is sums / counts. Ragged edges are kept
+as partial blocks with smaller counts.
+"""
+import numpy as np
+from affine import Affine
+from block_reduce import block_sums
+
+
+def build_pyramid(sums, counts, num_levels):
+    """Return [(sums, counts), ...] with level i covering 2**i base blocks per side.
+
+    Stops early once a level is a single block.
+    """
+    levels = [(np.asarray(sums, dtype=np.float64), np.asarray(counts, dtype=np.int64))]
+    for _ in range(1, num_levels):
+        level_sums, level_counts = levels[-1]
+        if level_sums.shape[-2] == 1 and level_sums.shape[-1] == 1:
+            break
+        parent_sums, _ = block_sums(level_sums, 2, keep_ragged=True)
+        parent_counts, _ = block_sums(level_counts, 2, keep_ragged=True)
+        levels.append((parent_sums, parent_counts))
+    return levels
+
+
+def pyramid_block_sizes(base_block_size, num_levels):
+    """Block size in pixels of every pyramid level, e.g. 1 -> [1, 2, 4, ..., 64]."""
+    return [base_block_size * 2 ** level for level in range(num_levels)]
+
+
+def save_pyramid(output_file, level_grids, crs):
+    """Save {block_size: (grid, transform)} into one .npz so every level can be loaded on its own."""
+    arrays = {'crs': np.array(crs.to_wkt() if crs is not None else '')}
+    for block_size, (grid, transform) in level_grids.items():
+        arrays[f"grid_bs{block_size}"] = grid
+        arrays[f"transform_bs{block_size}"] = np.array(tuple(transform)[:6])
+    np.savez_compressed(output_file, **arrays)
+
+
+def _level_block_sizes(data):
+    return sorted(int(name[len("grid_bs"):]) for name in data.files if name.startswith("grid_bs"))
+
+
+def load_pyramid_level(pyramid_file, block_size):
+    """Load the (grid, transform, crs_wkt) of one level saved by save_pyramid."""
+    with np.load(pyramid_file) as data:
+        key = f"grid_bs{block_size}"
+        if key not in data:
+            raise KeyError(f"No level with block size {block_size} in {pyramid_file}, "
+                           f"available: {_level_block_sizes(data)}")
+        return data[key], Affine(*data[f"transform_bs{block_size}"]), str(data['crs'])
+
+
+def pyramid_levels(pyramid_file):
+    """Block sizes of the levels stored in a pyramid file."""
+    with np.load(pyramid_file) as data:
+        return _level_block_sizes(data)
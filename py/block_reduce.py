@@ -0,0 +1,139 @@
+"""This file offers vectorized per-block reductions (sum, mean, max, median, fraction) over rasters.
+
+A raster of shape (..., rows, cols) is reshaped into (..., blocks_y, block_size, blocks_x, block_size)
+and reduced over the two block axes in one NumPy pass, so a single band and a stack of bands
+(e.g. hours x rows x cols) go through the same kernel.
+"""
+import numpy as np
+
+
+def valid_mask(data, nodata=None):
+    """Return a boolean mask of usable pixels, or None if every pixel is usable."""
+    invalid = None
+    if np.issubdtype(data.dtype, np.floating):
+        invalid = ~np.isfinite(data)
+    if nodata is not None and not (isinstance(nodata, float) and np.isnan(nodata)):
+        invalid = (data == nodata) if invalid is None else (invalid | (data == nodata))
+    if invalid is None or not invalid.any():
+        return None
+    return ~invalid
+
+
+def _accumulator_dtype(dtype):
+    """Integer rasters are summed exactly in int64, everything else in float64."""
+    if np.issubdtype(dtype, np.integer) or np.issubdtype(dtype, np.bool_):
+        return np.int64
+    return np.float64
+
+
+def _fit_to_blocks(data, block_size, keep_ragged, fill):
+    """Trim (or pad) the last two axes of data to a whole number of blocks."""
+    rows, cols = data.shape[-2:]
+    if keep_ragged:
+        pad_y = -rows % block_size
+        pad_x = -cols % block_size
+        if pad_y or pad_x:
+            pad = [(0, 0)] * (data.ndim - 2) + [(0, pad_y), (0, pad_x)]
+            data = np.pad(data, pad, constant_values=fill)
+        return data
+    return data[..., :rows // block_size * block_size, :cols // block_size * block_size]
+
+
+def block_view(data, block_size):
+    """Reshape (..., rows, cols) into (..., blocks_y, block_size, blocks_x, block_size).
+
+    The last two axes must already be a multiple of block_size (see _fit_to_blocks).
+    """
+    rows, cols = data.shape[-2:]
+    return data.reshape(data.shape[:-2] + (rows // block_size, block_size, cols // block_size, block_size))
+
+
+def block_sums(data, block_size, nodata=None, mask=None, keep_ragged=False):
+    """Sum the valid pixels of each block and count them.
+
+    mask is an optional boolean array (True = valid) combined with the nodata/NaN mask.
+    With keep_ragged=False the partial blocks at the bottom/right edge are dropped (as the
+    original per-block loops did); with keep_ragged=True they are kept and their counts
+    reflect the smaller number of pixels.
+
+    Returns (sums, counts) with shape (..., blocks_y, blocks_x).
+    """
+    data = np.asarray(data)
+    acc_dtype = _accumulator_dtype(data.dtype)
+
+    valid = valid_mask(data, nodata)
+    if mask is not None:
+        valid = mask if valid is None else (valid & mask)
+
+    if valid is None and not keep_ragged:
+        # Fast path: every block is full and every pixel counts
+        blocks = block_view(_fit_to_blocks(data, block_size, False, 0), block_size)
+        sums = blocks.sum(axis=(-3, -1), dtype=acc_dtype)
+        counts = np.full(sums.shape, block_size * block_size, dtype=np.int64)
+        return sums, counts
+
+    if valid is None:
+        valid = np.ones(data.shape, dtype=bool)
+    else:
+        data = np.where(valid, data, 0)
+
+    blocks = block_view(_fit_to_blocks(data, block_size, keep_ragged, 0), block_size)
+    valid_blocks = block_view(_fit_to_blocks(valid, block_size, keep_ragged, False), block_size)
+
+    sums = blocks.sum(axis=(-3, -1), dtype=acc_dtype)
+    counts = valid_blocks.sum(axis=(-3, -1), dtype=np.int64)
+    return sums, counts
+
+
+def block_mean(data, block_size, nodata=None, mask=None, keep_ragged=False):
+    """Mean of the valid pixels of each block; blocks without valid pixels are NaN."""
+    sums, counts = block_sums(data, block_size, nodata=nodata, mask=mask, keep_ragged=keep_ragged)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _valid_blocks(data, block_size, nodata, mask, keep_ragged):
+    """Float block view of data with invalid and padding pixels set to NaN, plus the per-block counts."""
+    data = np.asarray(data, dtype=np.float64)
+    valid = valid_mask(data, nodata)
+    if mask is not None:
+        valid = mask if valid is None else (valid & mask)
+    if valid is not None:
+        data = np.where(valid, data, np.nan)
+    blocks = block_view(_fit_to_blocks(data, block_size, keep_ragged, np.nan), block_size)
+    counts = (~np.isnan(blocks)).sum(axis=(-3, -1))
+    return blocks, counts
+
+
+def block_max(data, block_size, nodata=None, mask=None, keep_ragged=False):
+    """Maximum of the valid pixels of each block; blocks without valid pixels are NaN."""
+    blocks, counts = _valid_blocks(data, block_size, nodata, mask, keep_ragged)
+    maxima = np.fmax.reduce(np.fmax.reduce(blocks, axis=-1), axis=-2)
+    return np.where(counts > 0, maxima, np.nan)
+
+
+def block_median(data, block_size, nodata=None, mask=None, keep_ragged=False):
+    """Median of the valid pixels of each block; blocks without valid pixels are NaN."""
+    blocks, counts = _valid_blocks(data, block_size, nodata, mask, keep_ragged)
+    # (..., blocks_y, blocks_x, block_size * block_size), so nanmedian runs over one axis
+    pixels = np.moveaxis(blocks, -3, -2).reshape(counts.shape + (block_size * block_size,))
+    if (counts > 0).all():
+        return np.nanmedian(pixels, axis=-1)
+    medians = np.full(counts.shape, np.nan)
+    medians[counts > 0] = np.nanmedian(pixels[counts > 0], axis=-1)
+    return medians
+
+
+def fraction_from_sums(sums, counts, max_value=255):
+    """Fraction of the maximum possible value from per-block sums and counts; NaN where counts is 0."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / (max_value * counts), np.nan)
+
+
+def block_fraction(data, block_size, max_value=255, nodata=None, mask=None, keep_ragged=False):
+    """Fraction of the maximum possible value reached by each block (0..1).
+
+    For ShadeMap tiles (0 = shade, 255 = sun) this is the unshaded fraction of each block.
+    """
+    sums, counts = block_sums(data, block_size, nodata=nodata, mask=mask, keep_ragged=keep_ragged)
+    return fraction_from_sums(sums, counts, max_value)
@@ -0,0 +1,79 @@
+"""This file offers block-aligned windowed reading, so rasters larger than RAM can be reduced chunk by chunk."""
+import sys
+import resource
+import numpy as np
+from rasterio.windows import Window
+from block_reduce import block_sums
+from instrumentation import count
+
+
+def block_windows(height, width, block_size, chunk_size=2048):
+    """Yield (window, block_row, block_col) covering a height x width raster.
+
+    Every window starts on a multiple of block_size, so no block straddles two windows, and
+    (block_row, block_col) is the position of the window's first block in the full block grid.
+    chunk_size is rounded down to a multiple of block_size (but never below one block).
+    """
+    step = max(chunk_size // block_size, 1) * block_size
+    for row_off in range(0, height, step):
+        for col_off in range(0, width, step):
+            window = Window(col_off, row_off, min(step, width - col_off), min(step, height - row_off))
+            yield window, row_off // block_size, col_off // block_size
+
+
+def _assemble_block_sums(height, width, read_chunk, block_size, nodata, keep_ragged, chunk_size):
+    """Reduce a height x width raster window by window; read_chunk(window) returns one chunk."""
+    if keep_ragged:
+        blocks_y = -(-height // block_size)
+        blocks_x = -(-width // block_size)
+    else:
+        blocks_y = height // block_size
+        blocks_x = width // block_size
+
+    sums = None
+    counts = np.zeros((blocks_y, blocks_x), dtype=np.int64)
+
+    for window, block_row, block_col in block_windows(height, width, block_size, chunk_size):
+        chunk = read_chunk(window)
+        chunk_sums, chunk_counts = block_sums(chunk, block_size, nodata=nodata, keep_ragged=keep_ragged)
+        if sums is None:
+            sums = np.zeros((blocks_y, blocks_x), dtype=chunk_sums.dtype)
+
+        rows, cols = chunk_sums.shape
+        sums[block_row:block_row + rows, block_col:block_col + cols] = chunk_sums
+        counts[block_row:block_row + rows, block_col:block_col + cols] = chunk_counts
+
+    return sums, counts
+
+
+def read_block_sums(src, block_size, band=1, nodata=None, keep_ragged=False, chunk_size=2048):
+    """Per-block sums and valid-pixel counts of one band, read window by window.
+
+    Gives the same result as block_sums(src.read(band), ...) while only one chunk of the
+    raster is decoded at a time, so peak memory is bounded by chunk_size instead of the
+    raster size.
+    """
+    def read_chunk(window):
+        chunk = src.read(band, window=window)
+        count('bytes_decoded', chunk.nbytes)
+        return chunk
+
+    return _assemble_block_sums(src.height, src.width, read_chunk, block_size, nodata, keep_ragged, chunk_size)
+
+
+def array_block_sums(array, block_size, nodata=None, keep_ragged=False, chunk_size=2048):
+    """Per-block sums and valid-pixel counts of a 2D array, chunk by chunk.
+
+    Meant for np.memmap arrays: only the pages of the current chunk are touched, and the
+    temporary masks stay chunk-sized instead of raster-sized.
+    """
+    height, width = array.shape
+    return _assemble_block_sums(height, width, lambda window: array[window.toslices()],
+                                block_size, nodata, keep_ragged, chunk_size)
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
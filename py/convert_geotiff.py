@@ -1,48 +1,205 @@
-import rasterio
-import numpy as np
-import rasterio
 import numpy as np
+import shapely
+import shapely.geometry
+from functools import lru_cache
 from rasterio.features import shapes
-from rasterio.warp import transform_geom
-from pyproj import CRS
+from rasterio.warp import calculate_default_transform, reproject, Resampling
+from pyproj import CRS, Transformer
 from geojson import Feature, FeatureCollection, dumps
+from raster_pooling import pool_raster, write_cog
+import instrumentation
+from instrumentation import stage, count
+
+WGS84 = CRS.from_epsg(4326)
+
+@lru_cache(maxsize=None)
+def transformer_to_wgs84(crs_wkt):
+    """Build the PROJ transformer for a source CRS once and reuse it."""
+    return Transformer.from_crs(CRS.from_wkt(crs_wkt), WGS84, always_xy=True)
+
+def reproject_polygons(geometries, src_crs):
+    """Reproject polygon geometries to WGS84 (EPSG:4326) with a single batched transform call.
+
+    All ring coordinates are collected into flat arrays, transformed at once and split back
+    into the original rings.
+    """
+    if not geometries:
+        return []
+
+    rings = [np.asarray(ring, dtype=np.float64) for geom in geometries for ring in geom['coordinates']]
+    ring_ends = np.cumsum([len(ring) for ring in rings])[:-1]
+    coords = np.concatenate(rings)
+
+    lon, lat = transformer_to_wgs84(CRS.from_user_input(src_crs).to_wkt()).transform(coords[:, 0], coords[:, 1])
+    projected_rings = np.split(np.column_stack([lon, lat]), ring_ends)
+
+    reprojected = []
+    ring_index = 0
+    for geom in geometries:
+        num_rings = len(geom['coordinates'])
+        reprojected.append({
+            'type': geom['type'],
+            'coordinates': [ring.tolist() for ring in projected_rings[ring_index:ring_index + num_rings]],
+        })
+        ring_index += num_rings
+    return reprojected
+
+def jenks_breaks(values, num_classes):
+    """Fisher-Jenks natural breaks of a (small) sample by dynamic programming over the sorted values.
+
+    Minimizes the total within-class sum of squared deviations; returns num_classes - 1 inner breaks.
+    """
+    x = np.sort(np.asarray(values, dtype=np.float64))
+    n = len(x)
+    s1 = np.concatenate([[0.0], np.cumsum(x)])
+    s2 = np.concatenate([[0.0], np.cumsum(x * x)])
+
+    # ssd[i, j]: squared deviations of the class x[i..j]
+    i, j = np.triu_indices(n)
+    ssd = np.full((n, n), np.inf)
+    length = j - i + 1
+    ssd[i, j] = (s2[j + 1] - s2[i]) - (s1[j + 1] - s1[i]) ** 2 / length
+
+    cost = ssd[0].copy()  # one class covering x[0..j]
+    starts = []
+    for _ in range(1, num_classes):
+        # The new last class starts at i, the previous classes cover x[0..i-1]
+        candidates = np.vstack([np.full(n, np.inf), cost[:-1, np.newaxis] + ssd[1:]])
+        start = candidates.argmin(axis=0)
+        cost = candidates[start, np.arange(n)]
+        starts.append(start)
+
+    breaks = []
+    end = n - 1
+    for start in reversed(starts):
+        first = start[end]
+        breaks.append(x[first])
+        end = first - 1
+    return np.array(sorted(breaks))
+
+def class_breaks(values, num_classes, method='quantile', sample_size=2000, seed=0):
+    """Inner class breaks of the values for equal_interval, quantile or jenks classification.
+
+    Jenks is quadratic in the number of values, so it runs on a random sample of sample_size values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if method == 'equal_interval':
+        return np.linspace(values.min(), values.max(), num_classes + 1)[1:-1]
+    if method == 'quantile':
+        return np.unique(np.quantile(values, np.linspace(0, 1, num_classes + 1)[1:-1]))
+    if method == 'jenks':
+        if len(values) > sample_size:
+            values = np.random.default_rng(seed).choice(values, sample_size, replace=False)
+        return jenks_breaks(values, num_classes)
+    raise ValueError(f"Unknown classification method {method!r}, use equal_interval, quantile or jenks")
+
+def classify(data, valid, num_classes, method='quantile'):
+    """Quantize the valid pixels into classes; returns (class raster, mean value of every class)."""
+    breaks = class_breaks(data[valid], num_classes, method)
+    classes = np.digitize(data, breaks).astype(np.uint8)
+    sums = np.bincount(classes[valid], weights=data[valid], minlength=len(breaks) + 1)
+    counts = np.bincount(classes[valid], minlength=len(breaks) + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        class_values = sums / counts
+    return classes, class_values
+
+def simplify_coverage(geometries, tolerance):
+    """Simplify adjacent polygons together, so shared edges stay shared (no gaps or overlaps)."""
+    polygons = np.array([shapely.geometry.shape(geom) for geom in geometries], dtype=object)
+    # shapes() only puts a vertex where three polygons meet, so a long edge of one polygon can face
+    # several shorter edges of its neighbours. Node all edges and rebuild the faces, so neighbouring
+    # edges match vertex for vertex as coverage_simplify requires.
+    edges = shapely.union_all(shapely.boundary(polygons))
+    faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(edges)))
+    # Faces enclosed by the mask (holes) are not within any polygon and are left out
+    face_index, polygon_index = shapely.STRtree(polygons).query(shapely.point_on_surface(faces), predicate='within')
+    polygons[polygon_index] = faces[face_index]
+    simplified = shapely.coverage_simplify(polygons, tolerance)
+    return [shapely.geometry.mapping(geom) for geom in simplified]
+
+def warp_to_wgs84(data, transform, src_crs, nodata):
+    """Warp a raster to EPSG:4326 (nearest neighbour keeps the pooled values) before polygonizing."""
+    height, width = data.shape
+    left, top = transform * (0, 0)
+    right, bottom = transform * (width, height)
+    dst_transform, dst_width, dst_height = calculate_default_transform(
+        src_crs, WGS84, width, height, left=left, bottom=bottom, right=right, top=top)
+
+    warped = np.full((dst_height, dst_width), nodata, dtype=data.dtype)
+    reproject(source=data, destination=warped,
+              src_transform=transform, src_crs=src_crs, src_nodata=nodata,
+              dst_transform=dst_transform, dst_crs=WGS84, dst_nodata=nodata,
+              resampling=Resampling.nearest)
+    return warped, dst_transform
+
+def geotiff_to_geojson(filepath, pool_size=1, cache=None, warp_first=False, store=None,
+                       num_classes=None, method='quantile', simplify_tolerance=None,
+                       pool_method='mean', workers=None, cog_file=None):
+    # Pass a ReductionCache to skip re-reading and re-pooling an unchanged raster,
+    # and a RasterStore to pool from the memory-mapped band instead of decoding the GeoTIFF again.
+    # With warp_first=True the pooled raster is warped to EPSG:4326 before polygonizing,
+    # so no vector reprojection is needed at all.
+    # With num_classes the pooled values are quantized first (equal_interval, quantile or jenks), so
+    # neighbouring pixels of the same class merge into one polygon; raster_val is then the class mean.
+    # simplify_tolerance (in units of the raster CRS) simplifies the polygons as one coverage.
+    # pool_method is "mean", "median" or "max"; cog_file also saves the pooled raster as a Cloud-Optimized GeoTIFF.
+    with stage('lst.pool', file=filepath, pool_size=pool_size, method=pool_method):
+        # Read the raster in pool-aligned tiles on a thread pool (workers threads) and pool every
+        # tile on the fly, so only the pooled raster is held in memory (pool_size=1 keeps every pixel)
+        # Nodata pixels are left out of the pools, partial pools at the right/bottom edge are kept,
+        # and pools without any valid pixel become nodata
+        pooled, transform, crs, nodata = pool_raster(filepath, pool_size, pool_method, workers=workers,
+                                                     cache=cache, store=store)  # Assuming single band raster
+        count('blocks_emitted', pooled.size)
+        if cog_file:
+            write_cog(pooled, transform, crs, cog_file, nodata)
+        # Pools stay float32 (pool_raster's dtype), so means of integer rasters are not truncated;
+        # empty pools are NaN, or the nodata value when the raster has one
+        if nodata is None:
+            nodata = np.nan
+            data = pooled
+        else:
+            data = np.where(np.isnan(pooled), pooled.dtype.type(nodata), pooled)
+
+    if warp_first:
+        with stage('lst.warp'):
+            data, transform = warp_to_wgs84(data, transform, crs, nodata)
+
+    # Create a mask for non-nodata values
+    mask = ~np.isnan(data) & (data != nodata)
+
+    if num_classes:
+        with stage('lst.classify', method=method, num_classes=num_classes):
+            mask &= np.isfinite(data)
+            classes, class_values = classify(data, mask, num_classes, method)
+
+    # Get the features with their values
+    geometries = []
+    values = []
+    with stage('lst.polygonize'):
+        if num_classes:
+            for geom, value in shapes(classes, mask=mask, transform=transform):
+                geometries.append(geom)
+                values.append(float(class_values[int(value)]))
+        else:
+            for geom, value in shapes(data, mask=mask, transform=transform):
+                geometries.append(geom)
+                values.append(value)
+        count('polygons', len(geometries))
+
+    if simplify_tolerance:
+        with stage('lst.simplify', tolerance=simplify_tolerance):
+            geometries = simplify_coverage(geometries, simplify_tolerance)
+
+    # Reproject all geometries to WGS84 (EPSG:4326) in one go
+    if not warp_first:
+        with stage('lst.reproject'):
+            geometries = reproject_polygons(geometries, crs)
 
-def geotiff_to_geojson(filepath, pool_size=1):
-    with rasterio.open(filepath) as src:
-        # Read the raster data
-        data = src.read(1)  # Assuming single band raster
-
-        # Perform pooling if pool_size > 1
-        if pool_size > 1:
-            # Ensure data shape is divisible by pool_size
-            new_shape = (data.shape[0] // pool_size * pool_size,
-                         data.shape[1] // pool_size * pool_size)
-            data = data[:new_shape[0], :new_shape[1]]
-
-            # Reshape and compute mean
-            data = data.reshape((new_shape[0] // pool_size, pool_size,
-                                 new_shape[1] // pool_size, pool_size))
-            data = data.mean(axis=(1, 3))
-
-        # Create a mask for non-nodata values
-        mask = data != src.nodata
-
-        # Get the features with their values
-        results = (
-            {'properties': {'raster_val': v}, 'geometry': s}
-            for i, (s, v) in enumerate(
-            shapes(data, mask=mask, transform=src.transform))
-        )
-
-        # Create a list to store features
-        features = []
-        for result in results:
-            # Reproject the geometry to WGS84 (EPSG:4326)
-            geom = transform_geom(src.crs, CRS.from_epsg(4326), result['geometry'])
-
-            # Create a feature
-            feature = Feature(geometry=geom, properties=result['properties'])
-            features.append(feature)
+    with stage('lst.serialize'):
+        features = [Feature(geometry=geom, properties={'raster_val': value})
+                    for geom, value in zip(geometries, values)]
+        count('features_written', len(features))
 
         # Create a FeatureCollection
         feature_collection = FeatureCollection(features)
@@ -53,8 +210,20 @@ def geotiff_to_geojson(filepath, pool_size=1):
 if __name__ == "__main__":
     filepath = "LST_Clipped.tif"
     pool_size = 5  # Change this to pool pixels (e.g., 8 for 8x8 pooling)
-    geojson_output = geotiff_to_geojson(filepath, pool_size)
+    warp_first = False  # Set to True to warp the raster to EPSG:4326 instead of reprojecting polygons
+    num_classes = None  # Set to e.g. 8 to quantize the values into classes before polygonizing
+    method = "quantile"  # Class breaks: "equal_interval", "quantile" or "jenks"
+    simplify_tolerance = None  # e.g. 240 (metres, one pooled pixel of the UTM LST raster) to simplify the polygons
+    pool_method = "mean"  # or "median" / "max"
+    cog_file = None  # Set to e.g. "lst_pooled.tif" to keep the pooled raster as a Cloud-Optimized GeoTIFF
+    trace_file = None  # Set to "trace.jsonl" or "trace.json" (Chrome trace) to record per-stage timings
+    if trace_file:
+        instrumentation.enable(trace_file)
+    geojson_output = geotiff_to_geojson(filepath, pool_size, warp_first=warp_first, num_classes=num_classes,
+                                        method=method, simplify_tolerance=simplify_tolerance,
+                                        pool_method=pool_method, cog_file=cog_file)
 
     # Save the GeoJSON to a file
     with open("lst_clipped.geojson", "w") as f:
-        f.write(geojson_output)
\ No newline at end of file
+        f.write(geojson_output)
+    instrumentation.finish()
@@ -1,10 +1,21 @@
 import csv
 import json
-from typing import Dict, List
+import warnings
+from typing import Dict, List, Sequence
 import h3
 from statistics import mean
 from collections import defaultdict
 import numpy as np
+import pandas as pd
+import instrumentation
+from instrumentation import stage, count
+
+with warnings.catch_warnings():
+    # h3-py 3.x ships its batched functions under h3.unstable and warns on import
+    warnings.simplefilter('ignore')
+    from h3.unstable import vect as h3_vect
+
+PERCENTILES = [10, 25, 75, 90]
 
 def parse_csv(file_path: str) -> List[Dict]:
     data = []
@@ -67,21 +78,104 @@ def create_geojson(data: List[Dict], resolution: int = 8) -> Dict:
     print(f"Number of features: {len(features)}")
     return geojson
 
-def main():
+def load_listings(file_path: str) -> pd.DataFrame:
+    """Load only the coordinate and price columns of the CSV as numeric columns."""
+    with stage('housing.load', file=file_path):
+        listings = pd.read_csv(file_path, usecols=['latitude', 'longitude', 'Price_sqft'])
+        listings = listings.apply(pd.to_numeric, errors='coerce')
+
+        valid = listings.notna().all(axis=1).to_numpy()
+        if not valid.all():
+            print(f"Skipped {int((~valid).sum())} rows with missing or invalid coordinates/prices")
+        count('rows_read', len(listings))
+        count('rows_skipped', int((~valid).sum()))
+        return listings[valid]
+
+def assign_h3_cells(latitudes: np.ndarray, longitudes: np.ndarray, resolutions: Sequence[int]) -> Dict[int, np.ndarray]:
+    """Assign every point to its H3 cell (as uint64) at each resolution in one batched pass.
+
+    Points are indexed once at the finest resolution; coarser cells are derived as parents.
+    """
+    finest = max(resolutions)
+    cells = h3_vect.geo_to_h3(np.ascontiguousarray(latitudes, dtype=np.float64),
+                              np.ascontiguousarray(longitudes, dtype=np.float64), finest)
+    return {resolution: cells if resolution == finest else h3_vect.h3_to_parent(cells, resolution)
+            for resolution in resolutions}
+
+def aggregate_prices(cells: np.ndarray, prices: np.ndarray) -> pd.DataFrame:
+    """Count, mean, median and percentiles of the price per cell with one group-by."""
+    grouped = pd.Series(prices).groupby(cells, sort=False)
+    stats = grouped.agg(sample_size='count', mean_price='mean', median_price='median')
+    quantiles = grouped.quantile([p / 100 for p in PERCENTILES]).unstack()
+    quantiles.columns = [f"p{p}" for p in PERCENTILES]
+    return stats.join(quantiles)
+
+def create_geojson_columnar(listings: pd.DataFrame, resolutions: Sequence[int] = (8,)) -> Dict[int, Dict]:
+    """Bin the listings into H3 hexagons at every resolution; returns {resolution: FeatureCollection}."""
+    prices = listings['Price_sqft'].to_numpy(dtype=np.float64)
+    print_price_distribution(prices)
+
+    with stage('housing.assign_cells'):
+        cells_by_resolution = assign_h3_cells(listings['latitude'].to_numpy(), listings['longitude'].to_numpy(),
+                                              resolutions)
+
+    geojsons = {}
+    for resolution, cells in cells_by_resolution.items():
+        with stage('housing.aggregate', resolution=resolution):
+            stats = aggregate_prices(cells, prices)
+            count('cells', len(stats))
+
+        features = []
+        for cell, row in zip(stats.index.to_numpy(), stats.itertuples(index=False)):
+            hex_boundary = h3.h3_to_geo_boundary(h3.h3_to_string(int(cell)), geo_json=True)
+            properties = {
+                "avg_price_per_sqm": row.mean_price,
+                "sample_size": int(row.sample_size),
+                "median_price_per_sqm": row.median_price,
+            }
+            for p in PERCENTILES:
+                properties[f"p{p}_price_per_sqm"] = getattr(row, f"p{p}")
+
+            features.append({
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[list(point) for point in hex_boundary]]
+                },
+                "properties": properties
+            })
+
+        geojsons[resolution] = {
+            "type": "FeatureCollection",
+            "features": features
+        }
+        print(f"Number of features at resolution {resolution}: {len(features)}")
+    return geojsons
+
+def main(resolutions: Sequence[int] = (8,), trace_file: str = None):
+    if trace_file:
+        instrumentation.enable(trace_file)
     input_file = 'delhi.csv'  # Replace with your input file path
     output_file = 'delhi_housing_hexbins.geojson'
 
-    data = parse_csv(input_file)
-    if not data:
+    listings = load_listings(input_file)
+    if listings.empty:
         print("No data found in the CSV file.")
         return
 
-    geojson_data = create_geojson(data)
+    geojsons = create_geojson_columnar(listings, resolutions)
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(geojson_data, f, ensure_ascii=False, indent=2)
+    for resolution, geojson_data in geojsons.items():
+        # Resolution 8 keeps the file name the frontend expects
+        resolution_file = output_file if resolution == 8 else output_file.replace('.geojson', f'_r{resolution}.geojson')
+        with stage('housing.serialize', file=resolution_file), open(resolution_file, 'w', encoding='utf-8') as f:
+            json.dump(geojson_data, f, ensure_ascii=False, indent=2)
+            count('features_written', len(geojson_data['features']))
 
-    print(f"\nGeoJSON file '{output_file}' has been created successfully.")
+        print(f"\nGeoJSON file '{resolution_file}' has been created successfully.")
+    instrumentation.finish()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    resolutions = [8]  # Add e.g. 7 and 9 to bin at several H3 resolutions in the same pass
+    trace_file = None  # Set to "trace.jsonl" or "trace.json" (Chrome trace) to record per-stage timings
+    main(resolutions, trace_file)
\ No newline at end of file
@@ -6,23 +6,11 @@ from shapely.geometry import box, mapping
 import geopandas as gpd
 import glob
 import matplotlib.pyplot as plt
+from block_reduce import block_fraction
 
 def calculate_shade_fraction(raster, block_size):
     """Calculate the fraction of unshaded area for each block."""
-    rows, cols = raster.shape
-    blocks_y = rows // block_size
-    blocks_x = cols // block_size
-
-    fractions = np.zeros((blocks_y, blocks_x))
-
-    for i in range(blocks_y):
-        for j in range(blocks_x):
-            block = raster[i*block_size:(i+1)*block_size, j*block_size:(j+1)*block_size]
-            total_value = np.sum(block)
-            max_value = 255 * block_size * block_size
-            fractions[i, j] = total_value / max_value
-
-    return fractions
+    return block_fraction(raster, block_size, max_value=255)
 
 def print_shade_distribution(shade_fractions):
     """Calculate and print the distribution of shade fractions."""
@@ -1,120 +1,22 @@
 import os
-import rasterio
 import numpy as np
-from shapely.geometry import box, mapping
-import geopandas as gpd
 import glob
 import matplotlib.pyplot as plt
+from block_reduce import block_fraction, fraction_from_sums
+from running_stats import RunningStats
+from reduction_cache import ReductionCache, cached_block_sums
+from raster_store import RasterStore
 from datetime import datetime, timedelta
-
-class QuadrantCoverage:
-    def __init__(self):
-        self.quadrants = {
-            'upper_left': None,
-            'upper_right': None,
-            'lower_left': None,
-            'lower_right': None
-        }
-
-    def add_quadrant(self, quadrant, lon_min, lon_max, lat_min, lat_max):
-        self.quadrants[quadrant] = (lon_min, lon_max, lat_min, lat_max)
-
-    def is_overlapping(self, quadrant, lon, lat):
-        if quadrant == 'upper_left':
-            return False  # First quadrant, no need to check
-        elif quadrant == 'upper_right':
-            ul = self.quadrants['upper_left']
-            return lon < ul[1] if ul else False
-        elif quadrant == 'lower_left':
-            ul = self.quadrants['upper_left']
-            return lat > ul[2] if ul else False
-        elif quadrant == 'lower_right':
-            ul = self.quadrants['upper_left']
-            ur = self.quadrants['upper_right']
-            ll = self.quadrants['lower_left']
-
-            # Check if the point is in the upper left quadrant
-            if ul and lon < ul[1] and lat > ul[2]:
-                return True
-
-            # Check if the point is in the upper right quadrant
-            if ur and lon < ur[1] and lat > ur[2]:
-                return True
-
-            # Check if the point is in the lower left quadrant
-            if ll and lon < ll[1] and lat > ll[2]:
-                return True
-
-            return False
+from concurrent.futures import ProcessPoolExecutor
+from mosaic import BlockMosaic
+from grid_writer import write_block_grid, is_binary_grid, grid_format_name
+from block_pyramid import build_pyramid, pyramid_block_sizes, save_pyramid
+import instrumentation
+from instrumentation import stage, count
 
 def calculate_shade_fraction(raster, block_size):
     """Calculate the fraction of unshaded area for each block."""
-    rows, cols = raster.shape
-    blocks_y = rows // block_size
-    blocks_x = cols // block_size
-
-    fractions = np.zeros((blocks_y, blocks_x))
-
-    for i in range(blocks_y):
-        for j in range(blocks_x):
-            block = raster[i*block_size:(i+1)*block_size, j*block_size:(j+1)*block_size]
-            total_value = np.sum(block)
-            max_value = 255 * block_size * block_size
-            fractions[i, j] = total_value / max_value
-
-    return fractions
-
-# ... [Other helper functions remain unchanged] ...
-
-def create_geojson(quadrant, avg_fractions, transform, crs, block_size, output_file, quadrant_coverage):
-    features = []
-    rows, cols = avg_fractions.shape
-    quadrant_lon_min, quadrant_lon_max = float('inf'), float('-inf')
-    quadrant_lat_min, quadrant_lat_max = float('inf'), float('-inf')
-
-    for y in range(rows):
-        for x in range(cols):
-            # Calculate the actual coordinates of the block
-            x_min, y_max = transform * (x * block_size, y * block_size)
-            x_max, y_min = transform * ((x + 1) * block_size, (y + 1) * block_size)
-
-            # Check if this block overlaps with previously processed quadrants
-            if not quadrant_coverage.is_overlapping(quadrant, x_min, y_max):
-                # Create a polygon for the block
-                polygon = box(x_min, y_min, x_max, y_max)
-
-                # Create a feature with the polygon and average shade fraction
-                feature = {
-                    'type': 'Feature',
-                    'geometry': mapping(polygon),
-                    'properties': {
-                        'avg_shade_fraction': 1 - avg_fractions[y, x],  # Convert to shade fraction
-                    }
-                }
-                features.append(feature)
-
-                # Update quadrant bounds
-                quadrant_lon_min = min(quadrant_lon_min, x_min)
-                quadrant_lon_max = max(quadrant_lon_max, x_max)
-                quadrant_lat_min = min(quadrant_lat_min, y_min)
-                quadrant_lat_max = max(quadrant_lat_max, y_max)
-
-    # Add this quadrant to the coverage
-    if quadrant_lon_min != float('inf'):
-        quadrant_coverage.add_quadrant(quadrant, quadrant_lon_min, quadrant_lon_max, quadrant_lat_min, quadrant_lat_max)
-
-    if features:
-        # Create a GeoDataFrame
-        gdf = gpd.GeoDataFrame.from_features(features, crs=crs)
-
-        # Save to GeoJSON
-        gdf.to_file(output_file, driver='GeoJSON')
-
-        print(f"\nCreated GeoJSON file: {output_file}")
-        print(f"Number of polygons created: {len(gdf)}")
-    else:
-        print(f"\nNo non-overlapping features found for {quadrant}. GeoJSON file not created.")
-
+    return block_fraction(raster, block_size, max_value=255)
 
 def print_shade_distribution(shade_fractions):
     """Calculate and print the distribution of shade fractions."""
@@ -138,40 +40,116 @@ def plot_shade_fraction_histogram(shade_fractions, title, output_file):
     plt.savefig(output_file)
     plt.close()
 
-def process_geotiffs(input_directory, block_size=10, output_directory='histograms'):
-    subdirs = ['upper_left', 'upper_right', 'lower_left', 'lower_right']
+def reduce_tile(tiff_file, block_size, cache=None, store=None):
+    """Reduce the first band of a tile to per-block unshaded fractions and valid-pixel counts.
+
+    The band is read in block-aligned windows, so the full raster is never held in memory.
+    With a ReductionCache, tiles whose content was reduced before are not decoded again.
+    With a RasterStore, the tile is decoded once and reduced from its memory-mapped band.
+    """
+    with stage('shade.reduce_tile', file=tiff_file):
+        sums, counts, transform, crs = cached_block_sums(tiff_file, block_size, cache, store=store)
+        count('tiles_read')
+        count('blocks_emitted', sums.size)
+        return fraction_from_sums(sums, counts, 255), counts, transform, crs
+
+def _reduce_tile_task(task):
+    # Module-level so it can be pickled into pool workers. The worker's copies of the cache and
+    # store count their own hits/misses and decodes, so they are sent back to the parent's counters.
+    tiff_file, block_size, cache, store = task
+    result = reduce_tile(tiff_file, block_size, cache, store)
+    stats = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    store_stats = (store.decoded, store.reused) if store is not None else (0, 0)
+    return result, stats, store_stats
+
+def accumulate_geotiffs(input_directory, block_size=10, track_spread=False, workers=1, cache=None, store=None):
+    """Reduce every hourly tile and fold it into a per-subdir RunningStats as soon as it is read.
+
+    Returns (subdir_stats, subdir_counts, transforms, crss, num_hours); subdir_counts holds the
+    number of valid pixels behind every block, summed over the hours.
+
+    Only one raster per subdir is held in memory at a time, independent of the number of hours.
+    With track_spread=True the per-block min/max/variance over the hours are tracked as well.
+
+    With workers > 1 the read+reduce of each tile runs in a process pool. Results are still
+    folded in (hour, subdir) order, so the aggregates are bit-identical to the serial path.
+
+    cache is an optional ReductionCache shared by all tiles, store an optional RasterStore the
+    tiles are decoded into once; workers then only receive file names and map the decoded bands.
+    """
+    # Every subdirectory holds the hourly snapshots of one (possibly overlapping) tile
+    subdirs = sorted(entry for entry in os.listdir(input_directory)
+                     if os.path.isdir(os.path.join(input_directory, entry)))
 
     # Get all TIFF files for each subdirectory
     tiff_files = {subdir: sorted(glob.glob(os.path.join(input_directory, subdir, "*.tiff")),
                                  key=os.path.getmtime)
                   for subdir in subdirs}
 
-    if not all(tiff_files.values()):
+    if not subdirs or not all(tiff_files.values()):
         print(f"No TIFF files found in one or more subdirectories of {input_directory}")
         return None
 
-    # Create output directory for histograms if it doesn't exist
-    os.makedirs(output_directory, exist_ok=True)
-
-    subdir_fractions = {subdir: [] for subdir in subdirs}
+    subdir_stats = {subdir: RunningStats(track_extrema=track_spread, track_variance=track_spread)
+                    for subdir in subdirs}
+    subdir_counts = {}
     transforms = {}
     crss = {}
 
-    for hour in range(len(tiff_files[subdirs[0]])):  # Assume all subdirs have the same number of files
-        for subdir in subdirs:
-            tiff_file = tiff_files[subdir][hour]
-            with rasterio.open(tiff_file) as src:
-                raster = src.read(1)  # Read the first band
-                if subdir not in transforms:
-                    transforms[subdir] = src.transform
-                if subdir not in crss:
-                    crss[subdir] = src.crs
+    num_hours = max(len(files) for files in tiff_files.values())
+    tasks = [(subdir, tiff_files[subdir][hour])
+             for hour in range(num_hours)
+             for subdir in subdirs
+             if hour < len(tiff_files[subdir])]
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # map() yields in submission order, which keeps the merge deterministic
+        worker_cache = ReductionCache(cache.cache_dir, cache.max_bytes) if cache is not None else None
+        worker_store = RasterStore(store.store_dir, store.max_bytes) if store is not None else None
+        worker_results = executor.map(_reduce_tile_task, [(tiff_file, block_size, worker_cache, worker_store)
+                                                          for _, tiff_file in tasks])
+
+        def collect():
+            for result, (hits, misses), (decoded, reused) in worker_results:
+                if cache is not None:
+                    cache.hits += hits
+                    cache.misses += misses
+                if store is not None:
+                    store.decoded += decoded
+                    store.reused += reused
+                yield result
+        results = collect()
+    else:
+        executor = None
+        results = (reduce_tile(tiff_file, block_size, cache, store) for _, tiff_file in tasks)
+
+    try:
+        for (subdir, _), (fractions, counts, transform, crs) in zip(tasks, results):
+            if subdir not in transforms:
+                transforms[subdir] = transform
+            if subdir not in crss:
+                crss[subdir] = crs
+            subdir_stats[subdir].update(fractions)
+            subdir_counts[subdir] = subdir_counts.get(subdir, 0) + counts
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return subdir_stats, subdir_counts, transforms, crss, num_hours
+
+def process_geotiffs(input_directory, block_size=10, output_directory='histograms', workers=1, cache=None, store=None):
+    with stage('shade.accumulate', block_size=block_size, workers=workers):
+        accumulated = accumulate_geotiffs(input_directory, block_size, workers=workers, cache=cache, store=store)
+    if accumulated is None:
+        return None
+    subdir_stats, subdir_counts, transforms, crss, num_hours = accumulated
 
-            fractions = calculate_shade_fraction(raster, block_size)
-            subdir_fractions[subdir].append(fractions)
+    # Create output directory for histograms if it doesn't exist
+    os.makedirs(output_directory, exist_ok=True)
 
     # Calculate average shade fractions for each subdir
-    avg_subdir_fractions = {subdir: np.mean(fractions, axis=0) for subdir, fractions in subdir_fractions.items()}
+    avg_subdir_fractions = {subdir: stats.mean() for subdir, stats in subdir_stats.items()}
 
     # Plot histogram for average shade fractions (using combined data from all subdirs)
     #histogram_title = f"Average Shade Fraction Distribution"
@@ -179,68 +157,116 @@ def process_geotiffs(input_directory, block_size=10, output_directory='histogram
     #combined_avg_fractions = np.mean(list(avg_subdir_fractions.values()), axis=0)
     #plot_shade_fraction_histogram(1 - combined_avg_fractions.flatten(), histogram_title, histogram_file)
 
-    return avg_subdir_fractions, transforms, crss, len(tiff_files[subdirs[0]])
-
-def create_geojson(quadrant, avg_fractions, transform, crs, block_size, output_file, quadrant_coverage):
-    features = []
-    rows, cols = avg_fractions.shape
-    quadrant_lon_min, quadrant_lon_max = float('inf'), float('-inf')
-    quadrant_lat_min, quadrant_lat_max = float('inf'), float('-inf')
-
-    for y in range(rows):
-        for x in range(cols):
-            # Calculate the actual coordinates of the block
-            x_min, y_max = transform * (x * block_size, y * block_size)
-            x_max, y_min = transform * ((x + 1) * block_size, (y + 1) * block_size)
-
-            # Check if this block overlaps with previously processed quadrants
-            if not quadrant_coverage.is_overlapping(quadrant, x_min, y_max):
-                # Create a polygon for the block
-                polygon = box(x_min, y_min, x_max, y_max)
-
-                # Create a feature with the polygon and average shade fraction
-                feature = {
-                    'type': 'Feature',
-                    'geometry': mapping(polygon),
-                    'properties': {
-                        'avg_shade_fraction': 1 - avg_fractions[y, x],  # Convert to shade fraction
-                    }
-                }
-                features.append(feature)
-
-                # Update quadrant bounds
-                quadrant_lon_min = min(quadrant_lon_min, x_min)
-                quadrant_lon_max = max(quadrant_lon_max, x_max)
-                quadrant_lat_min = min(quadrant_lat_min, y_min)
-                quadrant_lat_max = max(quadrant_lat_max, y_max)
-
-    # Add this quadrant to the coverage
-    if quadrant_lon_min != float('inf'):
-        quadrant_coverage.add_quadrant(quadrant, quadrant_lon_min, quadrant_lon_max, quadrant_lat_min, quadrant_lat_max)
-
-    if features:
-        # Create a GeoDataFrame
-        gdf = gpd.GeoDataFrame.from_features(features, crs=crs)
-
-        # Save to GeoJSON
-        gdf.to_file(output_file, driver='GeoJSON')
-
-        print(f"\nCreated GeoJSON file: {output_file}")
-        print(f"Number of polygons created: {len(gdf)}")
+    return avg_subdir_fractions, subdir_counts, transforms, crss, num_hours
+
+def create_geojson(avg_fractions, transform, crs, block_size, output_file, precision=None, grid_dtype='uint8'):
+    """Write the non-NaN blocks as polygons with their average shade fraction.
+
+    The format follows the extension of output_file (.json/.geojson, .fgb, .parquet, or
+    .grid/.grid.gz for the compact binary grid with grid_dtype values);
+    precision limits the number of decimals of GeoJSON coordinates.
+    """
+    format_name = grid_format_name(output_file)
+    if np.isnan(avg_fractions).all():
+        print(f"\nNo features found. {format_name} file not created.")
+        return
+
+    shade_fractions = 1 - avg_fractions  # Convert to shade fraction
+    with stage('shade.write_grid', file=output_file):
+        num_features = write_block_grid(shade_fractions, transform, crs, block_size, output_file,
+                                        'avg_shade_fraction', precision, grid_dtype)
+        count('features_written', num_features)
+
+    if is_binary_grid(output_file):
+        print(f"\nCreated binary grid file: {output_file} ({os.path.getsize(output_file) / 1e3:.0f} KB)")
+        print(f"Number of cells with data: {num_features}")
     else:
-        print(f"\nNo non-overlapping features found for {quadrant}. GeoJSON file not created.")
+        print(f"\nCreated {format_name} file: {output_file}")
+        print(f"Number of polygons created: {num_features}")
 
 
-def main(input_directory, block_size=10):
-    avg_subdir_fractions, transforms, crss, num_hours = process_geotiffs(input_directory, block_size)
+def mosaic_tiles(avg_subdir_fractions, transforms, crss, block_size, subdir_weights=None):
+    """Merge the per-tile block grids onto one global block grid, averaging where tiles overlap.
 
-    if avg_subdir_fractions is not None:
-        quadrant_coverage = QuadrantCoverage()
-        all_features = []
+    subdir_weights optionally gives the number of pixels behind every block of each tile.
+    """
+    subdirs = list(avg_subdir_fractions)
+    if not subdirs:
+        raise ValueError("No tiles to mosaic")
+    if len({crss[subdir] for subdir in subdirs}) > 1:
+        raise ValueError("All tiles must share the same CRS to be mosaicked")
 
-        for subdir in ['upper_left', 'upper_right', 'lower_left', 'lower_right']:
-            output_file = f"{subdir}_average_shade.json"
-            create_geojson(subdir, avg_subdir_fractions[subdir], transforms[subdir], crss[subdir], block_size, output_file, quadrant_coverage)
+    with stage('shade.mosaic', block_size=block_size):
+        mosaic = BlockMosaic.for_tile(transforms[subdirs[0]], block_size)
+        for subdir in subdirs:
+            weights = subdir_weights[subdir] if subdir_weights is not None else None
+            mosaic.add_tile(avg_subdir_fractions[subdir], transforms[subdir], block_size, weights)
+
+        mosaic_fractions, mosaic_transform = mosaic.resolve()
+    return mosaic_fractions, mosaic_transform, crss[subdirs[0]]
+
+def build_shade_pyramid(avg_subdir_fractions, transforms, crss, block_size, num_levels, subdir_counts=None):
+    """Build every level of a 2x2 block pyramid on top of the base block grid and mosaic it.
+
+    The base fractions are turned back into per-block sums and pixel counts, so each parent level
+    is the exact sum of its children. Averaging over the hours is linear, so the pyramid of the
+    hourly mean equals the hourly mean of per-hour pyramids and no tile has to be read again.
+    subdir_counts are the valid pixels per block from accumulate_geotiffs; without them every
+    block counts as block_size x block_size pixels.
+
+    Returns {level_block_size: (fractions, transform)} and the CRS.
+    """
+    subdir_levels = {}
+    for subdir, fractions in avg_subdir_fractions.items():
+        if subdir_counts is not None:
+            counts = subdir_counts[subdir]
+        else:
+            counts = np.where(np.isnan(fractions), 0, block_size * block_size)
+        # Blocks without valid pixels add nothing to their parents
+        fractions = np.where(counts > 0, fractions, 0)
+        subdir_levels[subdir] = build_pyramid(fractions * counts, counts, num_levels)
+
+    level_grids = {}
+    crs = None
+    for level, level_block_size in enumerate(pyramid_block_sizes(block_size, num_levels)):
+        if any(level >= len(levels) for levels in subdir_levels.values()):
+            break
+        # The pyramid sums are fractions times counts, so the fraction's maximum value is 1
+        level_fractions = {subdir: fraction_from_sums(*levels[level], max_value=1)
+                           for subdir, levels in subdir_levels.items()}
+        level_counts = {subdir: levels[level][1] for subdir, levels in subdir_levels.items()}
+        fractions, transform, crs = mosaic_tiles(level_fractions, transforms, crss, level_block_size, level_counts)
+        level_grids[level_block_size] = (fractions, transform)
+
+    return level_grids, crs
+
+def main(input_directory, block_size=10, workers=1, pyramid_levels=1, cache_dir=None, store_dir=None,
+         trace_file=None, output_format='json'):
+    if trace_file:
+        instrumentation.enable(trace_file)
+    cache = ReductionCache(cache_dir) if cache_dir else None
+    store = RasterStore(store_dir) if store_dir else None
+    result = process_geotiffs(input_directory, block_size, workers=workers, cache=cache, store=store)
+
+    if result is not None:
+        avg_subdir_fractions, subdir_counts, transforms, crss, num_hours = result
+
+        if pyramid_levels > 1:
+            # One file per level (block_size, 2*block_size, 4*block_size, ...) plus all levels in one .npz
+            with stage('shade.pyramid', levels=pyramid_levels):
+                level_grids, crs = build_shade_pyramid(avg_subdir_fractions, transforms, crss, block_size, pyramid_levels,
+                                                       subdir_counts)
+            for level_block_size, (fractions, transform) in level_grids.items():
+                create_geojson(fractions, transform, crs, 1, f"average_shade_bs{level_block_size}.{output_format}")
+            save_pyramid("average_shade_pyramid.npz", level_grids, crs)
+            print(f"\nSaved shade pyramid with block sizes {list(level_grids)} to average_shade_pyramid.npz")
+        else:
+            mosaic_fractions, mosaic_transform, crs = mosaic_tiles(avg_subdir_fractions, transforms, crss, block_size,
+                                                                   subdir_counts)
+
+            # The mosaic transform is already per block, so every cell is one block
+            output_file = f"average_shade.{output_format}"
+            create_geojson(mosaic_fractions, mosaic_transform, crs, 1, output_file)
 
         # Print distribution of average shade fractions for all subdirs combined
         #all_avg_fractions = np.concatenate([f.flatten() for f in avg_subdir_fractions.values()])
@@ -248,10 +274,21 @@ def main(input_directory, block_size=10):
         print(f"\nBlock size used: {block_size}x{block_size} pixels")
         print(f"Number of time periods processed: {num_hours}")
         print(f"Histogram has been saved in the 'histograms' directory")
+        if cache is not None:
+            cache.report()
+        if store is not None:
+            store.report()
     else:
         print("No data to process.")
+    instrumentation.finish()
 
 if __name__ == "__main__":
     input_directory = "fusedata"  # Replace with your input directory path
     block_size = 5   # Adjust this value to control the resolution
-    main(input_directory, block_size)
\ No newline at end of file
+    workers = os.cpu_count() or 1  # Set to 1 to read and reduce the tiles serially
+    pyramid_levels = 1  # Set to e.g. 5 to also write block sizes 2x, 4x, 8x and 16x block_size
+    cache_dir = ".reduction_cache"  # Set to None to always re-read every tile
+    store_dir = ".raster_store"  # Decoded tiles shared by all stages and workers; None to decode on every read
+    trace_file = None  # Set to "trace.jsonl" for per-stage timings as JSON lines or "trace.json" for a Chrome trace
+    output_format = "json"  # or "grid.gz" for the compact binary grid read by the web app (src/lib/grid.ts)
+    main(input_directory, block_size, workers, pyramid_levels, cache_dir, store_dir, trace_file, output_format)
\ No newline at end of file
@@ -1,56 +1,63 @@
 import rasterio
 import numpy as np
-from rasterio.features import shapes
-from rasterio.warp import transform_geom
-from pyproj import CRS
 from geojson import Feature, FeatureCollection, dumps
-
-def geotiff_to_geojson(filepath, grid_size=32):
+from grid_writer import block_bounds
+from convert_geotiff import reproject_polygons
+from reduction_cache import cached_block_sums
+import instrumentation
+from instrumentation import stage, count
+
+def grid_cell_means(filepath, grid_size, cache=None, store=None):
+    """nan-aware mean of every grid_size x grid_size cell, computed for the whole raster at once.
+
+    NaN, inf and nodata pixels are left out of the means; cells without any valid pixel are NaN.
+    The raster is read in block-aligned windows, so it never has to fit in memory.
+    """
     with rasterio.open(filepath) as src:
-        data = src.read(1)  # Assuming single band raster
-
-        print(f"Original shape: {data.shape}")
+        nodata = src.nodata
+
+    sums, counts, transform, crs = cached_block_sums(filepath, grid_size, cache, nodata=nodata, store=store)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return means, transform, crs
+
+def cell_polygons(means, transform, grid_size):
+    """Square polygons of the cells with a value, straight from the affine transform."""
+    rows, cols = means.shape
+    x_min, y_min, x_max, y_max = block_bounds(transform, rows, cols, grid_size)
+    keep = ~np.isnan(means.ravel())
+
+    # Same ring order as rasterio's shapes() for a rectangle: top-left, down, right, up
+    rings = np.stack([
+        np.column_stack([x_min[keep], y_max[keep]]),
+        np.column_stack([x_min[keep], y_min[keep]]),
+        np.column_stack([x_max[keep], y_min[keep]]),
+        np.column_stack([x_max[keep], y_max[keep]]),
+        np.column_stack([x_min[keep], y_max[keep]]),
+    ], axis=1)
+    geometries = [{'type': 'Polygon', 'coordinates': [ring]} for ring in rings]
+    return geometries, means.ravel()[keep]
+
+def geotiff_to_geojson(filepath, grid_size=32, cache=None, store=None):
+    with rasterio.open(filepath) as src:
+        print(f"Original shape: {src.shape}")
         print(f"Original bounds: {src.bounds}")
         print(f"Original CRS: {src.crs}")
 
-        # Handle infinite and NaN values
-        data = np.where(np.isinf(data) | np.isnan(data), None, data)
-
-        # Calculate grid dimensions
-        rows, cols = data.shape
-        grid_rows = rows // grid_size
-        grid_cols = cols // grid_size
-
-        # Create a list to store features
-        features = []
-
-        for i in range(grid_rows):
-            for j in range(grid_cols):
-                # Extract grid cell data
-                cell_data = data[i*grid_size:(i+1)*grid_size, j*grid_size:(j+1)*grid_size]
-
-                # Calculate mean value for the cell, ignoring None values
-                valid_data = cell_data[cell_data != None]
-                cell_value = np.mean(valid_data) if len(valid_data) > 0 else None
-
-                # Skip cells with no valid data
-                if cell_value is None:
-                    continue
-
-                # Create a mask for the cell
-                cell_mask = np.ones_like(cell_data, dtype=bool)
-
-                # Calculate the transform for this cell
-                cell_transform = src.transform * src.transform.translation(j*grid_size, i*grid_size)
+    # Mean value of every grid cell, ignoring NaN/inf/nodata pixels
+    with stage('deprivation.reduce', file=filepath, grid_size=grid_size):
+        means, transform, crs = grid_cell_means(filepath, grid_size, cache, store)
+        count('blocks_emitted', means.size)
 
-                # Get the geometry for this cell
-                for geom, _ in shapes(cell_mask.astype(np.int16), mask=cell_mask, transform=cell_transform):
-                    # Reproject the geometry to WGS84 (EPSG:4326)
-                    geom = transform_geom(src.crs, CRS.from_epsg(4326), geom)
+    # Cell squares, reprojected to WGS84 (EPSG:4326) in one batched call
+    with stage('deprivation.polygons'):
+        geometries, values = cell_polygons(means, transform, grid_size)
+        geometries = reproject_polygons(geometries, crs)
 
-                    # Create a feature
-                    feature = Feature(geometry=geom, properties={'raster_val': float(cell_value)})
-                    features.append(feature)
+    with stage('deprivation.serialize'):
+        features = [Feature(geometry=geom, properties={'raster_val': float(value)})
+                    for geom, value in zip(geometries, values)]
+        count('features_written', len(features))
 
         print(f"Number of features: {len(features)}")
 
@@ -63,10 +70,14 @@ def geotiff_to_geojson(filepath, grid_size=32):
 if __name__ == "__main__":
     filepath = "poverty.tif"
     grid_size = 4  # Size of each grid cell in pixels
+    trace_file = None  # Set to "trace.jsonl" or "trace.json" (Chrome trace) to record per-stage timings
+    if trace_file:
+        instrumentation.enable(trace_file)
     geojson_output = geotiff_to_geojson(filepath, grid_size)
 
     # Save the GeoJSON to a file
     with open("deprivation_index.geojson", "w") as f:
         f.write(geojson_output)
 
-    print("GeoJSON file has been created.")
\ No newline at end of file
+    print("GeoJSON file has been created.")
+    instrumentation.finish()
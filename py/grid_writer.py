@@ -0,0 +1,247 @@
+"""This file offers a fast writer for regular block grids as GeoJSON, FlatGeobuf, GeoParquet or a compact binary grid.
+
+Block polygons are generated as coordinate arrays straight from the affine transform, so no
+per-block shapely geometry or feature dict is built. GeoJSON is streamed to disk in chunks;
+FlatGeobuf and GeoParquet are written from a columnar GeoDataFrame built with vectorized shapely.
+
+The binary grid (.grid, optionally .grid.gz or .grid.br) stores no geometry at all, only a small
+header and the packed cell values; src/lib/grid.ts decodes it into an image for the web map:
+
+    bytes 0-3   magic "SGRD"
+    byte  4     format version (1)
+    byte  5     value type: 1 = uint8, 2 = float16 (little endian)
+    bytes 6-7   reserved
+    bytes 8-11  header length n (uint32, little endian)
+    bytes 12-   n bytes of UTF-8 JSON header, space padded so the values start 8-byte aligned
+    then        rows * cols values, row by row from the top
+
+The header holds rows, cols, the grid origin (top left corner) and cell size, the CRS, the
+property name, and the corners in EPSG:4326 for map sources that are placed by their corners.
+uint8 values are decoded as offset + code * scale, with code 255 meaning no data; float16 no
+data is NaN.
+"""
+import os
+import gzip
+import json
+import struct
+import numpy as np
+import shapely
+import geopandas as gpd
+from affine import Affine
+from rasterio.warp import transform as transform_coords
+
+GRID_MAGIC = b'SGRD'
+GRID_VERSION = 1
+GRID_DTYPES = {'uint8': 1, 'float16': 2}
+UINT8_NODATA = 255
+
+
+def block_bounds(transform, rows, cols, block_size=1):
+    """Return flat (x_min, y_min, x_max, y_max) arrays for every block of a rows x cols grid."""
+    ys, xs = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
+    xs = xs.ravel()
+    ys = ys.ravel()
+
+    # Corners of each block in pixel space, then through the (north-up) affine transform
+    x_left = transform.c + transform.a * (xs * block_size)
+    x_right = transform.c + transform.a * ((xs + 1) * block_size)
+    y_top = transform.f + transform.e * (ys * block_size)
+    y_bottom = transform.f + transform.e * ((ys + 1) * block_size)
+
+    return (np.minimum(x_left, x_right), np.minimum(y_top, y_bottom),
+            np.maximum(x_left, x_right), np.maximum(y_top, y_bottom))
+
+
+def _crs_member(crs):
+    # GDAL's GeoJSON driver only writes a crs member for non-WGS84 data; do the same
+    if crs is None:
+        return None
+    epsg = crs.to_epsg()
+    if epsg == 4326:
+        return None
+    name = f"urn:ogc:def:crs:EPSG::{epsg}" if epsg else crs.to_string()
+    return {"type": "name", "properties": {"name": name}}
+
+
+def write_geojson(values, transform, crs, block_size, output_file, property_name,
+                  precision=None, chunk_size=100000):
+    """Stream a block grid to a GeoJSON FeatureCollection, skipping NaN cells.
+
+    precision sets the number of decimals for coordinates (None keeps full float precision).
+    The ring order matches shapely's box(), i.e. what GeoDataFrame.to_file used to write.
+    """
+    rows, cols = values.shape
+    x_min, y_min, x_max, y_max = block_bounds(transform, rows, cols, block_size)
+    flat_values = values.ravel()
+    keep = ~np.isnan(flat_values)
+
+    coord = "%s" if precision is None else f"%.{precision}f"
+    ring = ", ".join([f"[{coord}, {coord}]"] * 5)
+    template = ('{"type": "Feature", "properties": {"%s": %%s}, '
+                '"geometry": {"type": "Polygon", "coordinates": [[%s]]}}') % (property_name, ring)
+
+    header = {"type": "FeatureCollection", "name": os.path.splitext(os.path.basename(output_file))[0]}
+    crs_member = _crs_member(crs)
+    if crs_member:
+        header["crs"] = crs_member
+
+    count = 0
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(header)[:-1] + ', "features": [\n')
+        indices = np.flatnonzero(keep)
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            # Columns in template order: value, then the 5 ring vertices as in shapely's box()
+            columns = np.column_stack([
+                flat_values[chunk],
+                x_max[chunk], y_min[chunk],
+                x_max[chunk], y_max[chunk],
+                x_min[chunk], y_max[chunk],
+                x_min[chunk], y_min[chunk],
+                x_max[chunk], y_min[chunk],
+            ]).tolist()
+            lines = ",\n".join(template % tuple(row) for row in columns)
+            if count:
+                f.write(",\n")
+            f.write(lines)
+            count += len(chunk)
+        f.write("\n]}\n")
+
+    return count
+
+
+def to_geodataframe(values, transform, crs, block_size, property_name):
+    """Build a GeoDataFrame of the non-NaN blocks with vectorized shapely boxes."""
+    rows, cols = values.shape
+    x_min, y_min, x_max, y_max = block_bounds(transform, rows, cols, block_size)
+    flat_values = values.ravel()
+    keep = ~np.isnan(flat_values)
+    geometry = shapely.box(x_min[keep], y_min[keep], x_max[keep], y_max[keep])
+    return gpd.GeoDataFrame({property_name: flat_values[keep]}, geometry=geometry, crs=crs)
+
+
+def _compress(payload, output_file):
+    if output_file.endswith('.gz'):
+        # mtime=0 keeps the output byte-identical between runs
+        return gzip.compress(payload, compresslevel=9, mtime=0)
+    if output_file.endswith('.br'):
+        try:
+            import brotli
+        except ImportError:
+            raise ImportError("Writing .grid.br needs the brotli package (pip install brotli)") from None
+        return brotli.compress(payload)
+    return payload
+
+
+def write_binary_grid(values, transform, crs, block_size, output_file, property_name, dtype='uint8'):
+    """Write a block grid as header + packed values (see the module docstring), NaN cells as no data.
+
+    uint8 spreads the value range over 255 codes (255 = no data); float16 keeps ~3 significant digits.
+    Returns the number of cells with data.
+    """
+    rows, cols = values.shape
+    cell_transform = transform * Affine.scale(block_size)
+    valid = ~np.isnan(values)
+    header = {
+        'rows': rows,
+        'cols': cols,
+        'origin': [cell_transform.c, cell_transform.f],
+        'cell_size': [cell_transform.a, cell_transform.e],
+        'crs': crs.to_string() if crs is not None else None,
+        'property': property_name,
+        'dtype': dtype,
+    }
+
+    if dtype == 'uint8':
+        low = float(values[valid].min()) if valid.any() else 0.0
+        high = float(values[valid].max()) if valid.any() else 0.0
+        scale = (high - low) / (UINT8_NODATA - 1) or 1.0
+        packed = np.full(values.shape, UINT8_NODATA, dtype=np.uint8)
+        packed[valid] = np.round((values[valid] - low) / scale)
+        header.update(offset=low, scale=scale, nodata=UINT8_NODATA)
+    elif dtype == 'float16':
+        packed = values.astype('<f2')
+    else:
+        raise ValueError(f"Unsupported grid value type: {dtype}")
+
+    # Corners (top left, top right, bottom right, bottom left) in lon/lat
+    xs = [cell_transform.c, cell_transform.c + cols * cell_transform.a]
+    ys = [cell_transform.f, cell_transform.f + rows * cell_transform.e]
+    corner_xs, corner_ys = [xs[0], xs[1], xs[1], xs[0]], [ys[0], ys[0], ys[1], ys[1]]
+    if crs is not None and crs.to_epsg() != 4326:
+        corner_xs, corner_ys = transform_coords(crs, 'EPSG:4326', corner_xs, corner_ys)
+    header['corners'] = [[x, y] for x, y in zip(corner_xs, corner_ys)]
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-(12 + len(header_bytes)) % 8)
+    payload = (GRID_MAGIC + struct.pack('<BBxxI', GRID_VERSION, GRID_DTYPES[dtype], len(header_bytes))
+               + header_bytes + packed.tobytes())
+    with open(output_file, 'wb') as f:
+        f.write(_compress(payload, output_file))
+    return int(valid.sum())
+
+
+def read_binary_grid(input_file):
+    """Read a binary grid back; returns (values as float32 with NaN for no data, header)."""
+    with open(input_file, 'rb') as f:
+        payload = f.read()
+    if payload[:2] == b'\x1f\x8b':
+        payload = gzip.decompress(payload)
+    elif payload[:4] != GRID_MAGIC:
+        import brotli
+        payload = brotli.decompress(payload)
+
+    version, dtype_code, header_length = struct.unpack_from('<BBxxI', payload, 4)
+    if payload[:4] != GRID_MAGIC or version != GRID_VERSION:
+        raise ValueError(f"{input_file} is not a version {GRID_VERSION} binary grid")
+    header = json.loads(payload[12:12 + header_length])
+    shape = (header['rows'], header['cols'])
+    if dtype_code == GRID_DTYPES['uint8']:
+        codes = np.frombuffer(payload, np.uint8, shape[0] * shape[1], 12 + header_length).reshape(shape)
+        values = (header['offset'] + codes * header['scale']).astype(np.float32)
+        values[codes == header['nodata']] = np.nan
+    else:
+        values = np.frombuffer(payload, '<f2', shape[0] * shape[1], 12 + header_length).reshape(shape).astype(np.float32)
+    return values, header
+
+
+VECTOR_FORMATS = {'.json': 'GeoJSON', '.geojson': 'GeoJSON', '.fgb': 'FlatGeobuf', '.parquet': 'GeoParquet'}
+
+
+def is_binary_grid(output_file):
+    return output_file.lower().endswith(('.grid', '.grid.gz', '.grid.br'))
+
+
+def grid_format_name(output_file):
+    """Human-readable name of the format write_block_grid picks for output_file."""
+    if is_binary_grid(output_file):
+        return 'binary grid'
+    extension = os.path.splitext(output_file)[1].lower()
+    if extension not in VECTOR_FORMATS:
+        raise ValueError(f"Unsupported grid output format: {extension}")
+    return VECTOR_FORMATS[extension]
+
+
+def write_block_grid(values, transform, crs, block_size, output_file, property_name, precision=None,
+                     grid_dtype='uint8'):
+    """Write a block grid, picking the format from the file extension.
+
+    .json/.geojson -> streamed GeoJSON, .fgb -> FlatGeobuf, .parquet -> GeoParquet (needs pyarrow),
+    .grid/.grid.gz/.grid.br -> binary grid with grid_dtype values.
+    Returns the number of features (cells with data) written.
+    """
+    if is_binary_grid(output_file):
+        return write_binary_grid(values, transform, crs, block_size, output_file, property_name, grid_dtype)
+
+    extension = os.path.splitext(output_file)[1].lower()
+    if extension in ('.json', '.geojson'):
+        return write_geojson(values, transform, crs, block_size, output_file, property_name, precision)
+
+    gdf = to_geodataframe(values, transform, crs, block_size, property_name)
+    if extension == '.fgb':
+        gdf.to_file(output_file, driver='FlatGeobuf')
+    elif extension == '.parquet':
+        gdf.to_parquet(output_file)
+    else:
+        raise ValueError(f"Unsupported grid output format: {extension}")
+    return len(gdf)
@@ -0,0 +1,201 @@
+"""This file offers stage timers and counters that are written as JSON lines or as a Chrome trace.
+
+Wrap a stage in `with stage('shade.reduce_tile', file=path):` and count work inside it with
+`count('tiles_read')`. Counters are attributed to the innermost open stage of the current thread
+and summed per process. Nothing is recorded until enable() is called: stage() then returns a
+shared no-op context manager and count() returns right away, so the hooks can stay in hot loops.
+
+Records go to a JSON lines file, one line per finished stage plus a summary line per process on
+disable(). Process-pool workers pick up the SHADE_TRACE environment variable set by enable() (spawn)
+or replace the recorder they inherited (fork) and append to the same file; every process opens it
+with O_APPEND and writes its summary when it exits. A trace file
+ending in .json is converted to the Chrome trace format (chrome://tracing, Perfetto) on disable().
+"""
+import os
+import json
+import time
+import atexit
+import threading
+import multiprocessing.util
+from contextlib import nullcontext
+
+TRACE_ENV = 'SHADE_TRACE'
+
+_recorder = None
+_owner_pid = None
+_finalizer = None
+_NULL_STAGE = nullcontext()
+
+
+class _Recorder:
+    def __init__(self, trace_file, fresh=False):
+        self.trace_file = trace_file
+        self.pid = os.getpid()
+        self.events_file = trace_file + 'l' if trace_file.endswith('.json') else trace_file
+        if fresh:
+            open(self.events_file, 'w').close()
+        # Every process appends through O_APPEND and writes each record with a single write(), so
+        # records from the parent and its workers never overwrite or split each other (fork or spawn)
+        self.fd = os.open(self.events_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.totals = {}
+        self.stage_totals = {}
+
+    def write(self, record):
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self.lock:
+            os.write(self.fd, line)
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def count(self, name, value):
+        with self.lock:
+            self.totals[name] = self.totals.get(name, 0) + value
+        stack = self.stack()
+        if stack:
+            counters = stack[-1].counters
+            counters[name] = counters.get(name, 0) + value
+
+    def close(self):
+        self.write({'type': 'summary', 'pid': os.getpid(), 'counters': self.totals, 'stages': self.stage_totals})
+        os.close(self.fd)
+
+
+class _Stage:
+    def __init__(self, recorder, name, fields):
+        self.recorder = recorder
+        self.name = name
+        self.fields = fields
+        self.counters = {}
+
+    def __enter__(self):
+        self.recorder.stack().append(self)
+        self.start = time.time()
+        self.start_counter = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start_counter
+        recorder = self.recorder
+        recorder.stack().pop()
+        with recorder.lock:
+            totals = recorder.stage_totals.setdefault(self.name, {'count': 0, 'seconds': 0.0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+        recorder.write({'type': 'stage', 'name': self.name, 'start': self.start, 'seconds': seconds,
+                        'pid': os.getpid(), 'tid': threading.get_ident(), 'counters': self.counters,
+                        **self.fields})
+        return False
+
+
+def _process_recorder():
+    """The recorder of this process; a forked worker swaps the parent's copy for its own."""
+    global _recorder, _finalizer
+    if _recorder.pid != os.getpid():
+        os.close(_recorder.fd)
+        _recorder = _Recorder(_recorder.trace_file)
+    if _finalizer is None or not _finalizer.still_active():
+        # Fork and forkserver pool workers leave through os._exit, which skips atexit but runs the
+        # multiprocessing finalizers. Those are cleared when a worker starts, so register on first use.
+        _finalizer = multiprocessing.util.Finalize(None, disable, exitpriority=0)
+    return _recorder
+
+
+def stage(name, **fields):
+    """Context manager timing one stage; extra fields (e.g. file=path) go into its record."""
+    if _recorder is None:
+        return _NULL_STAGE
+    return _Stage(_process_recorder(), name, fields)
+
+
+def count(name, value=1):
+    """Add value to a counter of the current stage and of the process totals."""
+    if _recorder is None:
+        return
+    _process_recorder().count(name, value)
+
+
+def enabled():
+    return _recorder is not None
+
+
+def enable(trace_file):
+    """Start recording into trace_file (.jsonl for JSON lines, .json for a Chrome trace)."""
+    global _recorder, _owner_pid
+    if _recorder is not None:
+        return
+    # Pool workers inherit the variable and append to the same events file
+    os.environ[TRACE_ENV] = trace_file
+    _owner_pid = os.getpid()
+    _recorder = _Recorder(trace_file, fresh=True)
+    atexit.register(disable)
+
+
+def disable():
+    """Stop recording, write the summary and, for a .json trace file, the Chrome trace."""
+    global _recorder
+    if _recorder is None:
+        return
+    recorder, _recorder = _recorder, None
+    recorder.close()
+    if os.getpid() == _owner_pid:
+        os.environ.pop(TRACE_ENV, None)
+        if recorder.trace_file != recorder.events_file:
+            write_chrome_trace(recorder.events_file, recorder.trace_file)
+
+
+def finish():
+    """Stop recording and print the per-stage summary of the run."""
+    if _recorder is None:
+        return
+    events_file = _recorder.events_file
+    disable()
+    summarize(events_file)
+
+
+def read_events(events_file):
+    with open(events_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_chrome_trace(events_file, trace_file):
+    """Convert a JSON lines file into Chrome's trace event format (complete events in microseconds)."""
+    events = []
+    for record in read_events(events_file):
+        if record['type'] != 'stage':
+            continue
+        args = {key: value for key, value in record.items()
+                if key not in ('type', 'name', 'start', 'seconds', 'pid', 'tid', 'counters')}
+        args.update(record['counters'])
+        events.append({'name': record['name'], 'ph': 'X', 'ts': record['start'] * 1e6,
+                       'dur': record['seconds'] * 1e6, 'pid': record['pid'], 'tid': record['tid'], 'args': args})
+    with open(trace_file, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def summarize(events_file):
+    """Print the total time and counters per stage name over all processes, slowest first."""
+    stages = {}
+    for record in read_events(events_file):
+        if record['type'] != 'stage':
+            continue
+        totals = stages.setdefault(record['name'], {'count': 0, 'seconds': 0.0, 'counters': {}})
+        totals['count'] += 1
+        totals['seconds'] += record['seconds']
+        for name, value in record['counters'].items():
+            totals['counters'][name] = totals['counters'].get(name, 0) + value
+
+    print(f"\n{'stage':<28} {'calls':>6} {'seconds':>9}  counters")
+    for name, totals in sorted(stages.items(), key=lambda item: -item[1]['seconds']):
+        counters = ', '.join(f"{key}={value}" for key, value in sorted(totals['counters'].items()))
+        print(f"{name:<28} {totals['count']:>6} {totals['seconds']:>9.3f}  {counters}")
+
+
+if os.environ.get(TRACE_ENV):
+    # A pool worker of an instrumented run: record into the parent's events file
+    _recorder = _Recorder(os.environ[TRACE_ENV])
+    atexit.register(disable)
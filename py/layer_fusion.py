@@ -0,0 +1,206 @@
+"""This file fuses the shade, LST, NDVI/NDBI, deprivation and housing layers onto one block grid.
+
+Every raster layer is resampled (area-weighted average) onto a shared grid in a single warp call,
+and the housing listings are binned into the same cells with one bincount. The result is a
+columnar table with one row per cell and one column per metric, written as Parquet, so
+cross-layer questions ("hot, unshaded, deprived cells") become column filters instead of
+overlaying polygons in the browser.
+
+The grid is snapped to multiples of the cell size in its CRS (like BlockMosaic), so tables built
+from different runs or subsets of the layers line up cell by cell.
+"""
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import rasterio
+from affine import Affine
+from pyproj import Transformer
+from rasterio.crs import CRS
+from rasterio.warp import reproject, transform_bounds, Resampling
+
+GRID_CRS = CRS.from_epsg(32643)  # UTM zone 43N, the CRS of the Landsat layers, in metres
+
+
+def common_grid(bounds, cell_size):
+    """(transform, (rows, cols)) of a north-up grid covering bounds, snapped to cell_size."""
+    left, bottom, right, top = bounds
+    left = np.floor(left / cell_size) * cell_size
+    top = np.ceil(top / cell_size) * cell_size
+    cols = int(np.ceil((right - left) / cell_size))
+    rows = int(np.ceil((top - bottom) / cell_size))
+    return Affine(cell_size, 0, left, 0, -cell_size, top), (rows, cols)
+
+
+def union_bounds(layers, grid_crs):
+    """Bounds in grid_crs covering every (data, transform, crs, nodata) layer."""
+    all_bounds = []
+    for data, transform, crs, _ in layers:
+        rows, cols = data.shape
+        left, top = transform * (0, 0)
+        right, bottom = transform * (cols, rows)
+        all_bounds.append(transform_bounds(crs, grid_crs, min(left, right), min(bottom, top),
+                                           max(left, right), max(bottom, top)))
+    all_bounds = np.array(all_bounds)
+    return all_bounds[:, 0].min(), all_bounds[:, 1].min(), all_bounds[:, 2].max(), all_bounds[:, 3].max()
+
+
+def read_layer(path, band=1, store=None):
+    """(data, transform, crs, nodata) of one band, memory-mapped from a RasterStore if given."""
+    if store is not None:
+        return store.load(path, band)
+    with rasterio.open(path) as src:
+        return src.read(band), src.transform, src.crs, src.nodata
+
+
+def resample_to_grid(data, transform, crs, nodata, grid_transform, grid_shape, grid_crs=GRID_CRS):
+    """Area-weighted average of a raster layer over every grid cell; uncovered cells are NaN.
+
+    The band is warped in its stored dtype, so a memory-mapped band from a RasterStore is read
+    in place instead of being copied to float32 first.
+    """
+    source = np.asarray(data)
+    if nodata is None and np.issubdtype(source.dtype, np.floating):
+        nodata = np.nan
+
+    resampled = np.full(grid_shape, np.nan, dtype=np.float32)
+    reproject(source=source, destination=resampled,
+              src_transform=transform, src_crs=crs, src_nodata=nodata,
+              dst_transform=grid_transform, dst_crs=grid_crs, dst_nodata=np.nan,
+              resampling=Resampling.average)
+    return resampled
+
+
+def bin_points(lons, lats, values, grid_transform, grid_shape, grid_crs=GRID_CRS):
+    """Mean value and number of points per grid cell; cells without points are NaN / 0."""
+    to_grid = Transformer.from_crs(CRS.from_epsg(4326), grid_crs, always_xy=True)
+    x, y = to_grid.transform(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+    cols, rows = ~grid_transform * (x, y)
+    rows = np.floor(rows).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+
+    num_rows, num_cols = grid_shape
+    inside = (rows >= 0) & (rows < num_rows) & (cols >= 0) & (cols < num_cols)
+    cells = rows[inside] * num_cols + cols[inside]
+
+    counts = np.bincount(cells, minlength=num_rows * num_cols)
+    sums = np.bincount(cells, weights=np.asarray(values, dtype=np.float64)[inside], minlength=num_rows * num_cols)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return means.reshape(grid_shape), counts.reshape(grid_shape)
+
+
+def fuse_layers(raster_layers, cell_size=100, point_layers=None, grid_crs=GRID_CRS, bounds=None):
+    """Resample every layer onto one grid and return (table, grid_transform, grid_shape).
+
+    raster_layers maps a column name to (data, transform, crs, nodata); point_layers maps a column
+    name to (lons, lats, values) and adds a <name> mean and a <name>_count column. Without bounds
+    the grid covers all raster layers. Only cells with a value in at least one layer are kept.
+    """
+    point_layers = point_layers or {}
+    if bounds is None:
+        bounds = union_bounds(raster_layers.values(), grid_crs)
+    grid_transform, grid_shape = common_grid(bounds, cell_size)
+
+    columns = {}
+    for name, (data, transform, crs, nodata) in raster_layers.items():
+        columns[name] = resample_to_grid(data, transform, crs, nodata, grid_transform, grid_shape, grid_crs)
+    for name, (lons, lats, values) in point_layers.items():
+        columns[name], columns[f"{name}_count"] = bin_points(lons, lats, values, grid_transform, grid_shape, grid_crs)
+
+    covered = np.zeros(grid_shape, dtype=bool)
+    for name, column in columns.items():
+        if not name.endswith('_count'):
+            covered |= ~np.isnan(column)
+    rows, cols = np.nonzero(covered)
+
+    # Cell centers in the grid CRS and in lon/lat
+    x, y = grid_transform * (cols + 0.5, rows + 0.5)
+    lon, lat = Transformer.from_crs(grid_crs, CRS.from_epsg(4326), always_xy=True).transform(x, y)
+
+    table = pd.DataFrame({'row': rows.astype(np.int32), 'col': cols.astype(np.int32),
+                          'x': x, 'y': y, 'lon': lon, 'lat': lat})
+    for name, column in columns.items():
+        table[name] = column[rows, cols]
+    return table, grid_transform, grid_shape
+
+
+def write_table(table, output_file, grid_transform, grid_shape, grid_crs=GRID_CRS):
+    """Write the fused table as Parquet; the grid definition goes into the schema metadata."""
+    arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+    grid = {
+        'transform': list(tuple(grid_transform)[:6]),
+        'shape': list(grid_shape),
+        'crs': grid_crs.to_wkt(),
+    }
+    metadata = dict(arrow_table.schema.metadata or {})
+    metadata[b'grid'] = json.dumps(grid).encode('utf-8')
+    pq.write_table(arrow_table.replace_schema_metadata(metadata), output_file)
+
+
+def read_table(input_file):
+    """Read a fused table back as (table, grid_transform, grid_shape, grid_crs)."""
+    arrow_table = pq.read_table(input_file)
+    grid = json.loads(arrow_table.schema.metadata[b'grid'])
+    return (arrow_table.to_pandas(), Affine(*grid['transform']), tuple(grid['shape']),
+            CRS.from_wkt(grid['crs']))
+
+
+def shade_layer(input_directory, block_size, workers=1, cache=None, store=None):
+    """Average shade fraction of the shade tiles as a (data, transform, crs, nodata) layer."""
+    from delhi_shade_fusedata_non_overlapping import accumulate_geotiffs, mosaic_tiles
+
+    accumulated = accumulate_geotiffs(input_directory, block_size, workers=workers, cache=cache, store=store)
+    if accumulated is None:
+        return None
+    subdir_stats, subdir_counts, transforms, crss, _ = accumulated
+    avg_fractions = {subdir: stats.mean() for subdir, stats in subdir_stats.items()}
+    fractions, transform, crs = mosaic_tiles(avg_fractions, transforms, crss, block_size, subdir_counts)
+    # The mosaic holds the unshaded fraction per block
+    return 1 - fractions, transform, crs, None
+
+
+def main(cell_size=100, shade_block_size=5, workers=1, store_dir=None):
+    from delhi_housing_prices import load_listings
+    from raster_store import RasterStore
+
+    store = RasterStore(store_dir) if store_dir else None
+    output_file = "fused_layers.parquet"
+
+    raster_layers = {
+        'lst': read_layer("LST_Clipped.tif", store=store),
+        'ndvi_ndbi': read_layer("NDVI_NDBI_comp_clipped.tif", store=store),
+        'deprivation': read_layer("poverty.tif", store=store),
+    }
+    shade = shade_layer("fusedata", shade_block_size, workers=workers, store=store)
+    if shade is not None:
+        raster_layers['shade_fraction'] = shade
+
+    listings = load_listings("delhi.csv")
+    point_layers = {
+        'housing_price_per_sqm': (listings['longitude'].to_numpy(), listings['latitude'].to_numpy(),
+                                  listings['Price_sqft'].to_numpy()),
+    }
+
+    table, grid_transform, grid_shape = fuse_layers(raster_layers, cell_size, point_layers)
+    write_table(table, output_file, grid_transform, grid_shape)
+    print(f"\nFused {len(raster_layers) + len(point_layers)} layers onto a {grid_shape[0]}x{grid_shape[1]} grid "
+          f"of {cell_size} m cells: {len(table)} cells written to {output_file}")
+
+    # Example cross-layer query: hot, unshaded and deprived cells (top/bottom quarter of the
+    # cells that have all three layers)
+    if 'shade_fraction' in table:
+        covered = table.dropna(subset=['lst', 'shade_fraction', 'deprivation'])
+        hot = covered['lst'] > covered['lst'].quantile(0.75)
+        unshaded = covered['shade_fraction'] < covered['shade_fraction'].quantile(0.25)
+        deprived = covered['deprivation'] > covered['deprivation'].quantile(0.75)
+        print(f"Hot, unshaded and deprived cells: {int((hot & unshaded & deprived).sum())} of {len(covered)}")
+
+
+if __name__ == "__main__":
+    cell_size = 100  # Grid cell size in metres
+    shade_block_size = 5  # Shade is reduced to blocks of this many pixels before resampling
+    workers = 1
+    store_dir = ".raster_store"  # Set to None to decode every raster from its GeoTIFF
+    main(cell_size, shade_block_size, workers, store_dir)
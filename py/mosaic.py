@@ -0,0 +1,83 @@
+"""This file offers a block mosaic that merges any number of overlapping tiles onto one global grid."""
+import numpy as np
+from affine import Affine
+
+
+class BlockMosaic:
+    """Snap per-block values of many tiles onto a global block grid and average the overlaps.
+
+    The global grid has its origin at (0, 0) in the tiles' CRS and a cell size of
+    cell_width x cell_height, so the same location always maps to the same cell no matter
+    which or how many tiles are added. Every tile block is assigned to the global cell that
+    contains its center; cells covered by several tiles get the weighted mean of their values.
+
+    Cells are resolved with a grid hash (sort + bincount over the flattened cell keys), which is
+    O(n log n) in the number of tile blocks.
+    """
+
+    def __init__(self, cell_width, cell_height):
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self._rows = []
+        self._cols = []
+        self._values = []
+        self._weights = []
+
+    @classmethod
+    def for_tile(cls, transform, block_size):
+        """Create a mosaic whose cells are block_size x block_size pixels of the given tile."""
+        return cls(transform.a * block_size, transform.e * block_size)
+
+    def add_tile(self, values, transform, block_size, weights=None):
+        """Add a (blocks_y, blocks_x) grid of block values of one tile.
+
+        NaN values are ignored. weights (e.g. the number of valid pixels per block) default to 1.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        blocks_y, blocks_x = values.shape
+        if weights is None:
+            weights = np.ones_like(values)
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), values.shape)
+
+        # Block centers in the CRS, straight from the affine transform
+        col_centers = (np.arange(blocks_x) + 0.5) * block_size
+        row_centers = (np.arange(blocks_y) + 0.5) * block_size
+        center_x = transform.c + transform.a * col_centers[np.newaxis, :] + transform.b * row_centers[:, np.newaxis]
+        center_y = transform.f + transform.d * col_centers[np.newaxis, :] + transform.e * row_centers[:, np.newaxis]
+
+        keep = ~np.isnan(values) & (weights > 0)
+        self._cols.append(np.floor(center_x[keep] / self.cell_width).astype(np.int64))
+        self._rows.append(np.floor(center_y[keep] / self.cell_height).astype(np.int64))
+        self._values.append(values[keep])
+        self._weights.append(weights[keep])
+
+    def resolve(self):
+        """Return (grid, transform) of the weighted mean per global cell; uncovered cells are NaN.
+
+        Raises ValueError if no tile added a block with data.
+        """
+        if not sum(len(values) for values in self._values):
+            raise ValueError(f"No blocks with data to mosaic ({len(self._values)} tiles added, all empty)")
+
+        rows = np.concatenate(self._rows)
+        cols = np.concatenate(self._cols)
+        values = np.concatenate(self._values)
+        weights = np.concatenate(self._weights)
+
+        row_min, col_min = rows.min(), cols.min()
+        height = int(rows.max() - row_min + 1)
+        width = int(cols.max() - col_min + 1)
+
+        # Hash every block to a flat cell key and merge blocks that land in the same cell
+        keys = (rows - row_min) * width + (cols - col_min)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        weighted_sums = np.bincount(inverse, weights=values * weights, minlength=len(unique_keys))
+        weight_totals = np.bincount(inverse, weights=weights, minlength=len(unique_keys))
+
+        grid = np.full(height * width, np.nan)
+        grid[unique_keys] = weighted_sums / weight_totals
+        grid = grid.reshape(height, width)
+
+        transform = Affine(self.cell_width, 0.0, col_min * self.cell_width,
+                           0.0, self.cell_height, row_min * self.cell_height)
+        return grid, transform
@@ -0,0 +1,432 @@
+"""This file runs the whole py/ pipeline from one command as a graph of incremental stages.
+
+    python pipeline.py                    # bring every output up to date
+    python pipeline.py fuse --jobs 4      # only the fused table and the stages it needs
+    python pipeline.py --dry-run          # show what would run
+    python pipeline.py --block-size 10 --force shade.export
+
+Every stage declares its input files, output files and parameters. A stage is skipped when the
+content hashes of its inputs and its parameters match the last successful run (kept in
+.pipeline/state.json) and all its outputs exist; otherwise it runs, and so do the stages that
+depend on it, unless its outputs come out byte-identical. File hashes are remembered per
+(size, mtime), so unchanged files are not re-read to be hashed.
+
+Stages whose dependencies are done run concurrently in a process pool, so the shade, LST, water,
+deprivation and housing branches proceed in parallel.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from reduction_cache import file_hash
+
+STATE_DIR = '.pipeline'
+
+
+class Stage:
+    def __init__(self, name, func, inputs, outputs, params=(), deps=()):
+        self.name = name
+        self.func = func
+        self.inputs = inputs  # Paths or glob patterns
+        self.outputs = outputs
+        self.params = params  # Names of the config entries the stage depends on
+        self.deps = deps
+
+
+def _state_path(config, name):
+    return os.path.join(config['state_dir'], name)
+
+
+def _out(config, name):
+    return os.path.join(config['output_directory'], name)
+
+
+# Stage functions run in pool workers, so they are module-level and take the plain config dict
+
+def run_shade_reduce(config):
+    import numpy as np
+    from delhi_shade_fusedata_non_overlapping import accumulate_geotiffs
+    from reduction_cache import ReductionCache
+
+    cache = ReductionCache(config['cache_dir']) if config['cache_dir'] else None
+    accumulated = accumulate_geotiffs(config['input_directory'], config['block_size'],
+                                      workers=config['workers'], cache=cache)
+    if accumulated is None:
+        raise RuntimeError(f"No shade tiles found in {config['input_directory']}")
+    subdir_stats, subdir_counts, transforms, crss, _ = accumulated
+
+    arrays = {}
+    for subdir, stats in subdir_stats.items():
+        arrays[f"fractions_{subdir}"] = stats.mean()
+        arrays[f"counts_{subdir}"] = subdir_counts[subdir]
+        arrays[f"transform_{subdir}"] = np.array(tuple(transforms[subdir])[:6])
+        arrays[f"crs_{subdir}"] = np.array(crss[subdir].to_wkt())
+    np.savez(_state_path(config, 'shade_blocks.npz'), **arrays)
+
+
+def run_shade_mosaic(config):
+    import numpy as np
+    from affine import Affine
+    from rasterio.crs import CRS
+    from block_pyramid import save_pyramid
+    from delhi_shade_fusedata_non_overlapping import build_shade_pyramid
+
+    with np.load(_state_path(config, 'shade_blocks.npz')) as data:
+        subdirs = [name[len('fractions_'):] for name in data.files if name.startswith('fractions_')]
+        fractions = {subdir: data[f"fractions_{subdir}"] for subdir in subdirs}
+        # Blocks written before the counts were kept weigh block_size x block_size pixels each
+        counts = ({subdir: data[f"counts_{subdir}"] for subdir in subdirs}
+                  if all(f"counts_{subdir}" in data.files for subdir in subdirs) else None)
+        transforms = {subdir: Affine(*data[f"transform_{subdir}"]) for subdir in subdirs}
+        crss = {subdir: CRS.from_wkt(str(data[f"crs_{subdir}"])) for subdir in subdirs}
+
+    level_grids, crs = build_shade_pyramid(fractions, transforms, crss, config['block_size'],
+                                           config['pyramid_levels'], counts)
+    save_pyramid(_out(config, 'average_shade_pyramid.npz'), level_grids, crs)
+
+
+def run_shade_export(config):
+    from block_pyramid import load_pyramid_level
+    from rasterio.crs import CRS
+    from delhi_shade_fusedata_non_overlapping import create_geojson
+
+    for block_size, output_file in shade_export_files(config).items():
+        fractions, transform, crs_wkt = load_pyramid_level(_out(config, 'average_shade_pyramid.npz'), block_size)
+        create_geojson(fractions, transform, CRS.from_wkt(crs_wkt), 1, output_file)
+
+
+def run_shade_grid(config):
+    from block_pyramid import load_pyramid_level
+    from rasterio.crs import CRS
+    from delhi_shade_fusedata_non_overlapping import create_geojson
+
+    for block_size, output_file in shade_grid_files(config).items():
+        fractions, transform, crs_wkt = load_pyramid_level(_out(config, 'average_shade_pyramid.npz'), block_size)
+        create_geojson(fractions, transform, CRS.from_wkt(crs_wkt), 1, output_file, grid_dtype=config['grid_dtype'])
+
+
+def run_shade_cube(config):
+    from shade_cube import build_cubes
+    from reduction_cache import ReductionCache
+
+    cache = ReductionCache(config['cache_dir']) if config['cache_dir'] else None
+    build_cubes(config['input_directory'], config['block_size'], _out(config, 'shade_cube'),
+                config['cube_dtype'], cache=cache, require_times=config['require_times'])
+
+
+def _raster_to_geojson(config, raster_file, output_file):
+    from convert_geotiff import geotiff_to_geojson
+    geojson_output = geotiff_to_geojson(raster_file, config['pool_size'])
+    with open(output_file, 'w') as f:
+        f.write(geojson_output)
+
+
+def run_lst_export(config):
+    _raster_to_geojson(config, config['lst_file'], _out(config, 'lst_clipped.geojson'))
+
+
+def run_water_export(config):
+    _raster_to_geojson(config, config['ndvi_ndbi_file'], _out(config, 'ndvi_ndbi.geojson'))
+
+
+def run_deprivation_export(config):
+    from geotiff_from_UTM import geotiff_to_geojson
+    geojson_output = geotiff_to_geojson(config['deprivation_file'], config['grid_size'])
+    with open(_out(config, 'deprivation_index.geojson'), 'w') as f:
+        f.write(geojson_output)
+
+
+def run_housing_export(config):
+    from delhi_housing_prices import load_listings, create_geojson_columnar
+    geojsons = create_geojson_columnar(load_listings(config['housing_file']), [config['h3_resolution']])
+    with open(_out(config, 'delhi_housing_hexbins.geojson'), 'w', encoding='utf-8') as f:
+        json.dump(geojsons[config['h3_resolution']], f, ensure_ascii=False, indent=2)
+
+
+def run_fuse(config):
+    from block_pyramid import load_pyramid_level
+    from rasterio.crs import CRS
+    from delhi_housing_prices import load_listings
+    from layer_fusion import read_layer, fuse_layers, write_table
+
+    fractions, transform, crs_wkt = load_pyramid_level(_out(config, 'average_shade_pyramid.npz'),
+                                                       config['block_size'])
+    raster_layers = {
+        'lst': read_layer(config['lst_file']),
+        'ndvi_ndbi': read_layer(config['ndvi_ndbi_file']),
+        'deprivation': read_layer(config['deprivation_file']),
+        # The pyramid stores the unshaded fraction
+        'shade_fraction': (1 - fractions, transform, CRS.from_wkt(crs_wkt), None),
+    }
+    listings = load_listings(config['housing_file'])
+    point_layers = {
+        'housing_price_per_sqm': (listings['longitude'].to_numpy(), listings['latitude'].to_numpy(),
+                                  listings['Price_sqft'].to_numpy()),
+    }
+    table, grid_transform, grid_shape = fuse_layers(raster_layers, config['cell_size'], point_layers)
+    write_table(table, _out(config, 'fused_layers.parquet'), grid_transform, grid_shape)
+    print(f"Fused table: {len(table)} cells on a {grid_shape[0]}x{grid_shape[1]} grid")
+
+
+def run_tiles(config):
+    from vector_tiles import export_vector_tiles
+    layer_files = {
+        'shade': shade_export_files(config)[config['block_size']],
+        'temperature': _out(config, 'lst_clipped.geojson'),
+        'water': _out(config, 'ndvi_ndbi.geojson'),
+        'housing': _out(config, 'delhi_housing_hexbins.geojson'),
+    }
+    num_tiles = export_vector_tiles(layer_files, _out(config, 'delhi_layers.mbtiles'),
+                                    config['minzoom'], config['maxzoom'])
+    print(f"Vector tiles: {num_tiles} tiles")
+
+
+def shade_export_files(config):
+    """{block size: GeoJSON file} written by shade.export, one per pyramid level."""
+    from block_pyramid import pyramid_block_sizes
+    if config['pyramid_levels'] == 1:
+        return {config['block_size']: _out(config, 'average_shade.json')}
+    return {block_size: _out(config, f"average_shade_bs{block_size}.json")
+            for block_size in pyramid_block_sizes(config['block_size'], config['pyramid_levels'])}
+
+
+def shade_grid_files(config):
+    """{block size: binary grid file} written by shade.grid for the web app, one per pyramid level."""
+    from block_pyramid import pyramid_block_sizes
+    return {block_size: _out(config, f"average_shade_bs{block_size}.grid.gz")
+            for block_size in pyramid_block_sizes(config['block_size'], config['pyramid_levels'])}
+
+
+def build_stages(config):
+    """The stage graph: ingest -> reduce -> mosaic -> export/fuse -> tiles."""
+    shade_blocks = _state_path(config, 'shade_blocks.npz')
+    pyramid = _out(config, 'average_shade_pyramid.npz')
+    shade_json = list(shade_export_files(config).values())
+    lst_json = _out(config, 'lst_clipped.geojson')
+    water_json = _out(config, 'ndvi_ndbi.geojson')
+    housing_json = _out(config, 'delhi_housing_hexbins.geojson')
+    areas = sorted(entry for entry in os.listdir(config['input_directory'])
+                   if os.path.isdir(os.path.join(config['input_directory'], entry)))
+    cube_files = [_out(config, os.path.join('shade_cube', f"{area}.{extension}"))
+                  for area in areas for extension in ('npy', 'json')]
+
+    stages = [
+        Stage('shade.reduce', run_shade_reduce, [os.path.join(config['input_directory'], '*', '*.tiff')],
+              [shade_blocks], params=('block_size',)),
+        Stage('shade.mosaic', run_shade_mosaic, [shade_blocks], [pyramid],
+              params=('block_size', 'pyramid_levels'), deps=('shade.reduce',)),
+        Stage('shade.export', run_shade_export, [pyramid], shade_json,
+              params=('block_size', 'pyramid_levels'), deps=('shade.mosaic',)),
+        Stage('shade.grid', run_shade_grid, [pyramid], list(shade_grid_files(config).values()),
+              params=('block_size', 'pyramid_levels', 'grid_dtype'), deps=('shade.mosaic',)),
+        Stage('shade.cube', run_shade_cube, [os.path.join(config['input_directory'], '*', '*.tiff')],
+              cube_files, params=('block_size', 'cube_dtype', 'require_times')),
+        Stage('lst.export', run_lst_export, [config['lst_file']], [lst_json], params=('pool_size',)),
+        Stage('water.export', run_water_export, [config['ndvi_ndbi_file']], [water_json], params=('pool_size',)),
+        Stage('deprivation.export', run_deprivation_export, [config['deprivation_file']],
+              [_out(config, 'deprivation_index.geojson')], params=('grid_size',)),
+        Stage('housing.export', run_housing_export, [config['housing_file']], [housing_json],
+              params=('h3_resolution',)),
+        Stage('fuse', run_fuse,
+              [pyramid, config['lst_file'], config['ndvi_ndbi_file'], config['deprivation_file'],
+               config['housing_file']],
+              [_out(config, 'fused_layers.parquet')], params=('block_size', 'cell_size'), deps=('shade.mosaic',)),
+        Stage('tiles', run_tiles, shade_json + [lst_json, water_json, housing_json],
+              [_out(config, 'delhi_layers.mbtiles')], params=('block_size', 'minzoom', 'maxzoom'),
+              deps=('shade.export', 'lst.export', 'water.export', 'housing.export')),
+    ]
+    return {stage.name: stage for stage in stages}
+
+
+def load_state(state_file):
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'stages': {}, 'files': {}}
+
+
+def save_state(state_file, state):
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, state_file)
+
+
+def tracked_hash(path, known_files):
+    """Content hash of a file, reusing the stored hash while its size and mtime are unchanged."""
+    stat = os.stat(path)
+    known = known_files.get(path)
+    if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+        return known[2]
+    digest = file_hash(path)
+    known_files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+    return digest
+
+
+def fingerprint(stage, config, known_files):
+    """Hash of the stage's parameters and the content of all its input files."""
+    files = sorted({path for pattern in stage.inputs for path in glob.glob(pattern)})
+    missing = [pattern for pattern in stage.inputs if not glob.glob(pattern)]
+    if missing:
+        raise FileNotFoundError(f"{stage.name}: missing inputs {missing}")
+    description = {
+        'params': {name: config[name] for name in stage.params},
+        'inputs': {path: tracked_hash(path, known_files) for path in files},
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def upstream(stages, targets):
+    """The targets plus every stage they depend on."""
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(stages[name].deps)
+    return selected
+
+
+def run_pipeline(config, targets=None, jobs=1, force=False, dry_run=False):
+    """Run the selected stages whose inputs changed; returns the names of the stages that failed."""
+    os.makedirs(config['state_dir'], exist_ok=True)
+    os.makedirs(config['output_directory'], exist_ok=True)
+    stages = build_stages(config)
+    unknown = set(targets or ()) - set(stages)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}, available: {list(stages)}")
+
+    selected = upstream(stages, targets or list(stages))
+    order = [name for name in stages if name in selected]  # build_stages lists them topologically
+    state_file = os.path.join(config['state_dir'], 'state.json')
+    state = load_state(state_file)
+
+    done, dirty, failed, running = set(), set(), set(), {}
+    start = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=jobs) if not dry_run else None
+    try:
+        while True:
+            for name in order:
+                stage = stages[name]
+                if name in done or name in running.values() or name in failed:
+                    continue
+                if any(dep in failed for dep in stage.deps if dep in selected):
+                    print(f"[skip]    {name} (upstream failed)")
+                    failed.add(name)
+                    continue
+                if not all(dep in done for dep in stage.deps if dep in selected):
+                    continue
+
+                if dry_run and any(dep in dirty for dep in stage.deps):
+                    print(f"[run]     {name} (upstream changed)")
+                    dirty.add(name)
+                    done.add(name)
+                    continue
+
+                try:
+                    stage_fingerprint = fingerprint(stage, config, state['files'])
+                except FileNotFoundError as e:
+                    print(f"[failed]  {e}")
+                    failed.add(name)
+                    state['stages'].pop(name, None)
+                    continue
+                up_to_date = (state['stages'].get(name) == stage_fingerprint
+                              and all(os.path.exists(output) for output in stage.outputs))
+                if up_to_date and not force:
+                    print(f"[skip]    {name} (up to date)")
+                    done.add(name)
+                    continue
+                if dry_run:
+                    print(f"[run]     {name}")
+                    dirty.add(name)
+                    done.add(name)
+                    continue
+
+                print(f"[start]   {name}")
+                future = executor.submit(stage.func, config)
+                future.fingerprint = stage_fingerprint
+                future.started = time.perf_counter()
+                running[future] = name
+
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"[failed]  {name}: {e!r}")
+                    failed.add(name)
+                    state['stages'].pop(name, None)
+                else:
+                    print(f"[done]    {name} in {time.perf_counter() - future.started:.1f} s")
+                    state['stages'][name] = future.fingerprint
+                    done.add(name)
+                save_state(state_file, state)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if not dry_run:
+        print(f"\nPipeline finished in {time.perf_counter() - start:.1f} s"
+              + (f", failed: {sorted(failed)}" if failed else ""))
+    return failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the shade/LST/deprivation/housing pipeline incrementally.")
+    parser.add_argument('targets', nargs='*', help="stages to bring up to date (default: all)")
+    parser.add_argument('--list', action='store_true', help="list the stages and exit")
+    parser.add_argument('--dry-run', action='store_true', help="show which stages would run")
+    parser.add_argument('--force', action='store_true', help="re-run the selected stages even if up to date")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="stages to run concurrently")
+    parser.add_argument('--workers', type=int, default=1, help="processes for reading the shade tiles")
+    parser.add_argument('--input-directory', default='fusedata', help="directory with the hourly shade tiles")
+    parser.add_argument('--output-directory', default='.', help="where the outputs are written")
+    parser.add_argument('--state-dir', default=STATE_DIR, help="where intermediates and run state are kept")
+    parser.add_argument('--cache-dir', default='.reduction_cache', help="reduction cache ('' to disable)")
+    parser.add_argument('--block-size', type=int, default=5, help="shade block size in pixels")
+    parser.add_argument('--pyramid-levels', type=int, default=1, help="shade pyramid levels")
+    parser.add_argument('--cube-dtype', default='uint8', choices=['uint8', 'float16'],
+                        help="encoding of the hourly shade cube")
+    parser.add_argument('--require-times', action='store_true',
+                        help="fail shade.cube on tiles without a time instead of inferring their hour")
+    parser.add_argument('--grid-dtype', default='uint8', choices=['uint8', 'float16'],
+                        help="value type of the binary shade grid for the web app")
+    parser.add_argument('--pool-size', type=int, default=5, help="LST and NDVI/NDBI pooling in pixels")
+    parser.add_argument('--grid-size', type=int, default=4, help="deprivation grid cell size in pixels")
+    parser.add_argument('--cell-size', type=float, default=100, help="fused grid cell size in metres")
+    parser.add_argument('--h3-resolution', type=int, default=8, help="H3 resolution of the housing bins")
+    parser.add_argument('--minzoom', type=int, default=10)
+    parser.add_argument('--maxzoom', type=int, default=15)
+    parser.add_argument('--lst-file', default='LST_Clipped.tif')
+    parser.add_argument('--ndvi-ndbi-file', default='NDVI_NDBI_comp_clipped.tif')
+    parser.add_argument('--deprivation-file', default='poverty.tif')
+    parser.add_argument('--housing-file', default='delhi.csv')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = {name: value for name, value in vars(args).items()
+              if name not in ('targets', 'list', 'dry_run', 'force', 'jobs')}
+
+    if args.list:
+        for name, stage in build_stages(config).items():
+            deps = f" <- {', '.join(stage.deps)}" if stage.deps else ""
+            print(f"{name}{deps}")
+        return 0
+
+    failed = run_pipeline(config, args.targets, args.jobs, args.force, args.dry_run)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""This file pools rasters block-parallel: tiles of the raster are read and pooled on a thread pool.
+
+The raster is split into pool-aligned windows (chunked_reader.block_windows), so no pool straddles
+two windows and every pooled tile has a fixed place in the output. Each thread reads through its
+own dataset handle; GDAL releases the GIL while decoding and NumPy while reducing, so the windows
+proceed in parallel and only about `workers` windows are in memory at a time.
+
+Pooling leaves nodata (and NaN) pixels out, supports mean, median and max, and keeps the partial
+pools at the bottom/right edge. The pooled raster can be written as a Cloud-Optimized GeoTIFF.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from block_reduce import block_mean, block_median, block_max
+from chunked_reader import block_windows
+from instrumentation import stage, count
+
+POOL_METHODS = {'mean': block_mean, 'median': block_median, 'max': block_max}
+
+
+def pool_array(read_window, height, width, pool_size, method='mean', nodata=None, workers=None, tile_size=2048):
+    """Pool a height x width raster window by window; read_window(window) returns one tile.
+
+    Returns float32 pools with NaN where a pool has no valid pixel. Partial pools at the
+    bottom/right edge are kept, so the result is ceil(height / pool_size) x ceil(width / pool_size).
+    """
+    if method not in POOL_METHODS:
+        raise ValueError(f"Unknown pooling method {method!r}, use one of {sorted(POOL_METHODS)}")
+    reduce = POOL_METHODS[method]
+    pooled = np.full((-(-height // pool_size), -(-width // pool_size)), np.nan, dtype=np.float32)
+    windows = list(block_windows(height, width, pool_size, tile_size))
+
+    def pool_window(task):
+        window, pool_row, pool_col = task
+        tile = read_window(window)
+        count('bytes_decoded', tile.nbytes)
+        tile_pools = reduce(tile, pool_size, nodata=nodata, keep_ragged=True)
+        rows, cols = tile_pools.shape
+        pooled[pool_row:pool_row + rows, pool_col:pool_col + cols] = tile_pools
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        # Every window writes a disjoint part of the output, so no locking is needed
+        for _ in executor.map(pool_window, windows):
+            pass
+    count('windows_pooled', len(windows))
+    return pooled
+
+
+def pool_raster(path, pool_size, method='mean', band=1, workers=None, tile_size=2048, cache=None, store=None):
+    """Pool one band of a raster file; returns (pooled, transform, crs, nodata).
+
+    pooled is float32 with NaN for pools without valid pixels; transform is the pooled grid's.
+    With a ReductionCache an unchanged raster is not read again, with a RasterStore the tiles
+    are read from the memory-mapped band instead of being decoded.
+    """
+    with rasterio.open(path) as src:
+        height, width = src.height, src.width
+        transform, crs, nodata = src.transform, src.crs, src.nodata
+
+    def compute():
+        with stage('pool.raster', file=path, pool_size=pool_size, method=method):
+            if store is not None:
+                array = store.load(path, band)[0]
+                pooled = pool_array(lambda window: np.asarray(array[window.toslices()]), height, width,
+                                    pool_size, method, nodata, workers, tile_size)
+            else:
+                local = threading.local()
+                handles = []
+
+                def read_window(window):
+                    # Dataset handles are not thread-safe, so every thread opens its own
+                    if not hasattr(local, 'src'):
+                        local.src = rasterio.open(path)
+                        handles.append(local.src)
+                    return local.src.read(band, window=window)
+
+                try:
+                    pooled = pool_array(read_window, height, width, pool_size, method, nodata, workers, tile_size)
+                finally:
+                    for handle in handles:
+                        handle.close()
+        return {
+            'pooled': pooled,
+            'transform': np.array(tuple(transform * Affine.scale(pool_size))[:6]),
+            'crs': np.array(crs.to_wkt() if crs is not None else ''),
+        }
+
+    if cache is None:
+        arrays = compute()
+    else:
+        params = {'pool_size': pool_size, 'method': method, 'band': band}
+        arrays = cache.get_or_compute(path, 'pool', params, compute)
+
+    crs_wkt = str(arrays['crs'])
+    return arrays['pooled'], Affine(*arrays['transform']), CRS.from_wkt(crs_wkt) if crs_wkt else None, nodata
+
+
+def write_cog(pooled, transform, crs, output_file, nodata=None, compress='deflate'):
+    """Write a pooled raster as a Cloud-Optimized GeoTIFF (tiled, with overviews); NaN pools become nodata."""
+    data = pooled if nodata is None else np.where(np.isnan(pooled), nodata, pooled).astype(pooled.dtype)
+    profile = {
+        'driver': 'COG',
+        'width': pooled.shape[1],
+        'height': pooled.shape[0],
+        'count': 1,
+        'dtype': pooled.dtype,
+        'crs': crs,
+        'transform': transform,
+        'nodata': np.nan if nodata is None else nodata,
+        'compress': compress,
+        'predictor': 3 if np.issubdtype(pooled.dtype, np.floating) else 2,
+        'overview_resampling': 'average',
+    }
+    with stage('pool.write_cog', file=output_file), rasterio.open(output_file, 'w', **profile) as dst:
+        dst.write(data, 1)
+    return output_file
+
+
+if __name__ == "__main__":
+    filepath = "LST_Clipped.tif"
+    pool_size = 8
+    method = "median"  # "mean", "median" or "max"
+    workers = os.cpu_count() or 1
+    output_file = f"LST_Clipped_{method}_{pool_size}.tif"
+    pooled, transform, crs, nodata = pool_raster(filepath, pool_size, method, workers=workers)
+    write_cog(pooled, transform, crs, output_file, nodata)
+    print(f"Pooled {filepath} ({method} of {pool_size}x{pool_size}) to {pooled.shape[0]}x{pooled.shape[1]}, "
+          f"written as a COG to {output_file}")
@@ -0,0 +1,150 @@
+"""This file offers an on-disk store of decoded raster bands as uncompressed, memory-mapped .npy files.
+
+A GeoTIFF is decoded once (window by window, so it never has to fit in memory) into
+<store_dir>/<name>.npy with a <name>.json sidecar holding the transform, CRS, nodata value and
+source file. Later stages and pool workers open the band with np.load(mmap_mode='r'): nothing is
+re-decoded or copied, the OS page cache is shared between processes, and only the store name (a
+short string) has to be sent to a worker instead of a pickled array.
+
+Entries are named after the source file's content hash and band, so a changed file gets a new
+entry and an unchanged one is reused across runs. Like the ReductionCache, the store is bounded by
+max_bytes: after every new entry the least recently opened entries are deleted until it fits.
+Deleting a band that another process still has memory-mapped is safe, its mapping stays valid.
+"""
+import os
+import json
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from chunked_reader import block_windows, array_block_sums
+from reduction_cache import file_hash
+from instrumentation import count
+
+
+class RasterStore:
+    def __init__(self, store_dir='.raster_store', max_bytes=8 << 30):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.decoded = 0
+        self.reused = 0
+        os.makedirs(store_dir, exist_ok=True)
+
+    def _paths(self, name):
+        base = os.path.join(self.store_dir, name)
+        return f"{base}.npy", f"{base}.json"
+
+    def name(self, path, band=1):
+        """Store name of one band of a source file."""
+        return f"{file_hash(path)[:32]}_b{band}"
+
+    def has(self, name):
+        # The sidecar is written last, so its presence marks a complete entry
+        return os.path.exists(self._paths(name)[1])
+
+    def create(self, name, shape, dtype):
+        """Create an empty .npy for writing; call commit() once it is filled."""
+        array_path, _ = self._paths(name)
+        tmp_path = f"{array_path}.{os.getpid()}.tmp"
+        return np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+
+    def commit(self, name, array, transform, crs, nodata=None, source=None):
+        """Flush an array from create() and publish it together with its sidecar metadata."""
+        array_path, meta_path = self._paths(name)
+        array.flush()
+        tmp_array_path = array.filename
+        del array
+        os.replace(tmp_array_path, array_path)
+
+        meta = {
+            'transform': list(tuple(transform)[:6]),
+            'crs': crs.to_wkt() if crs is not None else '',
+            'nodata': nodata,
+            'source': source,
+        }
+        tmp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_meta_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta_path, meta_path)
+        self.evict(keep=name)
+
+    def put(self, name, data, transform, crs, nodata=None, source=None):
+        """Store an in-memory array (e.g. an aligned or resampled band) under name."""
+        array = self.create(name, data.shape, data.dtype)
+        array[...] = data
+        self.commit(name, array, transform, crs, nodata, source)
+
+    def open(self, name):
+        """Open a stored band read-only as (memmap, transform, crs, nodata) without copying it."""
+        array_path, meta_path = self._paths(name)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        array = np.load(array_path, mmap_mode='r')
+        # Mark the entry as recently used for the LRU eviction
+        try:
+            os.utime(meta_path)
+        except FileNotFoundError:
+            pass
+        crs = CRS.from_wkt(meta['crs']) if meta['crs'] else None
+        return array, Affine(*meta['transform']), crs, meta['nodata']
+
+    def evict(self, keep=None):
+        """Delete least recently opened entries (except keep) until the store fits in max_bytes."""
+        entries = []
+        for file_name in os.listdir(self.store_dir):
+            if not file_name.endswith('.json'):
+                continue
+            name = file_name[:-len('.json')]
+            array_path, meta_path = self._paths(name)
+            try:
+                size = os.path.getsize(array_path) + os.path.getsize(meta_path)
+                last_used = os.path.getmtime(meta_path)
+            except FileNotFoundError:
+                continue
+            entries.append((last_used, size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            # The sidecar goes first, so the entry stops counting as complete before its band is removed
+            for entry_path in reversed(self._paths(name)):
+                try:
+                    os.remove(entry_path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            count('store_evicted')
+
+    def decode(self, path, band=1, chunk_size=2048):
+        """Decode one band of a GeoTIFF into the store (if not stored yet) and return its name."""
+        name = self.name(path, band)
+        if self.has(name):
+            self.reused += 1
+            count('store_reused')
+            return name
+
+        with rasterio.open(path) as src:
+            array = self.create(name, (src.height, src.width), src.dtypes[band - 1])
+            for window, _, _ in block_windows(src.height, src.width, 1, chunk_size):
+                chunk = src.read(band, window=window)
+                count('bytes_decoded', chunk.nbytes)
+                array[window.toslices()] = chunk
+            self.commit(name, array, src.transform, src.crs, src.nodata, os.path.abspath(path))
+        self.decoded += 1
+        return name
+
+    def load(self, path, band=1):
+        """Memory-mapped (array, transform, crs, nodata) of one band, decoding it on first use."""
+        return self.open(self.decode(path, band))
+
+    def block_sums(self, path, block_size, band=1, nodata=None, keep_ragged=False):
+        """Per-block (sums, counts, transform, crs) computed from the memory-mapped band."""
+        array, transform, crs, _ = self.load(path, band)
+        sums, counts = array_block_sums(array, block_size, nodata=nodata, keep_ragged=keep_ragged)
+        return sums, counts, transform, crs
+
+    def report(self):
+        print(f"Raster store: {self.decoded} bands decoded, {self.reused} reused from {self.store_dir}")
@@ -0,0 +1,158 @@
+"""This file offers an on-disk cache of raster reductions keyed on file content and parameters.
+
+Entries are uncompressed .npz files named after sha256(file content hash + reduction kind +
+parameters), so a renamed or re-downloaded tile with the same bytes is still a hit, while any
+change to the file or to the block size produces a new key. The cache directory is bounded in
+size and evicts the least recently used entries first (hits refresh the entry's mtime).
+"""
+import os
+import json
+import hashlib
+from functools import lru_cache
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from chunked_reader import read_block_sums
+from instrumentation import count
+
+HASH_CHUNK = 1 << 20
+
+
+def file_hash(path):
+    """sha256 of a file's content, read in 1 MB chunks.
+
+    The hash is remembered per (path, size, mtime) for the life of the process, so a file that
+    several stages open is only hashed once.
+    """
+    stat = os.stat(path)
+    return _content_hash(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=4096)
+def _content_hash(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ReductionCache:
+    def __init__(self, cache_dir='.reduction_cache', max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, path, kind, params):
+        """Cache key of a reduction of the file at path with the given parameters."""
+        description = json.dumps({'kind': kind, 'params': params}, sort_keys=True)
+        return hashlib.sha256((file_hash(path) + description).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        """Return the cached arrays as a dict, or None on a miss."""
+        entry_path = self._entry_path(key)
+        try:
+            with np.load(entry_path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (FileNotFoundError, OSError, ValueError):
+            self.misses += 1
+            count('cache_misses')
+            return None
+        # Mark the entry as recently used for the LRU eviction
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        count('cache_hits')
+        return arrays
+
+    def put(self, key, arrays):
+        """Store a dict of arrays, then evict old entries if the cache is over its size limit."""
+        entry_path = self._entry_path(key)
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def get_or_compute(self, path, kind, params, compute):
+        """Return the cached arrays of a reduction, computing and storing them on a miss.
+
+        compute() must return a dict of arrays.
+        """
+        key = self.key(path, kind, params)
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = compute()
+            self.put(key, arrays)
+        return arrays
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(f"Reduction cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate) in {self.cache_dir}")
+
+
+def cached_block_sums(path, block_size, cache=None, band=1, nodata=None, keep_ragged=False, store=None):
+    """Per-block (sums, counts, transform, crs) of one band, served from the cache when possible.
+
+    The block sums are computed with the windowed reader on a miss, or from the memory-mapped
+    band when a RasterStore is given. Without a cache this is a plain read_block_sums call.
+    """
+    def compute():
+        if store is not None:
+            sums, counts, transform, crs = store.block_sums(path, block_size, band, nodata, keep_ragged)
+            return {
+                'sums': sums,
+                'counts': counts,
+                'transform': np.array(tuple(transform)[:6]),
+                'crs': np.array(crs.to_wkt() if crs is not None else ''),
+            }
+        with rasterio.open(path) as src:
+            sums, counts = read_block_sums(src, block_size, band=band, nodata=nodata, keep_ragged=keep_ragged)
+            return {
+                'sums': sums,
+                'counts': counts,
+                'transform': np.array(tuple(src.transform)[:6]),
+                'crs': np.array(src.crs.to_wkt() if src.crs is not None else ''),
+            }
+
+    if cache is None:
+        arrays = compute()
+    else:
+        params = {'block_size': block_size, 'band': band, 'nodata': nodata, 'keep_ragged': keep_ragged}
+        arrays = cache.get_or_compute(path, 'block_sums', params, compute)
+
+    crs_wkt = str(arrays['crs'])
+    crs = CRS.from_wkt(crs_wkt) if crs_wkt else None
+    return arrays['sums'], arrays['counts'], Affine(*arrays['transform']), crs
@@ -0,0 +1,64 @@
+"""This file offers constant-memory running statistics over a sequence of equally shaped arrays."""
+import numpy as np
+
+
+class RunningStats:
+    """Fold arrays in one at a time and keep per-cell sum/count (and optionally min/max/variance).
+
+    The mean is computed as running sum / count, which is exactly what np.mean(stack, axis=0)
+    returns for the same arrays, so switching from stacking to streaming does not change results.
+    The variance uses Welford's algorithm, which stays numerically stable over many updates.
+    """
+
+    def __init__(self, track_extrema=False, track_variance=False):
+        self.track_extrema = track_extrema
+        self.track_variance = track_variance
+        self.count = 0
+        self.total = None
+        self.minimum = None
+        self.maximum = None
+        self._welford_mean = None
+        self._m2 = None
+
+    def update(self, values):
+        """Fold one array into the aggregate."""
+        values = np.asarray(values, dtype=np.float64)
+        self.count += 1
+
+        if self.total is None:
+            self.total = values.copy()
+            if self.track_extrema:
+                self.minimum = values.copy()
+                self.maximum = values.copy()
+            if self.track_variance:
+                self._welford_mean = values.copy()
+                self._m2 = np.zeros_like(values)
+            return
+
+        if values.shape != self.total.shape:
+            raise ValueError(f"Expected an array of shape {self.total.shape}, got {values.shape}")
+
+        self.total += values
+        if self.track_extrema:
+            np.minimum(self.minimum, values, out=self.minimum)
+            np.maximum(self.maximum, values, out=self.maximum)
+        if self.track_variance:
+            delta = values - self._welford_mean
+            self._welford_mean += delta / self.count
+            self._m2 += delta * (values - self._welford_mean)
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def variance(self, ddof=0):
+        if not self.track_variance:
+            raise ValueError("Variance was not tracked, create RunningStats(track_variance=True)")
+        if self.count - ddof <= 0:
+            return None
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof=0):
+        variance = self.variance(ddof)
+        return None if variance is None else np.sqrt(variance)
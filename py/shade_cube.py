@@ -0,0 +1,228 @@
+"""This file builds a per-area shade cube (hour x block row x block col) instead of one daily mean.
+
+Each hourly tile of an area is reduced to per-block shade fractions and written as one hour slice
+of a memory-mapped .npy cube, with a JSON sidecar holding the hours, block transform, CRS and
+encoding. The hour axis comes first, so "shade at 14:00" reads one contiguous slice, while per-cell
+questions ("hours with at least 50% shade") are single vectorized reductions over the hour axis.
+
+Cubes are stored as uint8 (fraction * 254, 255 = no data; thresholds are compared without
+decoding) or float16 (NaN = no data).
+
+The hour of a tile is taken from its TIFF DateTime tag or from a time in its file name
+("ShadeMap May 20 10.22 AM.tiff", "ShadeMap May 20 17.21.00.tiff"). Tiles without a time fill
+the remaining hourly slots from start_hour on, in file name order, matching the hourly snapshots
+(9 AM to 5 PM) the data set was collected as. Such hours are guesses: the sidecar flags them in
+'inferred' and ShadeCube reports them as inferred. Pass require_times=True to refuse untimed tiles.
+"""
+import os
+import re
+import json
+import glob
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from reduction_cache import cached_block_sums
+from block_reduce import fraction_from_sums
+
+UINT8_SCALE = 254
+UINT8_NODATA = 255
+
+# "10.22 AM", "5:07 pm", "17.21.00", "17:21"
+AMPM_PATTERN = re.compile(r'(?<!\d)(\d{1,2})[.:](\d{2})(?:[.:]\d{2})?\s*([AaPp][Mm])\b')
+CLOCK_PATTERN = re.compile(r'(?<!\d)(\d{1,2})[.:](\d{2})(?:[.:](\d{2}))?(?!\d)')
+
+
+def parse_hour(path):
+    """Time of day in hours (e.g. 10.37) from the TIFF DateTime tag or the file name, or None."""
+    with rasterio.open(path) as src:
+        datetime_tag = src.tags().get('TIFFTAG_DATETIME')
+    if datetime_tag:
+        # "YYYY:MM:DD HH:MM:SS"
+        match = re.search(r'(\d{1,2}):(\d{2}):(\d{2})$', datetime_tag.strip())
+        if match:
+            return int(match.group(1)) + int(match.group(2)) / 60
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    match = AMPM_PATTERN.search(name)
+    if match:
+        hour = int(match.group(1)) % 12 + (12 if match.group(3).lower() == 'pm' else 0)
+        return hour + int(match.group(2)) / 60
+    match = CLOCK_PATTERN.search(name)
+    if match and int(match.group(1)) < 24 and int(match.group(2)) < 60:
+        return int(match.group(1)) + int(match.group(2)) / 60
+    return None
+
+
+def assign_hours(tiff_files, start_hour=9, require_times=False):
+    """Return [(hour, path, inferred)] sorted by hour, one tile per whole hour.
+
+    Tiles with a parsed time take the slot of their rounded-down hour; the others fill the free
+    slots from start_hour on, in file name order, and are marked inferred. With require_times=True
+    untimed tiles raise a ValueError instead.
+    """
+    parsed = {path: parse_hour(path) for path in sorted(tiff_files)}
+    taken = {}
+    for path, hour in parsed.items():
+        if hour is not None:
+            slot = int(hour)
+            if slot in taken:
+                raise ValueError(f"{os.path.basename(path)} and {os.path.basename(taken[slot][0])} "
+                                 f"are both from {slot}:00")
+            taken[slot] = (path, False)
+
+    unknown = [path for path, hour in parsed.items() if hour is None]
+    if unknown and require_times:
+        raise ValueError(f"{len(unknown)} of {len(parsed)} tiles have no time in their tags or name: "
+                         f"{', '.join(os.path.basename(path) for path in unknown)}")
+    slot = start_hour
+    for path in unknown:
+        while slot in taken:
+            slot += 1
+        taken[slot] = (path, True)
+        print(f"  {os.path.basename(path)} has no time in its tags or name, inferred {slot}:00")
+    if unknown:
+        print(f"{len(unknown)} of {len(parsed)} tiles got an inferred hour (flagged in the cube metadata)")
+    return [(hour, path, inferred) for hour, (path, inferred) in sorted(taken.items())]
+
+
+def encode(fractions, dtype):
+    if np.dtype(dtype) == np.uint8:
+        encoded = np.round(np.nan_to_num(fractions) * UINT8_SCALE).astype(np.uint8)
+        encoded[np.isnan(fractions)] = UINT8_NODATA
+        return encoded
+    return fractions.astype(dtype)
+
+
+def decode(values, dtype):
+    if np.dtype(dtype) == np.uint8:
+        decoded = values.astype(np.float32) / UINT8_SCALE
+        decoded[values == UINT8_NODATA] = np.nan
+        return decoded
+    return values.astype(np.float32)
+
+
+def build_cube(tiff_files, block_size, output_file, dtype='uint8', start_hour=9, cache=None, store=None,
+               require_times=False):
+    """Reduce the hourly tiles of one area into an hour x row x col cube of shade fractions.
+
+    Only one tile is held in memory at a time; every hour is written straight into the memmap.
+    """
+    hours = assign_hours(tiff_files, start_hour, require_times)
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    cube = None
+    for index, (hour, tiff_file, _) in enumerate(hours):
+        sums, counts, transform, crs = cached_block_sums(tiff_file, block_size, cache, store=store)
+        # Shaded pixels are 0, so the shade fraction is one minus the unshaded fraction
+        fractions = 1 - fraction_from_sums(sums, counts, 255)
+        if cube is None:
+            cube = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=dtype,
+                                             shape=(len(hours),) + fractions.shape)
+            block_transform = transform * Affine.scale(block_size)
+            block_crs = crs
+        cube[index] = encode(fractions, dtype)
+
+    cube.flush()
+    del cube
+    os.replace(tmp_file, output_file)
+
+    meta = {
+        'hours': [hour for hour, _, _ in hours],
+        'inferred': [inferred for _, _, inferred in hours],
+        'files': [os.path.basename(path) for _, path, _ in hours],
+        'block_size': block_size,
+        'transform': list(tuple(block_transform)[:6]),
+        'crs': block_crs.to_wkt() if block_crs is not None else '',
+        'dtype': np.dtype(dtype).name,
+    }
+    with open(os.path.splitext(output_file)[0] + '.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+    return output_file
+
+
+def build_cubes(input_directory, block_size, cube_directory, dtype='uint8', start_hour=9, cache=None, store=None,
+                require_times=False):
+    """Build one cube per area (subdirectory of input_directory); returns {area: cube file}."""
+    os.makedirs(cube_directory, exist_ok=True)
+    cube_files = {}
+    for area in sorted(os.listdir(input_directory)):
+        tiff_files = glob.glob(os.path.join(input_directory, area, "*.tiff"))
+        if not tiff_files:
+            continue
+        cube_files[area] = build_cube(tiff_files, block_size, os.path.join(cube_directory, f"{area}.npy"),
+                                      dtype, start_hour, cache, store, require_times)
+    return cube_files
+
+
+class ShadeCube:
+    """A memory-mapped shade cube with hour slicing and per-cell reductions over the hours."""
+
+    def __init__(self, cube_file):
+        with open(os.path.splitext(cube_file)[0] + '.json') as f:
+            meta = json.load(f)
+        self.values = np.load(cube_file, mmap_mode='r')
+        self.hours = meta['hours']
+        # Cubes written before the flag existed may hold guessed hours, so they count as inferred
+        self.inferred = meta.get('inferred', [True] * len(self.hours))
+        self.dtype = np.dtype(meta['dtype'])
+        self.transform = Affine(*meta['transform'])
+        self.crs = CRS.from_wkt(meta['crs']) if meta['crs'] else None
+        self.block_size = meta['block_size']
+
+    def hour_index(self, hour):
+        if hour not in self.hours:
+            raise KeyError(f"No snapshot for {hour}:00, available hours: {self.hours}")
+        return self.hours.index(hour)
+
+    @property
+    def inferred_hours(self):
+        """Hours whose tile had no time and was assigned to a free slot."""
+        return [hour for hour, inferred in zip(self.hours, self.inferred) if inferred]
+
+    def hour_label(self, hour):
+        return f"{hour}:00 (inferred)" if self.inferred[self.hour_index(hour)] else f"{hour}:00"
+
+    def at(self, hour):
+        """Shade fraction of every cell at one hour (reads a single slice of the cube)."""
+        return decode(self.values[self.hour_index(hour)], self.dtype)
+
+    def hours_at_least(self, threshold):
+        """Number of hours each cell has at least threshold shade; cells without data count 0 hours."""
+        if self.dtype == np.uint8:
+            # Compare the stored codes directly, the no-data code is excluded explicitly
+            code = np.ceil(threshold * UINT8_SCALE - 1e-9)
+            return ((self.values >= code) & (self.values != UINT8_NODATA)).sum(axis=0, dtype=np.int16)
+        return (self.values >= threshold).sum(axis=0, dtype=np.int16)
+
+    def mean(self):
+        """Daily mean shade fraction per cell over the hours with data."""
+        return np.nanmean(self._decoded(), axis=0)
+
+    def peak_hour(self):
+        """Hour of the most shade per cell."""
+        decoded = np.nan_to_num(self._decoded(), nan=-1)
+        return np.asarray(self.hours)[decoded.argmax(axis=0)]
+
+    def profile(self, row, col):
+        """{hour: shade fraction} of one cell."""
+        return dict(zip(self.hours, decode(self.values[:, row, col], self.dtype).tolist()))
+
+    def _decoded(self):
+        return decode(np.asarray(self.values), self.dtype)
+
+
+if __name__ == "__main__":
+    input_directory = "fusedata"
+    block_size = 5
+    cube_directory = "shade_cube"
+    dtype = "uint8"  # or "float16"
+    cube_files = build_cubes(input_directory, block_size, cube_directory, dtype)
+
+    for area, cube_file in cube_files.items():
+        cube = ShadeCube(cube_file)
+        afternoon = cube.at(14) if 14 in cube.hours else None
+        print(f"{area}: {cube.values.shape} ({cube.values.nbytes / 1e6:.1f} MB), "
+              f"hours {', '.join(cube.hour_label(hour) for hour in cube.hours)}")
+        if afternoon is not None:
+            print(f"  mean shade at {cube.hour_label(14)}: {np.nanmean(afternoon):.3f}")
+        print(f"  cells with at least 50% shade for 4+ hours: {int((cube.hours_at_least(0.5) >= 4).sum())}")
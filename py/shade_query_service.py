@@ -0,0 +1,231 @@
+"""This file serves bbox, point and top-k queries over the shade block grid from a small asyncio HTTP server.
+
+The grid is loaded once and kept in memory as a dense 2D array with the lon/lat of every cell
+center, so the index is the grid itself: a point query is one affine inversion, a bbox query is a
+window slice of the grid plus an exact filter on the cell centers, and a top-k query is a bbox
+query around the point followed by a distance filter and np.argpartition. Only matching cells are
+returned.
+
+Endpoints (all GET, all coordinates in lon/lat, responses are JSON):
+    /point?lon=77.1&lat=28.6
+    /bbox?west=77.0&south=28.5&east=77.1&north=28.6&limit=10000
+    /topk?lon=77.1&lat=28.6&radius=500&k=10      (shadiest cells within radius metres)
+    /info
+"""
+import json
+import asyncio
+import numpy as np
+from urllib.parse import urlsplit, parse_qsl
+from pyproj import Transformer
+from rasterio.crs import CRS
+from rasterio.warp import transform_bounds
+
+WGS84 = CRS.from_epsg(4326)
+METRES_PER_DEGREE = 111320.0
+
+
+class ShadeGridIndex:
+    """In-memory shade grid answering point, bbox and top-k queries in lon/lat."""
+
+    def __init__(self, grid, transform, crs):
+        self.grid = np.asarray(grid, dtype=np.float64)
+        self.transform = transform
+        self.crs = CRS.from_user_input(crs)
+        self.is_geographic = self.crs == WGS84
+
+        rows, cols = self.grid.shape
+        col_centers, row_centers = np.meshgrid(np.arange(cols) + 0.5, np.arange(rows) + 0.5)
+        x, y = transform * (col_centers, row_centers)
+        if self.is_geographic:
+            self.lon, self.lat = x, y
+        else:
+            self.lon, self.lat = Transformer.from_crs(self.crs, WGS84, always_xy=True).transform(x, y)
+            self._to_grid = Transformer.from_crs(WGS84, self.crs, always_xy=True)
+
+    @classmethod
+    def from_pyramid(cls, pyramid_file, block_size):
+        """One level of the shade pyramid written by delhi_shade_fusedata_non_overlapping."""
+        from block_pyramid import load_pyramid_level
+        fractions, transform, crs_wkt = load_pyramid_level(pyramid_file, block_size)
+        # The pyramid stores the unshaded fraction
+        return cls(1 - fractions, transform, CRS.from_wkt(crs_wkt))
+
+    @classmethod
+    def from_fused_table(cls, table_file, column='shade_fraction'):
+        """One column of the fused layer table written by layer_fusion."""
+        from layer_fusion import read_table
+        table, transform, shape, crs = read_table(table_file)
+        grid = np.full(shape, np.nan)
+        grid[table['row'].to_numpy(), table['col'].to_numpy()] = table[column].to_numpy()
+        return cls(grid, transform, crs)
+
+    @classmethod
+    def from_shade_tiles(cls, input_directory, block_size, workers=1, store=None):
+        """Reduce and mosaic the hourly shade tiles directly."""
+        from layer_fusion import shade_layer
+        shade_fractions, transform, crs, _ = shade_layer(input_directory, block_size, workers=workers, store=store)
+        return cls(shade_fractions, transform, crs)
+
+    def _grid_window(self, west, south, east, north):
+        """Row/col slices of the grid that can contain cells inside a lon/lat bbox."""
+        if not self.is_geographic:
+            west, south, east, north = transform_bounds(WGS84, self.crs, west, south, east, north)
+        inverse = ~self.transform
+        cols, rows = inverse * (np.array([west, east, west, east]), np.array([south, south, north, north]))
+        num_rows, num_cols = self.grid.shape
+        row_start = int(np.clip(np.floor(rows.min()), 0, num_rows))
+        row_stop = int(np.clip(np.ceil(rows.max()), 0, num_rows))
+        col_start = int(np.clip(np.floor(cols.min()), 0, num_cols))
+        col_stop = int(np.clip(np.ceil(cols.max()), 0, num_cols))
+        return slice(row_start, row_stop), slice(col_start, col_stop)
+
+    def _cells(self, rows, cols):
+        return [{'row': int(row), 'col': int(col),
+                 'lon': float(self.lon[row, col]), 'lat': float(self.lat[row, col]),
+                 'shade_fraction': float(self.grid[row, col])}
+                for row, col in zip(rows, cols)]
+
+    def _bbox_indices(self, west, south, east, north):
+        row_slice, col_slice = self._grid_window(west, south, east, north)
+        lon = self.lon[row_slice, col_slice]
+        lat = self.lat[row_slice, col_slice]
+        inside = ((lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+                  & ~np.isnan(self.grid[row_slice, col_slice]))
+        rows, cols = np.nonzero(inside)
+        return rows + row_slice.start, cols + col_slice.start
+
+    def point(self, lon, lat):
+        """The cell containing a point, or None outside the grid or on an empty cell."""
+        x, y = (lon, lat) if self.is_geographic else self._to_grid.transform(lon, lat)
+        col, row = ~self.transform * (x, y)
+        row, col = int(np.floor(row)), int(np.floor(col))
+        num_rows, num_cols = self.grid.shape
+        if not (0 <= row < num_rows and 0 <= col < num_cols) or np.isnan(self.grid[row, col]):
+            return None
+        return self._cells([row], [col])[0]
+
+    def bbox(self, west, south, east, north, limit=10000):
+        """Cells whose center lies inside the bbox, at most limit of them."""
+        if limit < 0:
+            raise ValueError(f"limit must not be negative, got {limit}")
+        rows, cols = self._bbox_indices(west, south, east, north)
+        return self._cells(rows[:limit], cols[:limit]), int(len(rows))
+
+    def topk(self, lon, lat, radius, k=10):
+        """The k shadiest cells whose center is within radius metres of a point, shadiest first."""
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        dlat = radius / METRES_PER_DEGREE
+        dlon = dlat / np.cos(np.radians(lat))
+        rows, cols = self._bbox_indices(lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+
+        # Equirectangular distances are accurate to well below a cell at these radii
+        dx = (self.lon[rows, cols] - lon) * METRES_PER_DEGREE * np.cos(np.radians(lat))
+        dy = (self.lat[rows, cols] - lat) * METRES_PER_DEGREE
+        near = dx * dx + dy * dy <= radius * radius
+        rows, cols = rows[near], cols[near]
+
+        values = self.grid[rows, cols]
+        if len(values) > k:
+            top = np.argpartition(-values, k - 1)[:k]
+            rows, cols, values = rows[top], cols[top], values[top]
+        order = np.argsort(-values, kind='stable')
+        return self._cells(rows[order], cols[order])
+
+    def info(self):
+        valid = ~np.isnan(self.grid)
+        bounds = None  # A grid without any data has no bounds
+        if valid.any():
+            bounds = [float(self.lon[valid].min()), float(self.lat[valid].min()),
+                      float(self.lon[valid].max()), float(self.lat[valid].max())]
+        return {
+            'shape': list(self.grid.shape),
+            'cells': int(valid.sum()),
+            'crs': self.crs.to_string(),
+            'bounds': bounds,
+        }
+
+
+def handle_query(index, path, params):
+    """Answer one request; returns (status, payload)."""
+    try:
+        if path == '/point':
+            cell = index.point(float(params['lon']), float(params['lat']))
+            return (200, {'cell': cell}) if cell is not None else (404, {'error': 'no cell at this point'})
+        if path == '/bbox':
+            cells, total = index.bbox(float(params['west']), float(params['south']), float(params['east']),
+                                      float(params['north']), int(params.get('limit', 10000)))
+            return 200, {'cells': cells, 'total': total}
+        if path == '/topk':
+            cells = index.topk(float(params['lon']), float(params['lat']), float(params.get('radius', 500)),
+                               int(params.get('k', 10)))
+            return 200, {'cells': cells}
+        if path == '/info':
+            return 200, index.info()
+    except (KeyError, ValueError) as e:
+        return 400, {'error': f"bad query parameters: {e}"}
+    return 404, {'error': f"unknown endpoint {path}"}
+
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}
+
+
+async def serve_connection(index, reader, writer):
+    """Answer HTTP/1.1 GET requests on one keep-alive connection."""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            url = urlsplit(target)
+            if method != 'GET':
+                status, payload = 400, {'error': 'only GET is supported'}
+            else:
+                status, payload = handle_query(index, url.path, dict(parse_qsl(url.query)))
+
+            body = json.dumps(payload).encode('utf-8')
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                         f"Content-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(index, host='127.0.0.1', port=8765):
+    return await asyncio.start_server(lambda reader, writer: serve_connection(index, reader, writer), host, port)
+
+
+async def serve(index, host='127.0.0.1', port=8765):
+    server = await start_server(index, host, port)
+    print(f"Serving {index.info()['cells']} shade cells on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(input_directory, block_size=10, host='127.0.0.1', port=8765):
+    index = ShadeGridIndex.from_shade_tiles(input_directory, block_size)
+    asyncio.run(serve(index, host, port))
+
+
+if __name__ == "__main__":
+    input_directory = "fusedata"
+    block_size = 10  # Block size in pixels of the served grid
+    host = "127.0.0.1"
+    port = 8765
+    main(input_directory, block_size, host, port)
@@ -0,0 +1,203 @@
+"""This file watches the shade tile directories and ingests new hourly tiles as they are dropped in.
+
+Every area (subdirectory of the input directory) keeps a RunningStats of its per-block unshaded
+fractions. A new tile is reduced, folded into the aggregate of its area, and only that area's
+output grid is rewritten, and only if any of its cells changed. Tiles go through the reduction
+cache, so a restart does not decode the tiles it has seen before. A tile that is overwritten or
+removed cannot be taken out of the running sums, so its area is rebuilt from its remaining tiles.
+
+The directories are polled with os.scandir, so no file system notification package is needed.
+A file is ingested once it has not been written to for settle_seconds, so half-copied exports are
+not read. Latency is measured from the file's ctime (when it appeared) to the moment the updated
+output is in place.
+"""
+import os
+import time
+import numpy as np
+from rasterio.errors import RasterioError
+from running_stats import RunningStats
+from delhi_shade_fusedata_non_overlapping import reduce_tile
+from grid_writer import write_block_grid
+from reduction_cache import ReductionCache
+import instrumentation
+from instrumentation import stage, count
+
+
+class _Area:
+    def __init__(self):
+        self.stats = RunningStats()
+        self.files = {}  # path -> mtime_ns of the version folded in
+        self.transform = None
+        self.crs = None
+        self.published = None  # Shade fractions of the last written output
+
+
+class ShadeWatcher:
+    """Poll input_directory/<area>/*.tiff and keep one output grid per area up to date."""
+
+    def __init__(self, input_directory, output_directory, block_size=10, output_format='grid.gz',
+                 cache=None, store=None, settle_seconds=0.5):
+        self.input_directory = input_directory
+        self.output_directory = output_directory
+        self.block_size = block_size
+        self.output_format = output_format
+        self.cache = cache
+        self.store = store
+        self.settle_seconds = settle_seconds
+        self.areas = {}
+        self.rejected = {}  # path -> mtime_ns of tiles that cannot be read or do not fit their area's grid
+        self.latencies = []
+        self.started = time.time()
+        os.makedirs(output_directory, exist_ok=True)
+
+    def output_file(self, area):
+        return os.path.join(self.output_directory, f"{area}_average_shade_bs{self.block_size}.{self.output_format}")
+
+    def scan(self):
+        """Return {area: {path: stat}} of the tiles that are settled, plus the areas that lost tiles."""
+        now = time.time()
+        ready = {}
+        shrunk = set()
+        for area_entry in os.scandir(self.input_directory):
+            if not area_entry.is_dir():
+                continue
+            area = self.areas.get(area_entry.name)
+            present = set()
+            for entry in os.scandir(area_entry.path):
+                if not entry.name.endswith('.tiff'):
+                    continue
+                present.add(entry.path)
+                stat = entry.stat()
+                known = area.files.get(entry.path) if area is not None else None
+                if stat.st_mtime_ns in (known, self.rejected.get(entry.path)):
+                    continue
+                if now - stat.st_mtime >= self.settle_seconds:
+                    ready.setdefault(area_entry.name, {})[entry.path] = stat
+            if area is not None and set(area.files) - present:
+                shrunk.add(area_entry.name)
+        return ready, shrunk
+
+    def poll(self):
+        """Ingest every settled new or changed tile; returns the number of tiles ingested."""
+        ready, shrunk = self.scan()
+        ingested = 0
+        for name in sorted(set(ready) | shrunk):
+            area = self.areas.setdefault(name, _Area())
+            tiles = ready.get(name, {})
+            with stage('watch.ingest', area=name, tiles=len(tiles)):
+                if name in shrunk or any(path in area.files for path in tiles):
+                    # Overwritten or removed tiles: fold the current tiles of the area in again
+                    current = {path: mtime_ns for path, mtime_ns in area.files.items() if os.path.exists(path)}
+                    current.update({path: stat.st_mtime_ns for path, stat in tiles.items()})
+                    area.stats = RunningStats()
+                    area.files = {}
+                    tiles_to_fold = current
+                    count('areas_rebuilt')
+                else:
+                    tiles_to_fold = {path: stat.st_mtime_ns for path, stat in tiles.items()}
+                folded = {path for path in sorted(tiles_to_fold) if self.fold(area, path, tiles_to_fold[path])}
+            changed = self.publish(name, area)
+
+            published = time.time()
+            # Rejected tiles never reached the output, so they have no latency and are not ingested
+            tiles = {path: stat for path, stat in tiles.items() if path in folded}
+            ingested += len(tiles)
+            for path, stat in tiles.items():
+                # Tiles that were there before the watcher started are catch-up, not drop latency
+                if stat.st_ctime >= self.started:
+                    self.latencies.append(published - stat.st_ctime)
+                    print(f"{os.path.relpath(path, self.input_directory)}: {changed} cells changed, "
+                          f"output up to date {published - stat.st_ctime:.2f} s after the drop")
+            if tiles and not any(stat.st_ctime >= self.started for stat in tiles.values()):
+                print(f"{name}: ingested {len(tiles)} existing tiles")
+        return ingested
+
+    def fold(self, area, path, mtime_ns):
+        """Fold one tile into its area; returns False if the tile was rejected."""
+        try:
+            fractions, _, transform, crs = reduce_tile(path, self.block_size, self.cache, self.store)
+        except (RasterioError, OSError, ValueError) as error:
+            # Unreadable or still being copied: retried once its mtime changes, skipped until then
+            print(f"Skipping {path}: {error}")
+            self.rejected[path] = mtime_ns
+            count('tiles_rejected')
+            return False
+        if area.stats.count and (fractions.shape != area.stats.total.shape or transform != area.transform):
+            print(f"Skipping {path}: its grid does not match the other tiles of the area")
+            self.rejected[path] = mtime_ns
+            count('tiles_rejected')
+            return False
+        area.stats.update(fractions)
+        area.files[path] = mtime_ns
+        self.rejected.pop(path, None)
+        area.transform, area.crs = transform, crs
+        count('tiles_ingested')
+        return True
+
+    def publish(self, name, area):
+        """Rewrite the area's output if any cell changed; returns the number of changed cells."""
+        if area.stats.count == 0:
+            # Every tile of the area is gone
+            if os.path.exists(self.output_file(name)):
+                os.remove(self.output_file(name))
+            area.published = None
+            return 0
+        shade_fractions = 1 - area.stats.mean()
+        if area.published is not None and area.published.shape == shade_fractions.shape:
+            changed = int(np.sum(~np.isclose(shade_fractions, area.published, equal_nan=True)))
+        else:
+            changed = int(np.sum(~np.isnan(shade_fractions)))
+        if changed == 0 and os.path.exists(self.output_file(name)):
+            return 0
+
+        with stage('watch.publish', area=name):
+            output_file = self.output_file(name)
+            # Written next to the output (same extension) and swapped in, so readers never see a partial file
+            tmp_file = os.path.join(self.output_directory, f".{os.getpid()}.{os.path.basename(output_file)}")
+            write_block_grid(shade_fractions, area.transform, area.crs, self.block_size, tmp_file,
+                             'avg_shade_fraction')
+            os.replace(tmp_file, output_file)
+            count('cells_changed', changed)
+        area.published = shade_fractions
+        return changed
+
+    def run(self, poll_interval=0.5, duration=None):
+        """Poll until interrupted (or for duration seconds), then print the latency summary."""
+        deadline = None if duration is None else time.monotonic() + duration
+        print(f"Watching {self.input_directory} (Ctrl+C to stop)")
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                self.poll()
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        self.report()
+
+    def report(self):
+        if self.latencies:
+            latencies = np.array(self.latencies)
+            print(f"\n{len(latencies)} dropped tiles, drop to output latency: "
+                  f"p50 {np.percentile(latencies, 50):.2f} s, max {latencies.max():.2f} s")
+        if self.cache is not None:
+            self.cache.report()
+
+
+def main(input_directory, output_directory, block_size=10, output_format='grid.gz', cache_dir=None,
+         poll_interval=0.5, trace_file=None):
+    if trace_file:
+        instrumentation.enable(trace_file)
+    cache = ReductionCache(cache_dir) if cache_dir else None
+    watcher = ShadeWatcher(input_directory, output_directory, block_size, output_format, cache)
+    watcher.run(poll_interval)
+    instrumentation.finish()
+
+
+if __name__ == "__main__":
+    input_directory = "fusedata"  # New ShadeMap exports are dropped into fusedata/<area>/
+    output_directory = "live_shade"  # One <area>_average_shade_bs<block_size> output per area
+    block_size = 10
+    output_format = "grid.gz"  # or "json" for GeoJSON
+    cache_dir = ".reduction_cache"  # Set to None to decode every tile again after a restart
+    poll_interval = 0.5  # seconds
+    trace_file = None  # Set to "trace.jsonl" for per-stage timings
+    main(input_directory, output_directory, block_size, output_format, cache_dir, poll_interval, trace_file)
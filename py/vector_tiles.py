@@ -0,0 +1,356 @@
+"""This file offers an export of the GeoJSON layers into a zoom-pyramided vector tile archive (MBTiles).
+
+Each layer is projected to Web Mercator once, then for every zoom level it is simplified to
+the size of one tile unit (per-zoom generalization), cut into tiles with an STRtree lookup and
+a vectorized clip, and encoded as Mapbox Vector Tiles (MVT). The gzipped tiles are stored in a
+single MBTiles SQLite file, so a map only has to fetch the tiles in view.
+
+The MVT protobuf encoding is written out by hand (it only needs varints and length-delimited
+fields), which keeps the exporter free of extra dependencies.
+"""
+import os
+import gzip
+import json
+import math
+import time
+import sqlite3
+import struct
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+EXTENT = 4096  # Tile units per tile side, the MVT default
+BUFFER = 64  # Tile units of geometry kept outside each tile edge to avoid seams
+MERCATOR_HALF_WORLD = 20037508.342789244
+
+# MVT geometry commands
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+POLYGON = 3
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _field_varint(field, value):
+    return _key(field, 0) + _varint(value)
+
+
+def _field_bytes(field, payload):
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _field_packed(field, values):
+    return _field_bytes(field, b''.join(_varint(int(v)) for v in values))
+
+
+def _zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return (values << 1) ^ (values >> 63)
+
+
+def _encode_value(value):
+    """Encode a property value as an MVT Value message."""
+    if isinstance(value, (bool, np.bool_)):
+        return _field_varint(7, int(value))
+    if isinstance(value, (int, np.integer)):
+        return _field_varint(6, int(_zigzag([value])[0]))
+    if isinstance(value, (float, np.floating)):
+        return _key(3, 1) + struct.pack('<d', float(value))
+    return _field_bytes(1, str(value).encode('utf-8'))
+
+
+def _field_type(dtype):
+    """TileJSON vector_layers type of a property column, matching how _encode_value encodes it."""
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'Boolean'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'Number'
+    return 'String'
+
+
+def _encode_ring(ring, exterior, cursor):
+    """Encode one closed ring in tile units as MoveTo/LineTo/ClosePath commands.
+
+    Returns (commands, cursor) or (None, cursor) if the ring collapsed after quantization.
+    Exterior rings are wound clockwise in tile space (y down) and holes counter-clockwise.
+    """
+    ring = ring[:-1]  # ClosePath replaces the repeated first point
+    if len(ring) == 0:
+        return None, cursor
+
+    # Drop consecutive duplicates that appear after snapping to integer tile units
+    keep = np.ones(len(ring), dtype=bool)
+    keep[1:] = np.any(ring[1:] != ring[:-1], axis=1)
+    ring = ring[keep]
+    if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+        ring = ring[:-1]
+    if len(ring) < 3:
+        return None, cursor
+
+    x, y = ring[:, 0], ring[:, 1]
+    doubled_area = np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)
+    if doubled_area == 0:
+        return None, cursor
+    if (doubled_area > 0) != exterior:
+        ring = ring[::-1]
+
+    deltas = np.diff(np.vstack([cursor, ring]), axis=0)
+    params = _zigzag(deltas).ravel()
+    commands = ([MOVE_TO | (1 << 3)] + params[:2].tolist()
+                + [LINE_TO | ((len(ring) - 1) << 3)] + params[2:].tolist()
+                + [CLOSE_PATH | (1 << 3)])
+    return commands, ring[-1]
+
+
+def _polygon_parts(geoms):
+    """Return (coords, ring_offsets, polygon_offsets, geometry_offsets) for polygonal geometries."""
+    geom_type, coords, offsets = shapely.to_ragged_array(geoms)
+    if geom_type == shapely.GeometryType.POLYGON:
+        ring_offsets, geometry_offsets = offsets
+        polygon_offsets = np.arange(len(geometry_offsets))
+        return coords, ring_offsets, polygon_offsets, polygon_offsets
+    ring_offsets, polygon_offsets, geometry_offsets = offsets
+    return coords, ring_offsets, polygon_offsets, geometry_offsets
+
+
+def encode_layer(name, geoms, properties, extent=EXTENT):
+    """Encode polygonal geometries already in integer tile units as one MVT layer.
+
+    properties is a list of column names and a matching list of per-feature value lists.
+    """
+    columns, rows = properties
+    keys = {}
+    values = {}
+    features = []
+
+    coords, ring_offsets, polygon_offsets, geometry_offsets = _polygon_parts(geoms)
+    coords = coords.astype(np.int64)
+
+    for g in range(len(geometry_offsets) - 1):
+        cursor = np.zeros(2, dtype=np.int64)
+        geometry = []
+        for p in range(geometry_offsets[g], geometry_offsets[g + 1]):
+            for r in range(polygon_offsets[p], polygon_offsets[p + 1]):
+                exterior = r == polygon_offsets[p]
+                ring = coords[ring_offsets[r]:ring_offsets[r + 1]]
+                commands, cursor = _encode_ring(ring, exterior, cursor)
+                if commands is None:
+                    if exterior:
+                        break  # The whole polygon collapsed, its holes go with it
+                    continue
+                geometry.extend(commands)
+        if not geometry:
+            continue
+
+        tags = []
+        for column, value in zip(columns, rows[g]):
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            tags.append(keys.setdefault(column, len(keys)))
+            tags.append(values.setdefault(_encode_value(value), len(values)))
+
+        feature = _field_packed(2, tags) + _field_varint(3, POLYGON) + _field_packed(4, geometry)
+        features.append(_field_bytes(2, feature))
+
+    if not features:
+        return None
+
+    layer = _field_varint(15, 2) + _field_bytes(1, name.encode('utf-8')) + b''.join(features)
+    layer += b''.join(_field_bytes(3, key.encode('utf-8')) for key in keys)
+    layer += b''.join(_field_bytes(4, value) for value in values)
+    layer += _field_varint(5, extent)
+    return _field_bytes(3, layer)
+
+
+def tile_size(zoom):
+    """Side length of a tile in Web Mercator meters."""
+    return 2 * MERCATOR_HALF_WORLD / (1 << zoom)
+
+
+def tile_range(bounds, zoom):
+    """Inclusive (x_min, y_min, x_max, y_max) tile indices covering Web Mercator bounds."""
+    size = tile_size(zoom)
+    last = (1 << zoom) - 1
+    x_min = min(max(int((bounds[0] + MERCATOR_HALF_WORLD) // size), 0), last)
+    x_max = min(max(int((bounds[2] + MERCATOR_HALF_WORLD) // size), 0), last)
+    y_min = min(max(int((MERCATOR_HALF_WORLD - bounds[3]) // size), 0), last)
+    y_max = min(max(int((MERCATOR_HALF_WORLD - bounds[1]) // size), 0), last)
+    return x_min, y_min, x_max, y_max
+
+
+def load_layer(geojson_file):
+    """Read a GeoJSON layer and project it to Web Mercator."""
+    # from_features closes unclosed rings (e.g. the raw H3 boundaries of the housing layer),
+    # which GDAL's reader rejects
+    with open(geojson_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    gdf = gpd.GeoDataFrame.from_features(data['features'], crs='EPSG:4326').to_crs(epsg=3857)
+    if not np.isin(shapely.get_type_id(gdf.geometry.values), [3, 6]).all():
+        raise ValueError(f"Only polygon layers can be tiled, {geojson_file} contains other geometry types")
+    return gdf
+
+
+def build_tiles(layers, minzoom, maxzoom):
+    """Yield (zoom, x, y, gzipped MVT bytes) for every non-empty tile of the given layers.
+
+    layers maps a layer name to a Web Mercator GeoDataFrame.
+    """
+    for zoom in range(minzoom, maxzoom + 1):
+        size = tile_size(zoom)
+        unit = size / EXTENT
+        zoom_layers = []
+        for name, gdf in layers.items():
+            # Generalize to one tile unit so low zooms do not carry invisible detail
+            geoms = shapely.simplify(gdf.geometry.values, unit, preserve_topology=True)
+            columns = [column for column in gdf.columns if column != gdf.geometry.name]
+            rows = gdf[columns].to_numpy(dtype=object).tolist()
+            zoom_layers.append((name, geoms, shapely.STRtree(geoms), columns, rows))
+
+        bounds = np.array([shapely.total_bounds(geoms) for _, geoms, _, _, _ in zoom_layers])
+        x_min, y_min, x_max, y_max = tile_range(
+            (bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()), zoom)
+
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                left = -MERCATOR_HALF_WORLD + x * size
+                top = MERCATOR_HALF_WORLD - y * size
+                pad = BUFFER * unit
+                clip_box = (left - pad, top - size - pad, left + size + pad, top + pad)
+
+                encoded_layers = []
+                for name, geoms, tree, columns, rows in zoom_layers:
+                    indices = tree.query(shapely.box(*clip_box), predicate='intersects')
+                    if len(indices) == 0:
+                        continue
+                    indices.sort()
+                    clipped = shapely.clip_by_rect(geoms[indices], *clip_box)
+                    keep = np.isin(shapely.get_type_id(clipped), [3, 6]) & ~shapely.is_empty(clipped)
+                    if not keep.any():
+                        continue
+                    clipped = clipped[keep]
+                    indices = indices[keep]
+
+                    # Web Mercator meters -> integer tile units (y down)
+                    clipped = shapely.transform(clipped, lambda c: np.round(
+                        np.column_stack([(c[:, 0] - left) / unit, (top - c[:, 1]) / unit])))
+                    encoded = encode_layer(name, clipped, (columns, [rows[i] for i in indices]))
+                    if encoded is not None:
+                        encoded_layers.append(encoded)
+
+                if encoded_layers:
+                    yield zoom, x, y, gzip.compress(b''.join(encoded_layers))
+
+
+def write_mbtiles(output_file, tiles, metadata):
+    """Write (zoom, x, y, data) tiles and a metadata dict into an MBTiles SQLite file."""
+    if os.path.exists(output_file):
+        os.remove(output_file)
+
+    connection = sqlite3.connect(output_file)
+    try:
+        connection.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        connection.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, "
+                           "tile_row INTEGER, tile_data BLOB)")
+        connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+
+        count = 0
+        for zoom, x, y, data in tiles:
+            # MBTiles rows follow the TMS scheme, i.e. counted from the south
+            connection.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                               (zoom, x, (1 << zoom) - 1 - y, sqlite3.Binary(data)))
+            count += 1
+
+        connection.executemany("INSERT INTO metadata VALUES (?, ?)",
+                               [(name, str(value)) for name, value in metadata.items()])
+        connection.commit()
+    finally:
+        connection.close()
+    return count
+
+
+def export_vector_tiles(layer_files, output_file, minzoom=10, maxzoom=15):
+    """Export GeoJSON layers ({layer name: path}) into an MBTiles vector tile archive.
+
+    Returns the number of tiles written.
+    """
+    layers = {name: load_layer(path) for name, path in layer_files.items()}
+
+    lonlat_bounds = np.array([gdf.to_crs(epsg=4326).total_bounds for gdf in layers.values()])
+    west, south = lonlat_bounds[:, 0].min(), lonlat_bounds[:, 1].min()
+    east, north = lonlat_bounds[:, 2].max(), lonlat_bounds[:, 3].max()
+
+    vector_layers = [{
+        'id': name,
+        'fields': {column: _field_type(dtype) for column, dtype in gdf.dtypes.items() if column != gdf.geometry.name},
+        'minzoom': minzoom,
+        'maxzoom': maxzoom,
+    } for name, gdf in layers.items()]
+
+    metadata = {
+        'name': os.path.splitext(os.path.basename(output_file))[0],
+        'format': 'pbf',
+        'type': 'overlay',
+        'version': '1',
+        'minzoom': minzoom,
+        'maxzoom': maxzoom,
+        'bounds': f"{west},{south},{east},{north}",
+        'center': f"{(west + east) / 2},{(south + north) / 2},{minzoom}",
+        'json': json.dumps({'vector_layers': vector_layers}),
+    }
+
+    return write_mbtiles(output_file, build_tiles(layers, minzoom, maxzoom), metadata)
+
+
+def print_size_report(layer_files, output_file, num_tiles, elapsed):
+    """Compare the archive with the JSON payloads the frontend bundles today."""
+    print("\nJSON payloads:")
+    json_total = 0
+    for name, path in layer_files.items():
+        size = os.path.getsize(path)
+        json_total += size
+        print(f"  {name:<12} {size / 1e6:>8.2f} MB  ({path})")
+    print(f"  {'total':<12} {json_total / 1e6:>8.2f} MB")
+
+    connection = sqlite3.connect(output_file)
+    try:
+        tile_sizes = [row[0] for row in connection.execute("SELECT length(tile_data) FROM tiles")]
+        per_zoom = connection.execute(
+            "SELECT zoom_level, count(*), sum(length(tile_data)) FROM tiles GROUP BY zoom_level").fetchall()
+    finally:
+        connection.close()
+
+    print(f"\nVector tile archive: {output_file}")
+    print(f"  file size        {os.path.getsize(output_file) / 1e6:>8.2f} MB")
+    print(f"  tiles            {num_tiles:>8}")
+    print(f"  mean tile (gzip) {np.mean(tile_sizes) / 1e3:>8.1f} kB")
+    print(f"  max tile (gzip)  {np.max(tile_sizes) / 1e3:>8.1f} kB")
+    for zoom, count, total in per_zoom:
+        print(f"  zoom {zoom:>2}: {count:>5} tiles, {total / 1e6:>6.2f} MB")
+    print(f"  export time      {elapsed:>8.1f} s")
+
+
+if __name__ == "__main__":
+    # The layers the Svelte map currently imports as whole JSON files
+    layer_files = {
+        'shade': "../src/assets/data/lower_left_average_shade_bs10.json",  # create_geojson output
+        'temperature': "../src/assets/data/temp_clustersize_8.json",  # convert_geotiff output (LST)
+        'water': "../src/assets/data/output.json",  # convert_geotiff output (NDVI/NDBI)
+        'housing': "../src/assets/data/delhi_housing_hexbins.json",  # delhi_housing_prices output
+    }
+    output_file = "delhi_layers.mbtiles"
+    minzoom, maxzoom = 10, 15  # Adjust to the zoom range the map should serve
+
+    start = time.perf_counter()
+    num_tiles = export_vector_tiles(layer_files, output_file, minzoom, maxzoom)
+    print_size_report(layer_files, output_file, num_tiles, time.perf_counter() - start)
@@ -1,20 +1,22 @@
 import folium
 from branca.colormap import LinearColormap
+from folium.utilities import mercator_transform
+import matplotlib.pyplot as plt
+import numpy as np
 import json
 import os
+import glob
 
 def plot_multi_sector_heatmap(input_directory, output_file='combined_heatmap.html'):
-    # List of sector names
-    sectors = ['upper_left', 'upper_right', 'lower_left', 'lower_right']
+    # Shade GeoJSON files: the mosaicked average_shade.json or older per-sector <sector>_average_shade.json
+    geojson_files = sorted(glob.glob(os.path.join(input_directory, "*average_shade.json")))
 
     # Initialize variables to calculate map center
     total_lat, total_lon, total_coords = 0, 0, 0
     all_features = []
 
-    # Process each sector
-    for sector in sectors:
-        geojson_file = os.path.join(input_directory, f"{sector}_average_shade.json")
-
+    # Process each file
+    for geojson_file in geojson_files:
         # Load GeoJSON file
         with open(geojson_file, 'r') as f:
             data = json.load(f)
@@ -58,6 +60,74 @@ def plot_multi_sector_heatmap(input_directory, output_file='combined_heatmap.htm
     m.save(output_file)
     print(f"Combined heatmap saved as {output_file}")
 
+def colorize(values, colormap):
+    """RGBA uint8 image of a 2D grid through a LinearColormap; NaN cells are fully transparent."""
+    stops = np.asarray(colormap.index, dtype=np.float64)
+    colors = np.asarray(colormap.colors, dtype=np.float64)  # RGBA floats in [0, 1]
+    clipped = np.clip(values, stops[0], stops[-1])
+
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    for channel in range(4):
+        rgba[..., channel] = np.round(np.interp(clipped, stops, colors[:, channel]) * 255)
+    rgba[np.isnan(values)] = 0
+    return rgba
+
+def plot_grid_heatmap(values, transform, output_file='combined_heatmap.html', image_file=None, opacity=0.7):
+    """Render an EPSG:4326 block grid as one colored PNG overlay instead of a polygon per cell.
+
+    The PNG is written next to the HTML and linked, so the HTML stays a few KB regardless of the
+    number of cells (pass image_file=False to embed the PNG in the HTML as a single file instead).
+    The map center comes from the grid bounds.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rows, cols = values.shape
+    # North-up, west-to-east pixel order for the image
+    if transform.e > 0:
+        values = values[::-1]
+    if transform.a < 0:
+        values = values[:, ::-1]
+
+    west, north = transform * (0, 0)
+    east, south = transform * (cols, rows)
+    west, east = min(west, east), max(west, east)
+    south, north = min(south, north), max(south, north)
+
+    colormap = LinearColormap(colors=['blue', 'green', 'yellow', 'red'], vmin=0, vmax=1)
+    # The grid rows are evenly spaced in latitude, the map is Web Mercator
+    rgba = mercator_transform(colorize(values, colormap), (south, north)).astype(np.uint8)
+
+    m = folium.Map(location=[(south + north) / 2, (west + east) / 2], zoom_start=13)
+    bounds = [[south, west], [north, east]]
+    if image_file is False:
+        folium.raster_layers.ImageOverlay(rgba, bounds=bounds, opacity=opacity).add_to(m)
+    else:
+        if image_file is None:
+            image_file = os.path.splitext(output_file)[0] + '.png'
+        plt.imsave(image_file, rgba)
+        overlay = folium.raster_layers.ImageOverlay(np.zeros((1, 1, 4), dtype=np.uint8), bounds=bounds,
+                                                    opacity=opacity)
+        # Link the PNG by its path relative to the HTML instead of embedding it
+        overlay.url = os.path.relpath(image_file, os.path.dirname(os.path.abspath(output_file)))
+        overlay.add_to(m)
+
+    colormap.add_to(m)
+    m.save(output_file)
+    print(f"Combined heatmap saved as {output_file}")
+
+def plot_shade_grid_heatmap(input_directory, block_size=10, output_file='combined_heatmap.html', image_file=None):
+    """Reduce and mosaic the shade tiles and render the average shade fraction as an image overlay."""
+    from layer_fusion import shade_layer
+    shade_fractions, transform, crs, _ = shade_layer(input_directory, block_size)
+    if crs is not None and crs.to_epsg() != 4326:
+        raise ValueError(f"The image overlay needs an EPSG:4326 grid, got {crs}")
+    plot_grid_heatmap(shade_fractions, transform, output_file, image_file)
+
 if __name__ == "__main__":
-    input_directory = ""  # Replace with the directory containing your sector GeoJSON files
-    plot_multi_sector_heatmap(input_directory)
+    render_mode = "geojson"  # "geojson" draws every cell as a polygon, "image" draws one PNG overlay
+    if render_mode == "image":
+        input_directory = "fusedata"  # Directory with the hourly shade tiles
+        block_size = 10
+        plot_shade_grid_heatmap(input_directory, block_size)
+    else:
+        input_directory = ""  # Replace with the directory containing your sector GeoJSON files
+        plot_multi_sector_heatmap(input_directory)
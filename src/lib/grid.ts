@@ -0,0 +1,129 @@
+// Decoder for the binary block grids written by py/grid_writer.py (.grid, .grid.gz).
+// A grid is a small JSON header plus one packed value per cell, so it is drawn as an image
+// source instead of one GeoJSON polygon per cell.
+
+export interface GridHeader {
+    rows: number;
+    cols: number;
+    origin: [number, number];
+    cell_size: [number, number];
+    crs: string | null;
+    property: string;
+    dtype: 'uint8' | 'float16';
+    offset?: number;
+    scale?: number;
+    nodata?: number;
+    // top left, top right, bottom right, bottom left in lon/lat
+    corners: [[number, number], [number, number], [number, number], [number, number]];
+}
+
+export interface Grid {
+    header: GridHeader;
+    // Cell values row by row from the top, NaN where there is no data
+    values: Float32Array;
+}
+
+const MAGIC = 'SGRD';
+const VERSION = 1;
+
+async function gunzip(buffer: ArrayBuffer): Promise<ArrayBuffer> {
+    const stream = new Blob([buffer]).stream().pipeThrough(new DecompressionStream('gzip'));
+    return new Response(stream).arrayBuffer();
+}
+
+function halfToFloat(bits: number): number {
+    const sign = bits & 0x8000 ? -1 : 1;
+    const exponent = (bits >> 10) & 0x1f;
+    const fraction = bits & 0x3ff;
+    if (exponent === 0) {
+        return sign * 2 ** -14 * (fraction / 1024);
+    }
+    if (exponent === 0x1f) {
+        return fraction ? NaN : sign * Infinity;
+    }
+    return sign * 2 ** (exponent - 15) * (1 + fraction / 1024);
+}
+
+export async function decodeGrid(buffer: ArrayBuffer): Promise<Grid> {
+    let bytes = new Uint8Array(buffer);
+    // .grid.gz files served without Content-Encoding arrive still compressed
+    if (bytes[0] === 0x1f && bytes[1] === 0x8b) {
+        buffer = await gunzip(buffer);
+        bytes = new Uint8Array(buffer);
+    }
+    const view = new DataView(buffer);
+    if (String.fromCharCode(...bytes.subarray(0, 4)) !== MAGIC || view.getUint8(4) !== VERSION) {
+        throw new Error('Not a version 1 binary grid (.grid.br files must be served with Content-Encoding: br)');
+    }
+
+    const dtypeCode = view.getUint8(5);
+    const headerLength = view.getUint32(8, true);
+    const header: GridHeader = JSON.parse(new TextDecoder().decode(bytes.subarray(12, 12 + headerLength)));
+    const start = 12 + headerLength;
+    const size = header.rows * header.cols;
+    const values = new Float32Array(size);
+
+    if (dtypeCode === 1) {
+        const codes = bytes.subarray(start, start + size);
+        const {offset = 0, scale = 1, nodata = 255} = header;
+        for (let i = 0; i < size; i++) {
+            values[i] = codes[i] === nodata ? NaN : offset + codes[i] * scale;
+        }
+    } else if (dtypeCode === 2) {
+        // The writer pads the header so the values start 8-byte aligned
+        const halves = new Uint16Array(buffer, start, size);
+        for (let i = 0; i < size; i++) {
+            values[i] = halfToFloat(halves[i]);
+        }
+    } else {
+        throw new Error(`Unknown grid value type ${dtypeCode}`);
+    }
+    return {header, values};
+}
+
+export async function fetchGrid(url: string): Promise<Grid> {
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error(`Could not load ${url}: ${response.status}`);
+    }
+    return decodeGrid(await response.arrayBuffer());
+}
+
+// [value, '#rrggbb'] pairs in increasing value order, like a Mapbox 'interpolate' expression
+export type ColorStops = [number, string][];
+
+function parseColor(color: string): [number, number, number] {
+    const hex = parseInt(color.slice(1), 16);
+    return [(hex >> 16) & 0xff, (hex >> 8) & 0xff, hex & 0xff];
+}
+
+// Draw a grid into a canvas with one pixel per cell, colors linearly interpolated between the
+// stops and no-data cells transparent. Use it as a Mapbox 'canvas' source at header.corners.
+export function gridToCanvas(grid: Grid, stops: ColorStops): HTMLCanvasElement {
+    const {rows, cols} = grid.header;
+    const canvas = document.createElement('canvas');
+    canvas.width = cols;
+    canvas.height = rows;
+    const context = canvas.getContext('2d')!;
+    const image = context.createImageData(cols, rows);
+    const colors = stops.map(([, color]) => parseColor(color));
+
+    grid.values.forEach((value, i) => {
+        if (Number.isNaN(value)) {
+            return;
+        }
+        let upper = stops.findIndex(([stop]) => stop >= value);
+        if (upper === -1) {
+            upper = stops.length - 1;
+        }
+        const lower = Math.max(upper - 1, 0);
+        const span = stops[upper][0] - stops[lower][0];
+        const t = span > 0 ? Math.min(Math.max((value - stops[lower][0]) / span, 0), 1) : 1;
+        for (let channel = 0; channel < 3; channel++) {
+            image.data[4 * i + channel] = colors[lower][channel] + t * (colors[upper][channel] - colors[lower][channel]);
+        }
+        image.data[4 * i + 3] = 255;
+    });
+    context.putImageData(image, 0, 0);
+    return canvas;
+}